@@ -1,15 +1,26 @@
 import asyncio
+import json
 import logging
 import uvicorn
 import websockets
 import yaml
-import os
 import numpy as np
-import resampy
+import os
+import socket
+import time
+import urllib.parse
+import uuid
+from collections import deque
 from fastapi import FastAPI, HTTPException
 from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 
 from recorder import Recorder
+from codec import create_encoder
+from resampler import StreamingResampler
+from spool import Spool, upload_backlog, MAX_GAP_SECONDS
+from edge_vad import EdgeVad
+from protocol import hello_message, pack_frame, SAMPLE_RATE
 from log import init_log
 
 init_log()
@@ -32,19 +43,74 @@ def load_config():
 class WebsocketManager:
     """
     管理与 VAD 服务器的 WebSocket 连接。
-    包括自动重连机制。
+    包括自动重连机制。录音由采集任务持续进行，音频编码成带帧头的消息放入发送队列：连接正常时实时发送，
+    短暂断线时保留在队列中，重连后服务器恢复同一个会话，从它已收到的采样位置继续发送；
+    断线时间超过 resume_seconds 时放弃恢复，（启用 spool 时）改为写入本地缓存，恢复连接后再补传。
+    服务器通过 ack 确认已处理的消息，并在处理变慢时发送流控信号：slow 时合并成更大的帧发送，
+    overloaded 或未确认的音频超过 max_inflight_seconds 时暂停实时发送，改为写入本地缓存，服务器恢复后补传。
     """
     def __init__(self):
         self.is_running = False  # 标记是否应该保持运行（包括重连）
         self._manage_task: asyncio.Task = None  # 连接管理任务
+        self._capture_task: asyncio.Task = None  # 采集与发送任务
+        self._upload_task: asyncio.Task = None  # 缓存补传任务
         self.server_url = ""
         self.recorder = None
-        self.MAX_RECONNECT_ATTEMPTS = 3
+        self.MAX_RECONNECT_ATTEMPTS = 3  # 未启用 spool 时的最大重连次数
         self.RECONNECT_INTERVAL = 5  # seconds
+        self.MAX_RECONNECT_INTERVAL = 60  # 启用 spool 时无限重连，间隔按指数退避，最长 60 秒
+        self.UPLOAD_RETRY_INTERVAL = 30  # 补传失败后重试的间隔
+        self.WELCOME_TIMEOUT = 10  # 等待服务器回复 welcome 的时间
+        self.codec = "pcm"  # 上行音频编码，服务器不支持时回退到 pcm
+        self.device_id: str = None  # 采集设备 ID，服务器按设备区分记录，默认为主机名
+        self.spool: Spool = None  # 断线期间的本地缓存，未启用时为 None
+        self._websocket = None  # 当前的连接，断开时为 None
+        self._encoder = None
+        self._reconnect_attempts = 0
+        self.edge_vad: EdgeVad = None  # 边缘 VAD，启用时只发送候选语音窗口
+        self._last_sent = 0.0  # 上一次发送消息的时间 (monotonic)，用于静音期间的心跳
+        self.keepalive_seconds = 10
+
+        # 流会话：采样位置从会话的第 0 个采样开始计数，服务器据此推算记录的时间戳
+        self.resume_samples = 60 * SAMPLE_RATE  # 断线后保留未发送音频的时长，超过后放弃恢复会话
+        self.resend_samples = 10 * SAMPLE_RATE  # 已发送的消息保留的时长，连接意外断开时可能未送达，重连后补发
+        self._session_id: uuid.UUID = None
+        self._epoch = 0.0  # 第 0 个采样的采集时间 (Unix 时间戳)
+        self._sample_index = 0  # 下一个采集的采样位置
+        self._sequence = 0  # 下一条消息的序号
+        self._encode_pos = 0  # 编码器输出的下一条消息的第一个采样位置
+        self._encode_next = 0  # 编码器中最后一个采样之后的位置，用于发现不连续的音频
+        self._window_pos = 0  # 边缘 VAD 当前窗口中下一段音频的采样位置
+        self._outbox: deque = deque()  # (序号, 起始采样位置, 结束采样位置, 消息)，按序号排列
+        self._send_seq = 0  # 下一条要发送的消息序号
+        self._send_lock = asyncio.Lock()
+        self._resumable = True  # 断线期间音频是否仍放入发送队列，False 时写入本地缓存
+        self._disconnected_at = 0  # 连接断开时的采样位置
+        self._offline: list = []  # 断线期间的原始音频 (采样, 采集时间)，放弃恢复时转存到本地缓存
+
+        # 流控
+        self.coalesce_samples = SAMPLE_RATE // 2  # 服务器处理变慢时，攒够这么多采样再编码成一条消息
+        self.max_inflight_samples = 5 * SAMPLE_RATE  # 已发送但服务器尚未确认的音频上限，超过时暂停实时发送
+        self.flow_state = "ok"  # 服务器最近一次发送的流控状态
+        self._deferring = False  # 是否暂停了实时发送，音频写入本地缓存
+        self._staged: list = []  # 等待合并编码的音频块
+        self._staged_index = 0
+        self._staged_samples = 0
+        self._sent_sample = 0  # 已发送的音频的结束位置
+        self._acked_sample = 0  # 服务器已处理到的采样位置
+        self._acked_seq = -1
+        self.server_lag_ms = None  # 服务器报告的从采集到处理完成的延迟
+        self.server_rtf = None  # 服务器报告的处理耗时与音频时长之比
+        self.segments_detected = 0
+        self.last_transcription: dict = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._websocket is not None
 
     async def connect(self, recorder: Recorder, server_url: str):
         """
-        启动连接管理任务。
+        启动录音和连接管理任务。
         :param recorder: 录音机实例
         :param server_url: VAD 服务器的 WebSocket URL
         """
@@ -54,118 +120,449 @@ class WebsocketManager:
         
         self.recorder = recorder
         self.server_url = server_url
+        self.codec = config.get("codec", {}).get("type", "pcm")
+        self.device_id = config.get("device_id") or socket.gethostname()
+        spool_config = config.get("spool", {})
+        if spool_config.get("enabled", False) and self.spool is None:
+            self.spool = Spool(
+                spool_config.get("directory") or os.path.join(os.path.dirname(__file__), "spool"),
+                max_bytes=spool_config.get("max_mb", 1024) * 1024 * 1024,
+                segment_seconds=spool_config.get("segment_seconds", 60),
+                codec=spool_config.get("codec", "flac"),
+                codec_config=config.get("codec", {}).get(spool_config.get("codec", "flac")),
+            )
+        edge_vad_config = dict(config.get("edge_vad", {}))
+        self.edge_vad = None
+        if edge_vad_config.pop("enabled", False):
+            self.keepalive_seconds = edge_vad_config.pop("keepalive_seconds", 10)
+            self.edge_vad = EdgeVad(**edge_vad_config)
+        stream_config = config.get("stream", {})
+        self.resume_samples = int(stream_config.get("resume_seconds", 60) * SAMPLE_RATE)
+        self.resend_samples = int(stream_config.get("resend_seconds", 10) * SAMPLE_RATE)
+        self.coalesce_samples = int(stream_config.get("coalesce_ms", 500) * SAMPLE_RATE / 1000)
+        self.max_inflight_samples = int(stream_config.get("max_inflight_seconds", 5) * SAMPLE_RATE)
+        # 第一块音频到达时开始新的会话
+        self._session_id = None
+        self._resumable = True
         self.is_running = True
         
-        # 启动后台管理任务
+        # 启动后台任务
+        self._capture_task = asyncio.create_task(self._capture_and_send())
         self._manage_task = asyncio.create_task(self._manage_connection())
         logger.info(f"已启动连接管理任务，目标服务器: {server_url}")
 
+    def _start_session(self, epoch: float):
+        """开始一个新的流会话，之前未发送的消息全部丢弃。"""
+        self._session_id = uuid.uuid4()
+        self._epoch = epoch
+        self._sample_index = 0
+        self._sequence = 0
+        self._encode_pos = self._encode_next = self._window_pos = 0
+        self._outbox.clear()
+        self._send_seq = 0
+        self._disconnected_at = 0
+        self._offline.clear()
+        self._staged.clear()
+        self._staged_samples = 0
+        self._sent_sample = self._acked_sample = 0
+        self._acked_seq = -1
+        self._encoder = create_encoder(self.codec, config.get("codec", {}).get(self.codec))
+        if self.edge_vad is not None:
+            self.edge_vad.reset()
+        logger.info(f"开始流会话 {self._session_id}")
+
+    async def _abandon_session(self):
+        """断线太久，服务器上的会话已经过期：断线期间的音频转存到本地缓存，重连后开始新的会话。"""
+        logger.warning(f"断线超过 {self.resume_samples / SAMPLE_RATE:.0f} 秒，放弃恢复流会话 {self._session_id}")
+        if self.spool is not None:
+            for samples, captured_at in self._offline:
+                await self.spool.append(samples, captured_at)
+        self._resumable = False
+        # 新会话的时间线接着旧会话
+        self._start_session(self._epoch + self._sample_index / SAMPLE_RATE)
+
     async def _manage_connection(self):
         """
         后台任务：管理连接生命周期，处理连接建立和自动重连。
         """
-        reconnect_attempts = 0
+        self._reconnect_attempts = 0
 
         while self.is_running:
             try:
-                # 尝试建立连接并运行发送循环
                 # 如果是重连，先等待一段时间
-                if reconnect_attempts > 0:
-                     logger.info(f"将在 {self.RECONNECT_INTERVAL} 秒后尝试第 {reconnect_attempts}/{self.MAX_RECONNECT_ATTEMPTS} 次重连...")
-                     await asyncio.sleep(self.RECONNECT_INTERVAL)
+                if self._reconnect_attempts > 0:
+                    if self.spool is not None:
+                        interval = min(self.RECONNECT_INTERVAL * 2 ** (self._reconnect_attempts - 1), self.MAX_RECONNECT_INTERVAL)
+                        logger.info(f"将在 {interval} 秒后尝试第 {self._reconnect_attempts} 次重连，期间音频暂存在本地...")
+                    else:
+                        interval = self.RECONNECT_INTERVAL
+                        logger.info(f"将在 {interval} 秒后尝试第 {self._reconnect_attempts}/{self.MAX_RECONNECT_ATTEMPTS} 次重连...")
+                    await asyncio.sleep(interval)
 
                 logger.info("正在尝试连接 VAD 服务器...")
-                await self._connect_and_run_sender()
-                
-                # 如果 _connect_and_run_sender 正常返回，说明是用户主动断开（is_running变为False）
-                # 或者连接意外断开但没抛出异常（这取决于实现，目前的实现会抛出异常）
-                # 这里我们假设正常返回意味着不需要重连
-                reconnect_attempts = 0 # 重置计数器
+                await self._run_connection()
 
             except Exception as e:
                 logger.error(f"连接或发送过程中发生错误: {e}")
                 # 检查是否应该重连
                 if self.is_running:
-                    reconnect_attempts += 1
-                    if reconnect_attempts > self.MAX_RECONNECT_ATTEMPTS:
+                    self._reconnect_attempts += 1
+                    if self.spool is None and self._reconnect_attempts > self.MAX_RECONNECT_ATTEMPTS:
                         logger.error("达到最大重连次数，停止尝试。")
                         self.is_running = False
+                        self._capture_task.cancel()
                         break
                 else:
                     # 如果用户已经请求停止，就不再重连
                     break
 
-    async def _connect_and_run_sender(self):
+    async def _run_connection(self):
         """
-        建立单次 WebSocket 连接并运行发送循环。
-        如果连接断开或发生错误，会抛出异常以便上层捕获并触发重连。
+        建立单次 WebSocket 连接，握手后补发服务器尚未收到的消息，并等待连接断开。
+        之后的音频由采集任务放入发送队列并发送。
+        连接断开时抛出异常以便上层捕获并触发重连。
         """
+        while self._session_id is None:
+            # 等待采集任务取得第一块音频并开始会话
+            await asyncio.sleep(0.1)
+        codec = self._encoder.codec
+        # 通过查询参数告知服务器上行编码和设备
+        separator = "&" if "?" in self.server_url else "?"
+        url = f"{self.server_url}{separator}{urllib.parse.urlencode({'codec': codec, 'device_id': self.device_id})}"
+
         try:
-            async with websockets.connect(self.server_url) as websocket:
-                logger.info(f"已连接到 VAD 服务器: {self.server_url}")
-                
-                # 连接成功，重置重连计数器的逻辑在上层
-                
-                # 启动录音
-                try:
-                    self.recorder.start()
-                except Exception as e:
-                    logger.error(f"录音机启动失败: {e}")
-                    raise # 抛出异常，触发重连逻辑（或者如果是硬件错误，可能需要停止重连？）
+            async with websockets.connect(url) as websocket:
+                logger.info(f"已连接到 VAD 服务器: {url}")
+                welcome = await self._handshake(websocket)
+                if welcome is not None:
+                    self._reconnect_attempts = 0
+                    self._resume(welcome)
 
-                try:
-                    target_samplerate = config.get("recorder", {}).get("target_samplerate", 16000)
-                    
-                    while self.is_running:
-                        try:
-                            # 设置超时，如果录音机队列长时间为空，不应该阻塞所有操作
-                            # 这里使用 wait_for 并捕获 TimeoutError 也可以，
-                            # 但为了简单，我们假设 recorder.q.get() 总是能在合理时间内返回
-                            # 或者我们可以让其一直等待，直到 task 被 cancel
-                            audio_data_int16 = await self.recorder.q.get()
-
-                            # 检查是否需要重采样
-                            if self.recorder.device_samplerate != target_samplerate:
-                                audio_data_float32 = audio_data_int16.flatten().astype(np.float32) / 32768.0
-                                resampled_data_float32 = resampy.resample(
-                                    audio_data_float32,
-                                    sr_orig=self.recorder.device_samplerate,
-                                    sr_new=target_samplerate,
-                                    filter='kaiser_fast'
-                                )
-                                final_audio_data = (resampled_data_float32 * 32768.0).astype(np.int16)
-                            else:
-                                final_audio_data = audio_data_int16
-                            
-                            await websocket.send(final_audio_data.tobytes())
-                                
-                        except asyncio.CancelledError:
-                            raise # 允许任务被取消
-                        except websockets.exceptions.ConnectionClosed:
-                            logger.warning("WebSocket 连接已关闭")
-                            raise # 重新抛出，触发外层捕获
-                        except Exception as e:
-                            logger.error("音频发送循环发生错误", exc_info=True)
-                            # 如果是 websockets 相关的其它错误，或者我们就认为是连接问题
-                            # 我们可以尝试访问 protocol.state，但为了安全起见，
-                            # 如果发送失败，我们假设连接可能不稳定，抛出异常触发重连往往是更安全的选择。
-                            # 或者，我们只针对特定异常重连。
-                            
-                            # 这里做一个简单的检查：如果异常消息包含 connection closed 相关字眼
-                            if "closed" in str(e).lower() or isinstance(e, (ConnectionError, BrokenPipeError)):
-                                 raise ConnectionError("Connection issue detected") from e
-                            
-                            # 对于其他错误（如数据处理错误），我们可能希望继续尝试发送下一帧，
-                            # 除非错误持续发生。但为了避免死循环报错，这里可以选择不抛出，继续循环。
-                            
-                finally:
-                    # 确保退出循环时停止录音
-                    self.recorder.stop()
+                    # 断线期间写了一半的段立即落盘，开始补传
+                    await self._start_upload()
+
+                    self._websocket = websocket
+                    try:
+                        await self._flush_outbox()
+                        # 接收服务器的确认、流控信号和识别结果，直到连接关闭
+                        async for message in websocket:
+                            await self._handle_server_message(json.loads(message))
+                    finally:
+                        self._websocket = None
+                        self._disconnected_at = self._sample_index
+                else:
+                    await websocket.wait_closed()
+
+                # 1003: 服务器不支持该编码，下次重连使用 PCM；已按旧编码编码的消息作废
+                if websocket.close_code == 1003 and codec != "pcm":
+                    logger.warning(f"服务器不支持音频编码 {codec} ({websocket.close_reason})，回退到 pcm")
+                    self.codec = "pcm"
+                    await self._abandon_session()
+                raise ConnectionError(f"WebSocket 连接已关闭 (code={websocket.close_code})")
                     
         except (websockets.exceptions.ConnectionClosedError, ConnectionRefusedError, ConnectionError) as e:
             logger.warning(f"WebSocket 连接中断: {e}")
             raise # 重新抛出，让 _manage_connection 处理重连
 
+    async def _handshake(self, websocket):
+        """发送 hello 并等待 welcome；服务器在握手前关闭连接时返回 None。"""
+        await websocket.send(hello_message(self._session_id, self._epoch, self.device_id))
+        try:
+            welcome = json.loads(await asyncio.wait_for(websocket.recv(), self.WELCOME_TIMEOUT))
+        except websockets.exceptions.ConnectionClosed:
+            return None
+        if welcome.get("type") != "welcome" or welcome.get("session_id") != str(self._session_id):
+            raise ConnectionError(f"意外的握手回复: {welcome}")
+        return welcome
+
+    def _resume(self, welcome: dict):
+        """根据服务器已收到的采样位置裁剪发送队列，剩余的消息在连接上重新发送。"""
+        next_sample = welcome["next_sample"]
+        if welcome["resumed"]:
+            # 服务器已处理完的音频不再发送；控制消息位于 next_sample 处时服务器可能尚未收到，重发无害
+            kept = [entry for entry in self._outbox
+                    if (entry[2] > next_sample if isinstance(entry[3], bytes) else entry[1] >= next_sample)]
+            logger.info(f"已恢复流会话 {self._session_id}，服务器已收到 {next_sample / SAMPLE_RATE:.1f}s，补发 {len(kept)} 条消息")
+        else:
+            # 服务器重启或会话已过期：已发送的消息大概率已经处理过，为避免重复记录只发送尚未发送的
+            kept = [entry for entry in self._outbox if entry[0] >= self._send_seq]
+            if self._send_seq:
+                logger.warning(f"服务器上的流会话 {self._session_id} 已不存在，进行中的语音可能丢失")
+        self._outbox = deque(kept)
+        self._send_seq = kept[0][0] if kept else self._sequence
+        self._resumable = True
+        self._offline.clear()
+        self._sent_sample = self._acked_sample = next_sample
+        self.flow_state = "ok"
+
+    async def _handle_server_message(self, message: dict):
+        message_type = message.get("type")
+        if message_type == "ack":
+            self._acked_seq = message["seq"]
+            self._acked_sample = message["next_sample"]
+            self.server_lag_ms = message.get("lag_ms")
+            self.server_rtf = message.get("rtf")
+            # 已确认的消息不需要再补发
+            while self._outbox and self._outbox[0][0] <= self._acked_seq:
+                self._outbox.popleft()
+        elif message_type == "flow":
+            if message["state"] != self.flow_state:
+                logger.warning(f"服务器处理状态: {message['state']} (rtf={message.get('rtf')})")
+            self.flow_state = message["state"]
+        elif message_type == "segment":
+            self.segments_detected += 1
+            logger.info(f"服务器检测到语音片段 #{message['record_id']}: {message['timestamp']}, {message['duration']:.1f}s")
+        elif message_type == "transcribed":
+            self.last_transcription = message
+            logger.info(f"片段 #{message['record_id']} 识别结果 ({message['status']}): {message.get('transcription')}")
+        else:
+            logger.warning(f"未知的服务器消息: {message}")
+
+    def _queue(self, start: int, end: int, message):
+        """
+        把一条消息放入发送队列。
+        :param message: 编码后的音频 (bytes) 或控制消息 (dict)
+        """
+        sequence = self._sequence
+        self._sequence += 1
+        if isinstance(message, bytes):
+            message = pack_frame(self._session_id, sequence, start, message)
+        else:
+            message = json.dumps({**message, "seq": sequence})
+        self._outbox.append((sequence, start, end, message))
+
+    def _emit(self, messages):
+        for message, samples in messages:
+            self._queue(self._encode_pos, self._encode_pos + samples, message)
+            self._encode_pos += samples
+
+    def _encode(self, samples, sample_index: int):
+        """编码从 sample_index 开始的一段音频；与上一段不连续时先把编码器中剩余的音频作为一条消息输出。"""
+        if sample_index != self._encode_next:
+            self._emit(self._encoder.flush())
+            self._encode_pos = sample_index
+        self._encode_next = sample_index + len(samples)
+        self._emit(self._encoder.encode(samples))
+
+    async def _flush_outbox(self):
+        """按序号发送队列中尚未发送的消息。"""
+        async with self._send_lock:
+            for sequence, _, end, message in list(self._outbox):
+                if sequence < self._send_seq:
+                    continue
+                websocket = self._websocket
+                if websocket is None:
+                    return
+                await websocket.send(message)
+                self._send_seq = sequence + 1
+                self._sent_sample = max(self._sent_sample, end)
+                self._last_sent = time.monotonic()
+
+    async def _send_pending(self):
+        """发送新放入队列的消息，并丢弃已发送足够久的消息；断线太久时放弃恢复会话。"""
+        if self.is_connected:
+            await self._flush_outbox()
+        elif self._sample_index - self._disconnected_at > self.resume_samples:
+            await self._abandon_session()
+            return
+        horizon = self._sample_index - self.resend_samples
+        while self._outbox and self._outbox[0][0] < self._send_seq and self._outbox[0][2] < horizon:
+            self._outbox.popleft()
+
+    def _advance(self, audio, captured_at: float) -> int:
+        """
+        为一块新采集的音频分配采样位置并返回其起始位置。
+        缓冲区溢出丢弃了音频时，采样计数会落后于实际时间，落后超过 MAX_GAP_SECONDS 时向前跳到实际位置，服务器视为不连续的音频。
+        """
+        if self._session_id is None:
+            self._start_session(captured_at)
+        measured = int((captured_at - self._epoch) * SAMPLE_RATE)
+        if measured - self._sample_index > MAX_GAP_SECONDS * SAMPLE_RATE:
+            logger.warning(f"采样位置落后采集时间 {(measured - self._sample_index) / SAMPLE_RATE:.1f}s，跳过这段音频")
+            self._sample_index = measured
+        sample_index = self._sample_index
+        self._sample_index += len(audio)
+        return sample_index
+
+    async def _capture_and_send(self):
+        """
+        后台任务：从录音机取出音频并重采样，编码后放入发送队列；
+        放弃恢复会话后直到重新连接之前，音频写入本地缓存（未启用时丢弃）。
+        """
+        while self.is_running:
+            try:
+                self.recorder.start()
+                break
+            except Exception as e:
+                logger.error(f"录音机启动失败: {e}，{self.RECONNECT_INTERVAL} 秒后重试")
+                await asyncio.sleep(self.RECONNECT_INTERVAL)
+        if not self.recorder.is_recording:
+            return
+
+        try:
+            recorder_config = config.get("recorder", {})
+            target_samplerate = recorder_config.get("target_samplerate", 16000)
+            device_samplerate = self.recorder.device_samplerate
+            # 每次从环形缓冲区取出的音频时长，取较大的块以减少事件循环的唤醒次数
+            read_frames = int(device_samplerate * recorder_config.get("read_ms", 100) / 1000)
+            # 使用一个有状态的重采样器，块与块之间的滤波器状态连续
+            resampler = None
+            if device_samplerate != target_samplerate:
+                resampler = StreamingResampler(device_samplerate, target_samplerate, max_block=read_frames)
+
+            while self.is_running:
+                try:
+                    # 一直等待到缓冲区中有 read_frames 帧，直到 task 被 cancel
+                    audio_data_int16 = await self.recorder.read(read_frames)
+                    # 这一块第一个采样的采集时间：当前时间减去它之后仍在缓冲区中的音频时长
+                    captured_at = time.time() - (self.recorder.buffer.available + read_frames) / device_samplerate
+
+                    # 检查是否需要重采样
+                    if resampler is not None:
+                        final_audio_data = resampler.process(audio_data_int16[:, 0])
+                    else:
+                        final_audio_data = audio_data_int16[:, 0]
+
+                    sample_index = self._advance(final_audio_data, captured_at)
+                    if self.is_connected and self._should_defer():
+                        await self._defer()
+                        await self.spool.append(final_audio_data, captured_at)
+                    elif self.is_connected or self._resumable:
+                        if self._deferring:
+                            await self._resume_live()
+                        self._stage(final_audio_data, sample_index)
+                        if not self.is_connected and self.spool is not None:
+                            # 重采样器返回的是内部缓冲区的视图，需要复制
+                            self._offline.append((final_audio_data.copy(), captured_at))
+                        await self._send_pending()
+                    elif self.spool is not None:
+                        await self.spool.append(final_audio_data, captured_at)
+
+                except websockets.exceptions.ConnectionClosed:
+                    # 未送达的消息仍在发送队列中，重连后补发
+                    logger.warning("WebSocket 连接已关闭")
+                    self._websocket = None
+                except asyncio.CancelledError:
+                    raise # 允许任务被取消
+                except Exception:
+                    # 对于其他错误（如数据处理错误），继续处理下一块
+                    logger.error("音频采集发送循环发生错误", exc_info=True)
+        finally:
+            # 确保退出循环时停止录音
+            if self.recorder.is_recording:
+                self.recorder.stop()
+
+    def _stage(self, audio, sample_index: int):
+        """
+        暂存一块音频并在攒够时编码。服务器处理正常时立即编码；变慢时合并成 coalesce_samples 一条的消息，
+        减少服务器逐条处理消息的开销（对 pcm 有效，flac/opus 的消息大小由编码参数决定）。
+        """
+        if self._staged and sample_index != self._staged_index + self._staged_samples:
+            self._process_staged()
+        if not self._staged:
+            self._staged_index = sample_index
+        # 重采样器返回的是内部缓冲区的视图，需要复制
+        self._staged.append(audio.copy())
+        self._staged_samples += len(audio)
+        if self._staged_samples >= (self.coalesce_samples if self.flow_state != "ok" else 0):
+            self._process_staged()
+
+    def _process_staged(self):
+        if not self._staged:
+            return
+        audio = np.concatenate(self._staged) if len(self._staged) > 1 else self._staged[0]
+        self._staged.clear()
+        self._staged_samples = 0
+        if self.edge_vad is not None:
+            self._queue_windows(audio, self._staged_index)
+        else:
+            self._encode(audio, self._staged_index)
+
+    def _should_defer(self) -> bool:
+        """服务器过载或未确认的音频过多时暂停实时发送；需要本地缓存才能暂停。"""
+        if self.spool is None:
+            return False
+        inflight = self._sent_sample - self._acked_sample
+        if self._deferring:
+            # 积压降到一半以下且服务器不再过载时恢复
+            return self.flow_state == "overloaded" or inflight > self.max_inflight_samples // 2
+        return self.flow_state == "overloaded" or inflight > self.max_inflight_samples
+
+    async def _defer(self):
+        if self._deferring:
+            return
+        self._deferring = True
+        logger.warning(
+            f"服务器处理跟不上 (状态 {self.flow_state}，未确认 {(self._sent_sample - self._acked_sample) / SAMPLE_RATE:.1f}s)，"
+            f"暂停实时发送，音频写入本地缓存"
+        )
+        # 已暂存和编码器中剩余的音频照常发出，进行中的窗口在此结束
+        self._process_staged()
+        self._emit(self._encoder.flush())
+        if self.edge_vad is not None and self.edge_vad.active:
+            self._queue(self._window_pos, self._window_pos, {"type": "window_end"})
+            self.edge_vad.reset()
+        await self._flush_outbox()
+
+    async def _resume_live(self):
+        self._deferring = False
+        logger.info("服务器已恢复，继续实时发送，暂停期间的音频稍后补传")
+        await self._start_upload()
+
+    async def _start_upload(self):
+        """把写了一半的缓存段落盘，并在补传任务未运行时启动它。"""
+        if self.spool is None:
+            return
+        await self.spool.close_segment()
+        if self._upload_task is None or self._upload_task.done():
+            self._upload_task = asyncio.create_task(self._upload_backlog())
+
+    def _queue_windows(self, audio, sample_index: int):
+        """
+        经过边缘 VAD，只发送候选语音窗口。每个窗口以带采集时间的 window_start 控制消息开始、以 window_end 结束；
+        静音期间定期发送 keepalive。
+        """
+        for event in self.edge_vad.process(audio, self._epoch + sample_index / SAMPLE_RATE):
+            if event[0] == "start":
+                self._window_pos = round((event[1] - self._epoch) * SAMPLE_RATE)
+                start = datetime.fromtimestamp(event[1], tz=timezone.utc).isoformat()
+                self._queue(self._window_pos, self._window_pos, {"type": "window_start", "captured_at": start})
+            elif event[0] == "audio":
+                self._encode(event[1], self._window_pos)
+                self._window_pos += len(event[1])
+            else:
+                # 窗口结束前把编码器中剩余的音频发出
+                self._emit(self._encoder.flush())
+                self._queue(self._window_pos, self._window_pos, {"type": "window_end"})
+
+        if self.is_connected and not self.edge_vad.active and time.monotonic() - self._last_sent >= self.keepalive_seconds:
+            self._queue(self._sample_index, self._sample_index, {"type": "keepalive"})
+
+    async def _upload_backlog(self):
+        """后台任务：连接正常期间逐段补传缓存音频，实时音频出现积压时暂停。"""
+        spool_config = config.get("spool", {})
+        upload_url = spool_config.get("upload_url") or _default_upload_url(self.server_url)
+        read_frames = int((self.recorder.device_samplerate or 16000) * config.get("recorder", {}).get("read_ms", 100) / 1000)
+
+        def live_backlogged() -> bool:
+            # 环形缓冲区中积压超过两次读取的量，说明实时发送跟不上
+            if self._deferring or self.flow_state != "ok":
+                # 服务器已经跟不上实时音频
+                return True
+            return self.recorder.buffer is not None and self.recorder.buffer.available > 2 * read_frames
+
+        while self.is_running and self.is_connected and self.spool.segments():
+            await upload_backlog(
+                self.spool,
+                upload_url,
+                spool_config.get("access_token"),
+                should_pause=live_backlogged,
+                can_continue=lambda: self.is_running and self.is_connected,
+                device_id=self.device_id,
+            )
+            if self.spool.segments():
+                await asyncio.sleep(self.UPLOAD_RETRY_INTERVAL)
+
     async def disconnect(self):
         """用户主动请求断开连接。"""
         if not self.is_running:
@@ -175,17 +572,59 @@ class WebsocketManager:
         logger.info("正在断开连接...")
         self.is_running = False # 设置标志位，通知所有循环停止
         
-        if self._manage_task:
-            # 取消管理任务
-            self._manage_task.cancel()
-            try:
-                await self._manage_task
-            except asyncio.CancelledError:
-                pass
-            self._manage_task = None
+        # 取消后台任务
+        for task in (self._upload_task, self._manage_task, self._capture_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._upload_task = self._manage_task = self._capture_task = None
+
+        if self.spool is not None:
+            # 未发送的缓存保留在磁盘上，下次连接时补传
+            await self.spool.close_segment()
         
         logger.info("已停止录音并断开连接。")
 
+    def status(self) -> dict:
+        return {
+            "is_running": self.is_running,
+            "device_id": self.device_id,
+            "connected": self.is_connected,
+            "codec": self._encoder.codec if self._encoder else self.codec,
+            "session": {
+                "id": str(self._session_id),
+                "captured_seconds": round(self._sample_index / SAMPLE_RATE, 1),
+                "resumable": self._resumable,
+                "outbox": len(self._outbox),
+                "unsent": self._sequence - self._send_seq,
+            } if self._session_id is not None else None,
+            "flow": {
+                "state": self.flow_state,
+                "deferring": self._deferring,
+                "inflight_seconds": round((self._sent_sample - self._acked_sample) / SAMPLE_RATE, 1),
+                "server_lag_ms": self.server_lag_ms,
+                "server_rtf": self.server_rtf,
+            },
+            "segments_detected": self.segments_detected,
+            "last_transcription": self.last_transcription,
+            "edge_vad": {
+                "active": self.edge_vad.active,
+                "windows": self.edge_vad.windows,
+                "noise_floor_db": self.edge_vad.noise_floor_db,
+            } if self.edge_vad is not None else None,
+            "spool": self.spool.status() if self.spool is not None else None,
+        }
+
+
+def _default_upload_url(server_url: str) -> str:
+    """由 WebSocket 地址推导补传接口地址，例如 ws://host:8569/vad -> http://host:8569/api/ingest/upload。"""
+    parsed = urllib.parse.urlparse(server_url)
+    scheme = "https" if parsed.scheme == "wss" else "http"
+    return f"{scheme}://{parsed.netloc}/api/ingest/upload"
+
 # 全局 WebSocket 管理器和录音机实例
 websocket_manager = WebsocketManager()
 recorder: Recorder = None
@@ -196,22 +635,8 @@ async def lifespan(app: FastAPI):
     global recorder
     load_config() # 在应用启动时加载配置
 
-    # -- Numba JIT 编译器预热 --
-    # resampy 内部使用 numba，首次调用会有一个显著的编译延迟，
-    # 这会阻塞异步事件循环，导致音频 input overflow。
-    # 我们在启动时执行一次虚拟的重采样操作，以提前触发编译。
-    try:
-        logger.info("正在预热音频重采样编译器 (numba)...")
-        # resampy 需要一个足够长的信号来进行有意义的重采样，这里使用 1024 个样本
-        _warmup_input = np.zeros(1024, dtype=np.float32)
-        resampy.resample(_warmup_input, 48000, 16000)
-        logger.info("编译器预热成功。")
-    except Exception as e:
-        logger.error(f"预热音频重采样编译器失败: {e}")
-        # 这里不抛出异常，因为即使预热失败，程序仍可能工作，尽管首次处理会延迟。
-
     # Recorder 现在不需要任何参数，它会自动检测采样率
-    recorder = Recorder()
+    recorder = Recorder(buffer_seconds=config.get("recorder", {}).get("buffer_seconds", 10))
     yield
     # 在应用关闭时，确保断开 WebSocket 连接
     if websocket_manager.is_running:
@@ -238,6 +663,13 @@ async def stop_record():
     await websocket_manager.disconnect()
     return {"status": "录音已停止，正在断开"}
 
+@app.get("/record/status")
+async def record_status():
+    """HTTP 端点，返回录音与环形缓冲区的状态，包括 overrun 计数。"""
+    if not recorder:
+        raise HTTPException(status_code=500, detail="录音机未初始化")
+    return {**websocket_manager.status(), **recorder.status()}
+
 if __name__ == "__main__":
     # 客户端运行在不同的端口以避免与服务器冲突
     uvicorn.run("app:app", host="0.0.0.0", port=8570, reload=True)
@@ -0,0 +1,117 @@
+"""
+上行音频编码器，消息格式与 server/audio_codec.py 保持一致。
+
+- pcm:  原始 int16 PCM（256 kbit/s）
+- flac: 无损，每条消息是一段独立完整的 FLAC 流，需要 soundfile
+- opus: 有损，每条消息包含若干个 20ms 的 Opus 包，每个包前带 2 字节大端长度，需要 opuslib
+
+encode/flush 返回 (消息, 消息包含的采样数) 的列表，用于计算帧头中的采样位置。
+"""
+import io
+import logging
+import struct
+from typing import List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+OPUS_FRAME_SAMPLES = SAMPLE_RATE // 50
+OPUS_LENGTH_PREFIX = struct.Struct(">H")
+
+
+class PcmEncoder:
+    codec = "pcm"
+
+    def encode(self, samples: np.ndarray) -> List[Tuple[bytes, int]]:
+        return [(samples.astype(np.int16).tobytes(), len(samples))] if len(samples) else []
+
+    def flush(self) -> List[Tuple[bytes, int]]:
+        return []
+
+
+class FlacEncoder:
+    """攒够 block_samples 个采样后编码成一段独立的 FLAC 流；块太小时 FLAC 的头部开销会抵消压缩收益。"""
+    codec = "flac"
+
+    def __init__(self, block_samples: int = SAMPLE_RATE // 2):
+        import soundfile
+        self._soundfile = soundfile
+        self.block_samples = block_samples
+        self._pending = np.zeros(0, dtype=np.int16)
+
+    def _encode_block(self, block: np.ndarray) -> bytes:
+        buffer = io.BytesIO()
+        self._soundfile.write(buffer, block, SAMPLE_RATE, format="FLAC", subtype="PCM_16")
+        return buffer.getvalue()
+
+    def encode(self, samples: np.ndarray) -> List[Tuple[bytes, int]]:
+        self._pending = np.concatenate([self._pending, samples.astype(np.int16)])
+        messages = []
+        while len(self._pending) >= self.block_samples:
+            messages.append((self._encode_block(self._pending[:self.block_samples]), self.block_samples))
+            self._pending = self._pending[self.block_samples:]
+        return messages
+
+    def flush(self) -> List[Tuple[bytes, int]]:
+        if not len(self._pending):
+            return []
+        block, self._pending = self._pending, np.zeros(0, dtype=np.int16)
+        return [(self._encode_block(block), len(block))]
+
+
+class OpusEncoder:
+    """按 20ms 一包编码，每攒够 frames_per_message 个包发送一条消息。"""
+    codec = "opus"
+
+    def __init__(self, bitrate: int = 24000, frames_per_message: int = 5):
+        import opuslib
+        self._encoder = opuslib.Encoder(SAMPLE_RATE, 1, opuslib.APPLICATION_VOIP)
+        self._encoder.bitrate = bitrate
+        self.frames_per_message = frames_per_message
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._packets: List[bytes] = []
+
+    def encode(self, samples: np.ndarray) -> List[Tuple[bytes, int]]:
+        self._pending = np.concatenate([self._pending, samples.astype(np.int16)])
+        messages = []
+        while len(self._pending) >= OPUS_FRAME_SAMPLES:
+            frame = self._pending[:OPUS_FRAME_SAMPLES]
+            self._pending = self._pending[OPUS_FRAME_SAMPLES:]
+            self._packets.append(self._encoder.encode(frame.tobytes(), OPUS_FRAME_SAMPLES))
+            if len(self._packets) >= self.frames_per_message:
+                messages.append(self._take_message())
+        return messages
+
+    def _take_message(self) -> Tuple[bytes, int]:
+        # 补静音的最后一包按完整的 20ms 计算，与服务器解码出的长度一致
+        message = b"".join(OPUS_LENGTH_PREFIX.pack(len(p)) + p for p in self._packets)
+        samples = len(self._packets) * OPUS_FRAME_SAMPLES
+        self._packets = []
+        return message, samples
+
+    def flush(self) -> List[Tuple[bytes, int]]:
+        if len(self._pending):
+            # 最后不足一包的部分补静音
+            frame = np.zeros(OPUS_FRAME_SAMPLES, dtype=np.int16)
+            frame[:len(self._pending)] = self._pending
+            self._pending = np.zeros(0, dtype=np.int16)
+            self._packets.append(self._encoder.encode(frame.tobytes(), OPUS_FRAME_SAMPLES))
+        return [self._take_message()] if self._packets else []
+
+
+def create_encoder(codec: str, codec_config: dict = None):
+    """
+    创建编码器。缺少编码库时回退到 PCM，保证客户端总能推流。
+    :param codec_config: 传给编码器的参数，例如 opus 的 bitrate
+    """
+    encoders = {"pcm": PcmEncoder, "flac": FlacEncoder, "opus": OpusEncoder}
+    if codec not in encoders:
+        logger.error(f"未知的音频编码: {codec}，使用 pcm")
+        return PcmEncoder()
+    try:
+        return encoders[codec](**(codec_config or {}))
+    except (ImportError, OSError) as e:
+        logger.error(f"音频编码 {codec} 不可用 ({e})，使用 pcm")
+        return PcmEncoder()
@@ -0,0 +1,142 @@
+"""
+客户端的边缘 VAD：只把可能包含语音的窗口发送给服务器。
+
+默认使用能量门限：按 32ms 一帧计算音量 (dBFS)，并跟踪环境噪声底；音量超过噪声底 margin_db 时认为是候选语音。
+可选地再用本地 Silero 模型确认（需要安装 silero-vad 和 torch）。
+窗口开始前保留 pre_roll_ms 的音频，最后一帧候选语音之后再延续 post_roll_ms，保证服务器端 VAD 能看到完整的语音边界。
+服务器端仍然对窗口内的音频做完整的 Silero VAD，这里宁可多发也不要漏发。
+"""
+import logging
+from collections import deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# 每帧的采样数，与 Silero 在 16kHz 下的窗口大小一致
+FRAME_SAMPLES = 512
+# 候选语音帧上噪声底的跟随系数
+CANDIDATE_FLOOR_ALPHA = 0.001
+
+
+class EdgeVad:
+    def __init__(
+        self,
+        margin_db: float = 8.0,
+        min_db: float = -65.0,
+        pre_roll_ms: int = 500,
+        post_roll_ms: int = 1500,
+        silero: bool = False,
+        silero_threshold: float = 0.3,
+    ):
+        """
+        :param margin_db: 音量超过噪声底多少 dB 时认为是候选语音
+        :param min_db: 低于该音量的帧一律视为静音
+        :param silero: 是否用本地 Silero 模型确认能量门限检测到的候选语音
+        """
+        self.margin_db = margin_db
+        self.min_db = min_db
+        self.pre_roll_frames = max(pre_roll_ms * SAMPLE_RATE // 1000 // FRAME_SAMPLES, 1)
+        self.post_roll_frames = max(post_roll_ms * SAMPLE_RATE // 1000 // FRAME_SAMPLES, 1)
+        self.silero_threshold = silero_threshold
+        self._silero = self._load_silero() if silero else None
+
+        self.noise_floor_db: Optional[float] = None
+        self.active = False # 当前是否处于语音窗口中
+        self._silent_frames = 0
+        self._pre_roll: deque = deque(maxlen=self.pre_roll_frames) # (帧, 采集时间)
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._pending_captured_at = 0.0
+        self.windows = 0 # 已发送的语音窗口数
+
+    def _load_silero(self):
+        try:
+            import torch
+            from silero_vad import load_silero_vad
+        except ImportError as e:
+            logger.error(f"无法加载本地 Silero 模型 ({e})，边缘 VAD 只使用能量门限")
+            return None
+        torch.set_num_threads(1)
+        return load_silero_vad()
+
+    def _is_speech(self, frame: np.ndarray) -> bool:
+        rms = np.sqrt(np.mean(frame.astype(np.float32) ** 2))
+        db = 20 * np.log10(max(rms, 1.0) / 32768.0)
+        if self.noise_floor_db is None:
+            self.noise_floor_db = db
+        candidate = db > self.min_db and db > self.noise_floor_db + self.margin_db
+
+        # 噪声底下降时快速跟随，上升时缓慢跟随，避免被持续的语音抬高。
+        # 候选帧也以极慢的速度跟随：背景噪声突然升高超过 margin_db 后每一帧都是候选，
+        # 否则噪声底永远追不上，窗口会一直开着（时间常数约 30 秒，远长于一句梦话）
+        if not candidate:
+            alpha = 0.1 if db < self.noise_floor_db else 0.01
+        else:
+            alpha = CANDIDATE_FLOOR_ALPHA
+        self.noise_floor_db += alpha * (db - self.noise_floor_db)
+        if not candidate:
+            return False
+        if self._silero is None:
+            return True
+        import torch
+        probability = self._silero(torch.from_numpy(frame.astype(np.float32) / 32768.0), SAMPLE_RATE).item()
+        return probability >= self.silero_threshold
+
+    def process(self, samples: np.ndarray, captured_at: float) -> List[Tuple]:
+        """
+        处理一段 16kHz 音频，返回需要执行的事件：
+        ("start", 窗口第一个采样的采集时间)、("audio", 采样数组)、("end",)
+        :param captured_at: samples 第一个采样的采集时间 (Unix 时间戳)
+        """
+        if not len(self._pending):
+            self._pending_captured_at = captured_at
+        data = np.concatenate([self._pending, samples])
+        data_captured_at = self._pending_captured_at
+
+        events = []
+        frames = len(data) // FRAME_SAMPLES
+        for index in range(frames):
+            frame = data[index * FRAME_SAMPLES:(index + 1) * FRAME_SAMPLES]
+            frame_time = data_captured_at + index * FRAME_SAMPLES / SAMPLE_RATE
+            speech = self._is_speech(frame)
+
+            if not self.active:
+                self._pre_roll.append((frame, frame_time))
+                if speech:
+                    self.active = True
+                    self._silent_frames = 0
+                    self.windows += 1
+                    events.append(("start", self._pre_roll[0][1]))
+                    events.append(("audio", np.concatenate([f for f, _ in self._pre_roll])))
+                    self._pre_roll.clear()
+                continue
+
+            events.append(("audio", frame))
+            self._silent_frames = 0 if speech else self._silent_frames + 1
+            if self._silent_frames >= self.post_roll_frames:
+                self.active = False
+                events.append(("end",))
+
+        self._pending = data[frames * FRAME_SAMPLES:].copy()
+        self._pending_captured_at = data_captured_at + frames * FRAME_SAMPLES / SAMPLE_RATE
+        return self._merge_audio(events)
+
+    @staticmethod
+    def _merge_audio(events: List[Tuple]) -> List[Tuple]:
+        """合并相邻的音频事件，减少发送的消息数。"""
+        merged = []
+        for event in events:
+            if event[0] == "audio" and merged and merged[-1][0] == "audio":
+                merged[-1] = ("audio", np.concatenate([merged[-1][1], event[1]]))
+            else:
+                merged.append(event)
+        return merged
+
+    def reset(self):
+        """连接重建后调用：丢弃进行中的窗口，噪声底保留。"""
+        self.active = False
+        self._silent_frames = 0
+        self._pre_roll.clear()
+        self._pending = np.zeros(0, dtype=np.int16)
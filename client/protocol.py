@@ -0,0 +1,35 @@
+"""
+/vad 的帧格式，与 server/stream_session.py 保持一致。
+
+连接后先发送 hello（会话 ID 和第 0 个采样的采集时间），服务器回复 welcome 和已收到的采样位置。
+之后每条二进制消息带 32 字节帧头：
+    magic "DT" | 版本 (1B) | 标志 (1B) | 会话 ID (16B UUID) | 序号 (uint32) | 第一个采样的采集位置 (uint64)，均为大端
+"""
+import json
+import struct
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+FRAME_MAGIC = b"DT"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct(">2sBB16sIQ")
+SAMPLE_RATE = 16000
+
+
+def pack_frame(session_id: uuid.UUID, sequence: int, sample_index: int, payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, 0, session_id.bytes, sequence & 0xFFFFFFFF, sample_index) + payload
+
+
+def hello_message(session_id: uuid.UUID, capture_start: float, device_id: Optional[str] = None) -> str:
+    """
+    :param capture_start: 会话第 0 个采样的采集时间 (Unix 时间戳)
+    :param device_id: 采集设备 ID，服务器据此区分不同房间的记录
+    """
+    return json.dumps({
+        "type": "hello",
+        "session_id": str(session_id),
+        "capture_start": datetime.fromtimestamp(capture_start, tz=timezone.utc).isoformat(),
+        "sample_rate": SAMPLE_RATE,
+        "device_id": device_id,
+    })
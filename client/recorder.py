@@ -4,6 +4,8 @@ import sounddevice as sd
 import platform # 导入 platform 模块
 import re       # 导入正则表达式模块
 
+from ringbuffer import RingBuffer
+
 logger = logging.getLogger(__name__)
 
 
@@ -11,12 +13,17 @@ class Recorder:
     """
     录音机类，负责从麦克风捕获音频并将其放入异步队列中。
     """
-    def __init__(self, channels=1, dtype="int16"):
-        """初始化录音机。"""
+    def __init__(self, channels=1, dtype="int16", buffer_seconds=10):
+        """
+        初始化录音机。
+        :param buffer_seconds: 环形缓冲区能容纳的音频时长，事件循环停顿超过该时长时会丢弃音频
+        """
         self.device_samplerate = None # 设备的物理采样率，将在 start 时自动检测
         self.channels = channels      # 声道数
         self.dtype = dtype            # 数据类型
-        self.q = asyncio.Queue()      # 用于在回调和主异步循环之间传递音频数据的异步队列
+        self.buffer_seconds = buffer_seconds
+        self.buffer: RingBuffer = None # 在回调线程和主异步循环之间传递音频数据的环形缓冲区，在 start 时按采样率分配
+        self.input_overflows = 0      # PortAudio 报告的 input overflow 次数
         self.loop = asyncio.get_running_loop()
         self.stream = None            # sounddevice 的音频流对象
         self.is_recording = False     # 录音状态标志
@@ -28,14 +35,12 @@ class Recorder:
         这个函数在一个单独的线程中运行。
         """
         if status:
+            if status.input_overflow:
+                self.input_overflows += 1
             logger.warning(f"Sounddevice 状态: {status}")
-        
-        try:
-            # 使用从主线程获取的事件循环，确保线程安全
-            self.loop.call_soon_threadsafe(self.q.put_nowait, indata.copy())
-        except RuntimeError:
-            # 如果事件循环已经关闭，这可能会发生。
-            pass
+
+        # 直接复制到预分配的环形缓冲区，不在这里唤醒事件循环
+        self.buffer.write(indata)
 
     def start(self):
         """
@@ -51,6 +56,12 @@ class Recorder:
             # 查询默认输入设备的信息以获取其支持的采样率
             device_info = sd.query_devices(kind='input')
             self.device_samplerate = int(device_info['default_samplerate'])
+            self.buffer = RingBuffer(
+                int(self.device_samplerate * self.buffer_seconds),
+                channels=self.channels,
+                dtype=self.dtype,
+                loop=self.loop,
+            )
             
             # 明确设置 blocksize 可以提供更大的缓冲区，减少 input overflow 的风险
             # 1024 帧对于 48kHz 采样率来说，大约是 21ms 的数据
@@ -89,3 +100,19 @@ class Recorder:
             self.stream = None
         self.is_recording = False
         logger.info("音频流已停止。")
+
+    async def read(self, frames: int):
+        """等待并取出 frames 帧音频，返回的数组在下一次调用 read 前有效。"""
+        return await self.buffer.read(frames)
+
+    def status(self) -> dict:
+        buffer = self.buffer
+        return {
+            "is_recording": self.is_recording,
+            "device_samplerate": self.device_samplerate,
+            "buffered_frames": buffer.available if buffer else 0,
+            "buffer_capacity": buffer.capacity if buffer else 0,
+            "overruns": buffer.overruns if buffer else 0,
+            "dropped_frames": buffer.dropped_frames if buffer else 0,
+            "input_overflows": self.input_overflows,
+        }
@@ -0,0 +1,94 @@
+"""
+重采样基准：比较原先逐块调用 resampy 的方式与 StreamingResampler。
+
+按录音回调的块大小（默认 1024 帧）逐块处理，报告每秒音频消耗的 CPU 时间，
+以及相对整段一次性处理结果的误差（逐块独立重采样在块边界处的失真）。
+
+用法:
+    python resample_bench.py --rates 48000,44100 --seconds 60
+    python resample_bench.py --wav night_48k.wav
+"""
+import argparse
+import time
+import wave
+
+import numpy as np
+
+from resampler import StreamingResampler
+
+TARGET_SAMPLERATE = 16000
+
+
+def resampy_blocks(audio: np.ndarray, sr: int, block: int) -> np.ndarray:
+    """原先 app.py 中的做法：每块单独转换为 float32 并调用 resampy。"""
+    import resampy
+    out = []
+    for offset in range(0, len(audio), block):
+        chunk = audio[offset:offset + block].astype(np.float32) / 32768.0
+        resampled = resampy.resample(chunk, sr_orig=sr, sr_new=TARGET_SAMPLERATE, filter='kaiser_fast')
+        out.append((resampled * 32768.0).astype(np.int16))
+    return np.concatenate(out)
+
+
+def resampy_whole(audio: np.ndarray, sr: int) -> np.ndarray:
+    import resampy
+    resampled = resampy.resample(audio.astype(np.float32) / 32768.0, sr_orig=sr, sr_new=TARGET_SAMPLERATE, filter='kaiser_fast')
+    return (resampled * 32768.0).astype(np.int16)
+
+
+def streaming_blocks(audio: np.ndarray, sr: int, block: int) -> np.ndarray:
+    resampler = StreamingResampler(sr, TARGET_SAMPLERATE, max_block=block)
+    return np.concatenate([resampler.process(audio[offset:offset + block]).copy() for offset in range(0, len(audio), block)])
+
+
+def streaming_whole(audio: np.ndarray, sr: int) -> np.ndarray:
+    return StreamingResampler(sr, TARGET_SAMPLERATE, max_block=len(audio)).process(audio).copy()
+
+
+def error_db(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """相对整段处理结果的误差能量 (dB)，越小越好。"""
+    n = min(len(reference), len(candidate))
+    noise = np.mean((reference[:n].astype(np.float64) - candidate[:n]) ** 2)
+    signal = np.mean(reference[:n].astype(np.float64) ** 2)
+    return 10 * np.log10(noise / signal) if noise > 0 else float("-inf")
+
+
+def measure(name: str, blocks_fn, whole_fn, audio: np.ndarray, sr: int, block: int):
+    blocks_fn(audio[:sr], sr, block) # 预热（包括 numba 编译），不计入耗时
+    start = time.process_time()
+    out = blocks_fn(audio, sr, block)
+    cpu = time.process_time() - start
+    seconds = len(audio) / sr
+    print(f"{name:<10} {sr:>7} {cpu / seconds * 1000:>14.2f} {error_db(whole_fn(audio, sr), out):>14.1f}")
+
+
+def load_wav(path: str):
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: 需要 16-bit PCM 的 WAV 文件")
+        channels = wf.getnchannels()
+        audio = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        return wf.getframerate(), audio[::channels]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比较逐块 resampy 与流式多相重采样的 CPU 开销和块边界失真")
+    parser.add_argument("--rates", default="48000,44100", help="逗号分隔的输入采样率（合成噪声信号）")
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--block", type=int, default=1024, help="每块的帧数，与 Recorder 的 blocksize 一致")
+    parser.add_argument("--wav", default=None, help="使用 WAV 文件代替合成信号")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.wav:
+        inputs = [load_wav(args.wav)]
+    else:
+        inputs = [(int(sr), (rng.standard_normal(int(int(sr) * args.seconds)) * 3000).astype(np.int16)) for sr in args.rates.split(",")]
+
+    print(f"{'method':<10} {'rate':>7} {'cpu_ms/audio_s':>14} {'boundary_dB':>14}")
+    for sr, audio in inputs:
+        try:
+            measure("resampy", resampy_blocks, resampy_whole, audio, sr, args.block)
+        except ImportError:
+            print(f"{'resampy':<10} {sr:>7} skipped: resampy is not installed")
+        measure("streaming", streaming_blocks, streaming_whole, audio, sr, args.block)
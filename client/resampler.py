@@ -0,0 +1,89 @@
+"""
+有状态的流式多相 (polyphase) 重采样器。
+
+录音回调每次只给出约 21ms 的音频块。逐块独立重采样时，每块的边界都没有前一块的滤波器状态，
+会在块边界产生毛刺。这里把上一块末尾的采样作为历史保留下来，各块连续处理的结果与一次性处理整段音频一致。
+所有中间缓冲区都预先分配，处理每块时只做 NumPy 向量运算，不依赖 numba，因此不需要预热。
+"""
+from math import gcd
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def design_filter(up: int, down: int, zeros: int = 16, rolloff: float = 0.9, beta: float = 8.0) -> np.ndarray:
+    """
+    设计以上采样后的采样率为基准的 Kaiser 窗 sinc 低通滤波器。
+    :param zeros: 滤波器每侧包含的 sinc 过零点数量，越大过渡带越窄、计算量越大
+    :param rolloff: 截止频率相对于奈奎斯特频率的比例
+    """
+    factor = max(up, down)
+    num_taps = 2 * zeros * factor + 1
+    cutoff = 0.5 * rolloff / factor
+    m = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * m) * np.kaiser(num_taps, beta)
+    # 上采样插入了 up - 1 个零，需要乘以 up 以保持增益
+    return taps * (up / taps.sum())
+
+
+class StreamingResampler:
+    """
+    把 int16 音频块从 sr_in 重采样到 sr_out。
+    process 返回的数组指向内部缓冲区，在下一次调用 process 前有效。
+    """
+
+    def __init__(self, sr_in: int, sr_out: int, max_block: int = 4096, **filter_kwargs):
+        divisor = gcd(sr_in, sr_out)
+        self.up = sr_out // divisor
+        self.down = sr_in // divisor
+
+        taps = design_filter(self.up, self.down, **filter_kwargs)
+        self.taps_per_phase = -(-len(taps) // self.up)
+        taps = np.concatenate([taps, np.zeros(self.taps_per_phase * self.up - len(taps))])
+        # phases[p, k] = taps[p + k * up]，并按 k 反转，以便直接与输入的滑动窗口做点积
+        self.phases = np.ascontiguousarray(taps.reshape(self.taps_per_phase, self.up).T[:, ::-1], dtype=np.float32)
+
+        self.history = self.taps_per_phase - 1
+        self._next_t = 0 # 下一个输出采样在上采样时间轴上的位置，以当前块第一个采样为 0
+        self._allocate(max_block)
+
+    def _allocate(self, max_block: int):
+        self.max_block = max_block
+        max_out = max_block * self.up // self.down + 2
+        previous = getattr(self, "_input", None)
+        self._input = np.zeros(self.history + max_block, dtype=np.float32)
+        if previous is not None:
+            self._input[:self.history] = previous[:self.history]
+        self._windows = sliding_window_view(self._input, self.taps_per_phase)
+        self._gathered = np.empty((max_out, self.taps_per_phase), dtype=np.float32)
+        self._coefficients = np.empty((max_out, self.taps_per_phase), dtype=np.float32)
+        self._float_out = np.empty(max_out, dtype=np.float32)
+        self._out = np.empty(max_out, dtype=np.int16)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        n = len(block)
+        if n > self.max_block:
+            self._allocate(n)
+        self._input[self.history:self.history + n] = block
+
+        # 本块可以计算的输出：对应的输入下标 t // up 必须落在本块内
+        t = np.arange(self._next_t, n * self.up, self.down)
+        count = len(t)
+        indices = t // self.up
+        np.take(self._windows, indices, axis=0, out=self._gathered[:count])
+        np.take(self.phases, t % self.up, axis=0, out=self._coefficients[:count])
+        out = self._float_out[:count]
+        np.einsum("nk,nk->n", self._gathered[:count], self._coefficients[:count], out=out)
+        np.clip(out, -32768, 32767, out=out)
+        np.rint(out, out=out)
+        result = self._out[:count]
+        result[:] = out
+
+        self._next_t = (int(t[-1]) + self.down if count else self._next_t) - n * self.up
+        # 保留末尾的采样作为下一块的滤波器历史
+        self._input[:self.history] = self._input[n:n + self.history]
+        return result
+
+    def reset(self):
+        self._input[:self.history] = 0
+        self._next_t = 0
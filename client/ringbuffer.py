@@ -0,0 +1,83 @@
+"""
+单生产者单消费者 (SPSC) 的音频环形缓冲区。
+
+生产者是 PortAudio 回调线程，消费者是事件循环中的发送协程。缓冲区在创建时一次性分配，
+写入时直接把 indata 复制到环中，不再为每个音频块创建 Python 对象，也不再每 21ms 唤醒一次事件循环。
+
+读写位置都是只增不减的帧计数：写位置只由生产者修改，读位置只由消费者修改，
+而且都在数据复制完成之后才更新，单个整数的赋值在 CPython 中是原子的，因此不需要加锁。
+缓冲区满时丢弃新数据并计入 overrun，内存占用始终有上限。
+"""
+import asyncio
+
+import numpy as np
+
+
+class RingBuffer:
+    def __init__(self, capacity: int, channels: int = 1, dtype="int16", loop: asyncio.AbstractEventLoop = None):
+        self.capacity = capacity
+        self._data = np.zeros((capacity, channels), dtype=dtype)
+        self._write = 0 # 已写入的总帧数，只由生产者修改
+        self._read = 0  # 已读取的总帧数，只由消费者修改
+        self.overruns = 0       # 缓冲区满导致丢弃数据的次数
+        self.dropped_frames = 0 # 丢弃的总帧数
+
+        self._loop = loop or asyncio.get_running_loop()
+        self._data_ready = asyncio.Event()
+        self._wake_at = None # 消费者等待时，写位置达到该值才唤醒事件循环
+        self._out = np.zeros((0, channels), dtype=dtype)
+
+    @property
+    def available(self) -> int:
+        return self._write - self._read
+
+    def write(self, frames: np.ndarray):
+        """在生产者线程中调用。空间不足时只写入能放下的部分，其余丢弃。"""
+        count = min(len(frames), self.capacity - self.available)
+        if count < len(frames):
+            self.overruns += 1
+            self.dropped_frames += len(frames) - count
+        if count:
+            start = self._write % self.capacity
+            first = min(count, self.capacity - start)
+            self._data[start:start + first] = frames[:first]
+            self._data[:count - first] = frames[first:count]
+            self._write += count
+
+        wake_at = self._wake_at
+        if wake_at is not None and self._write >= wake_at:
+            self._wake_at = None
+            try:
+                self._loop.call_soon_threadsafe(self._data_ready.set)
+            except RuntimeError:
+                # 事件循环已经关闭
+                pass
+
+    async def read(self, frames: int) -> np.ndarray:
+        """
+        等待直到有 frames 帧可读，然后一次性取出。
+        返回的数组指向内部缓冲区，在下一次调用 read 前有效。
+        """
+        if frames > self.capacity:
+            raise ValueError(f"读取的帧数 {frames} 超过了缓冲区容量 {self.capacity}")
+        while self.available < frames:
+            self._data_ready.clear()
+            self._wake_at = self._read + frames
+            # 设置唤醒位置后再检查一次，避免生产者恰好在此之前写入而错过唤醒
+            if self.available >= frames:
+                self._wake_at = None
+                break
+            await self._data_ready.wait()
+
+        if len(self._out) != frames:
+            self._out = np.zeros((frames, self._data.shape[1]), dtype=self._data.dtype)
+        start = self._read % self.capacity
+        first = min(frames, self.capacity - start)
+        self._out[:first] = self._data[start:start + first]
+        self._out[first:] = self._data[:frames - first]
+        self._read += frames
+        return self._out
+
+    def clear(self):
+        """丢弃未读数据，只应在生产者停止后调用。"""
+        self._read = self._write
@@ -0,0 +1,206 @@
+"""
+断线期间的本地音频缓存。
+
+与服务器断开时，录音不停止，重采样后的音频按段编码（默认 FLAC）写入缓存目录，
+文件名包含该段第一个采样的采集时间（毫秒时间戳）和编码。缓存总大小有上限，超出时删除最旧的段。
+恢复连接后由 upload_backlog 逐段上传到服务器的 /api/ingest/upload，服务器按原始采集时间生成记录。
+每段带有内容哈希作为 upload_id，上传超时后重传同一段时服务器不会重复生成记录。
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from codec import create_encoder
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# 采集时间与段内位置相差超过该值时（例如缓冲区溢出丢弃了音频），另起一段，保证段内时间连续
+MAX_GAP_SECONDS = 0.5
+
+
+class Spool:
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 1024 ** 3,
+        segment_seconds: int = 60,
+        codec: str = "flac",
+        codec_config: dict = None,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.codec_config = codec_config or {}
+        self._segment = np.zeros(segment_seconds * SAMPLE_RATE, dtype=np.int16)
+        self._length = 0
+        self._segment_start: Optional[float] = None # 当前段第一个采样的采集时间 (Unix 时间戳)
+        self.dropped_segments = 0 # 因超出容量被删除的段数
+        os.makedirs(directory, exist_ok=True)
+        # 只用于确定实际可用的编码，缺少编码库时回退到 pcm
+        self.codec = create_encoder(codec, self._encoder_config(codec)).codec
+
+    def _encoder_config(self, codec: str) -> dict:
+        if codec == "flac":
+            # 整段编码为一个 FLAC 流
+            return {"block_samples": len(self._segment)}
+        return self.codec_config
+
+    async def append(self, samples: np.ndarray, captured_at: float):
+        """
+        追加一段连续的音频。
+        :param captured_at: samples 第一个采样的采集时间 (Unix 时间戳)
+        """
+        if self._segment_start is not None:
+            expected = self._segment_start + self._length / SAMPLE_RATE
+            if abs(captured_at - expected) > MAX_GAP_SECONDS:
+                await self.close_segment()
+
+        offset = 0
+        while offset < len(samples):
+            if self._segment_start is None:
+                self._segment_start = captured_at + offset / SAMPLE_RATE
+            count = min(len(samples) - offset, len(self._segment) - self._length)
+            self._segment[self._length:self._length + count] = samples[offset:offset + count]
+            self._length += count
+            offset += count
+            if self._length == len(self._segment):
+                await self.close_segment()
+
+    async def close_segment(self):
+        """把当前未满的段写入磁盘。"""
+        if not self._length:
+            return
+        samples = self._segment[:self._length].copy()
+        start = self._segment_start
+        self._length = 0
+        self._segment_start = None
+        await asyncio.to_thread(self._write_segment, samples, start)
+
+    def _write_segment(self, samples: np.ndarray, start: float):
+        encoder = create_encoder(self.codec, self._encoder_config(self.codec))
+        data = b"".join(message for message, _ in encoder.encode(samples) + encoder.flush())
+        path = os.path.join(self.directory, f"{int(start * 1000)}.{encoder.codec}")
+        # 先写临时文件再重命名，避免断电时留下不完整的段
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        logger.info(f"已缓存 {len(samples) / SAMPLE_RATE:.0f}s 音频: {path} ({len(data)} 字节)")
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        segments = self.segments()
+        total = sum(size for _, size in segments)
+        for path, size in segments:
+            if total <= self.max_bytes:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # 刚好已被上传并删除
+                continue
+            self.dropped_segments += 1
+            logger.warning(f"缓存超出上限 {self.max_bytes} 字节，删除最旧的段: {path}")
+
+    def segments(self) -> List[Tuple[str, int]]:
+        """按采集时间排序的已写入段 (路径, 字节数)。"""
+        result = []
+        for name in os.listdir(self.directory):
+            stem, _, codec = name.partition(".")
+            if stem.isdigit() and codec and not codec.endswith("tmp"):
+                path = os.path.join(self.directory, name)
+                try:
+                    result.append((int(stem), path, os.path.getsize(path)))
+                except FileNotFoundError:
+                    continue
+        return [(path, size) for _, path, size in sorted(result)]
+
+    def status(self) -> dict:
+        segments = self.segments()
+        return {
+            "codec": self.codec,
+            "segments": len(segments),
+            "bytes": sum(size for _, size in segments),
+            "max_bytes": self.max_bytes,
+            "buffered_seconds": round(self._length / SAMPLE_RATE, 1),
+            "dropped_segments": self.dropped_segments,
+        }
+
+
+def _post_segment(upload_url: str, access_token: Optional[str], path: str, device_id: Optional[str]) -> int:
+    """上传一段缓存音频，返回 HTTP 状态码。"""
+    name = os.path.basename(path)
+    stem, _, codec = name.partition(".")
+    captured_at = datetime.fromtimestamp(int(stem) / 1000, tz=timezone.utc).isoformat()
+    with open(path, "rb") as f:
+        data = f.read()
+    params = {"captured_at": captured_at, "codec": codec, "upload_id": hashlib.sha256(data).hexdigest()}
+    if device_id:
+        params["device_id"] = device_id
+    query = urllib.parse.urlencode(params)
+    request = urllib.request.Request(f"{upload_url}?{query}", data=data, method="POST")
+    request.add_header("Content-Type", "application/octet-stream")
+    if access_token:
+        request.add_header("Authorization", f"Bearer {access_token}")
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        logger.error(f"上传缓存音频失败 ({e.code}): {e.read()[:200]!r}")
+        return e.code
+
+
+async def upload_backlog(
+    spool: Spool,
+    upload_url: str,
+    access_token: Optional[str],
+    should_pause: Callable[[], bool],
+    can_continue: Callable[[], bool],
+    device_id: Optional[str] = None,
+):
+    """
+    从最旧的段开始逐段上传，每段上传成功后删除。
+    :param should_pause: 返回 True 时暂停上传（例如实时音频出现积压），实时流优先
+    :param can_continue: 返回 False 时停止上传（例如连接再次断开）
+    :param device_id: 采集设备 ID
+    """
+    uploaded = 0
+    while can_continue():
+        if should_pause():
+            await asyncio.sleep(1)
+            continue
+        segments = spool.segments()
+        if not segments:
+            break
+        path, _ = segments[0]
+        start = time.perf_counter()
+        try:
+            status = await asyncio.to_thread(_post_segment, upload_url, access_token, path, device_id)
+        except (urllib.error.URLError, OSError) as e:
+            logger.warning(f"上传缓存音频失败，稍后重试: {e}")
+            break
+
+        if 200 <= status < 300:
+            os.remove(path)
+            uploaded += 1
+            logger.info(f"已上传缓存音频 {path}，耗时 {time.perf_counter() - start:.1f}s")
+        elif status == 400:
+            # 文件损坏，重试也不会成功
+            logger.error(f"服务器无法解析缓存音频，已删除: {path}")
+            os.remove(path)
+        else:
+            # 503（模型未就绪）、415（服务器不支持该编码）等，稍后重试
+            break
+    if uploaded:
+        logger.info(f"本次共上传 {uploaded} 段缓存音频，剩余 {len(spool.segments())} 段。")
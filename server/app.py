@@ -1,21 +1,49 @@
 from contextlib import asynccontextmanager
+import asyncio
+import json
 import logging
+import time
+import uuid
+import wave
+from collections import Counter
 from pydantic import BaseModel
 import uvicorn
-import yaml
-import os
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response, PlainTextResponse
 from datetime import date, timedelta, datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, TYPE_CHECKING
 
 from log import init_log
-from vad.engine import VadEngine
-from stt import get_stt_engine, STTEngine
-from database import init_db, add_record
-from schemas import MonthlyActivity, SleepRecordCreate, SleepRecord, StatisticsResponse
-from records import get_records_by_date, get_audio_file_by_id, get_monthly_record_activity, update_record_favorite_status, get_statistics, delete_record
+from config import load_config
+from stt import get_stt_engine, STTEngine, StreamingSTTEngine
+from stt.queue import TranscriptionQueue
+from stt.schedule import TranscriptionSchedule
+from database import init_db, add_record, set_slow_query_threshold
+from schemas import MonthlyActivity, SleepRecordCreate, SleepRecord, StatisticsResponse, BulkOperationResult, RetentionReport, DeviceSummary
+from records import (
+    get_records_by_date,
+    get_device_summaries,
+    get_audio_file_by_id,
+    get_monthly_record_activity,
+    update_record_favorite_status,
+    get_statistics,
+    delete_record,
+    bulk_update_favorite_status,
+    bulk_update_tags,
+    bulk_delete_records,
+)
 from storage import get_storage_backend, StorageBackend
+from retention import RetentionPolicy, run_retention, retention_loop
+from export import stream_export, EXPORT_FORMATS
+from waveform import get_peaks_by_record_id
+from events import broker
+from audio_codec import get_decoder, UnsupportedCodecError
+from ingest import BacklogIngestor, to_shanghai
+from stream_session import SessionRegistry, FeedbackChannel, parse_frame, FrameError
+from devices import validate_device_id, device_vad_overrides
+from startup import startup
+from profiling import LoopLagMonitor, sample_stacks, profile_event_loop, MAX_PROFILE_SECONDS
+from metrics import render_metrics, WEBSOCKET_STREAMS, AUDIO_MESSAGE_LAG, AUDIO_UPLINK_BYTES, STREAM_SESSIONS, DEVICE_SEGMENTS, DEVICE_STREAMS, STORAGE_FALLBACK, HTTP_REQUEST, STT_QUEUE_DEPTH, STT_BACKLOG_AGE, STT_DEFERRED
 from auth import (
     get_user_credentials,
     get_credential_by_id,
@@ -34,7 +62,10 @@ from webauthn import (
 from webauthn.helpers import options_to_json_dict, base64url_to_bytes
 from webauthn.helpers.structs import AuthenticatorSelectionCriteria, ResidentKeyRequirement, UserVerificationRequirement
 
-init_log()
+if TYPE_CHECKING:
+    from vad.engine import VadEngine
+
+init_log(load_config().get('logging', {}))
 logger = logging.getLogger(__name__)
 
 # 临时存储挑战码
@@ -43,20 +74,47 @@ challenge_storage: Dict[str, bytes] = {}
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """FastAPI 的生命周期事件，在应用启动时执行。"""
-    init_db()
-    await startup_event()
+    with startup.phase("init_db"):
+        init_db()
+    broker.bind_loop(asyncio.get_running_loop())
+    with startup.phase("config"):
+        await startup_event()
+    # 模型在后台加载，期间只读 API 已经可以使用
+    model_task = asyncio.create_task(load_models())
+    retention_task = None
+    if retention_policy.enabled:
+        retention_task = asyncio.create_task(retention_loop(retention_policy, storage_backend))
+    loop_lag_monitor.start()
     yield
+    loop_lag_monitor.stop()
+    model_task.cancel()
+    transcription_queue.stop()
+    if retention_task:
+        retention_task.cancel()
 
 
 app = FastAPI(lifespan=lifespan)
 
 # 全局 VAD, STT 和 Storage 实例
-vad_engine: VadEngine = None
+vad_engine: "VadEngine" = None
 stt_engine: STTEngine = None
 storage_backend: StorageBackend = None
+transcription_queue: TranscriptionQueue = None
+backlog_ingestor: BacklogIngestor = None
+stream_sessions: SessionRegistry = SessionRegistry()
+stream_config: dict = {}
+devices_config: dict = {}
+# 当前有 /vad 连接的设备及其连接数
+connected_devices: Counter = Counter()
+retention_policy: RetentionPolicy = RetentionPolicy()
+loop_lag_monitor: LoopLagMonitor = LoopLagMonitor()
+# 同一时间只允许一个剖析任务
+profile_lock = asyncio.Lock()
 
 
 ACCESS_CODE = None
+# /metrics 端点的独立访问令牌，未设置时不做认证（便于 Prometheus 在内网抓取）
+METRICS_TOKEN = None
 
 # 简单的内存速率限制存储
 # 格式: {ip_address: {"count": int, "blocked_until": datetime}}
@@ -65,14 +123,10 @@ MAX_LOGIN_ATTEMPTS = 5
 BLOCK_DURATION_MINUTES = 10
 
 async def startup_event():
-    """在应用启动时加载配置和模型。"""
-    global vad_engine, stt_engine, storage_backend, ACCESS_CODE
-    config_path = os.path.join(os.path.dirname(__file__), '.config.yaml')
-    config = {}
-    if os.path.exists(config_path):
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
-    
+    """在应用启动时加载配置并初始化不依赖模型的组件。模型由 load_models 在后台加载。"""
+    global storage_backend, transcription_queue, backlog_ingestor, stream_sessions, stream_config, devices_config, retention_policy, loop_lag_monitor, ACCESS_CODE, METRICS_TOKEN
+    config = load_config()
+
     # 加载安全配置
     security_config = config.get('security', {})
     ACCESS_CODE = security_config.get('access_code')
@@ -88,14 +142,88 @@ async def startup_event():
     storage_config = config.get('storage', {})
     storage_backend = get_storage_backend(storage_config)
     logger.info(f"存储后端已初始化: {storage_config.get('type', 'local')}")
+    STORAGE_FALLBACK.set_function(lambda: 1 if getattr(storage_backend, "_minio_down", False) else 0)
 
-    # 初始化 VAD 引擎
-    vad_config = config.get('vad', {})
-    vad_engine = VadEngine(vad_config=vad_config)
+    METRICS_TOKEN = config.get('metrics', {}).get('token')
+    set_slow_query_threshold(config.get('logging', {}).get('slow_query_ms', 100))
 
-    # 初始化 STT 引擎
+    diagnostics_config = config.get('diagnostics', {})
+    loop_lag_monitor = LoopLagMonitor(
+        threshold=diagnostics_config.get('loop_lag_threshold_ms', 200) / 1000.0,
+        interval=diagnostics_config.get('loop_lag_interval_ms', 100) / 1000.0,
+    )
+
+    # 加载录音保留策略
+    retention_policy = RetentionPolicy.from_config(config.get('retention', {}))
+
+    # 初始化 STT 队列。STT 模型就绪前提交的任务会保存在数据库中，模型加载后开始识别
     stt_config = config.get('stt', {})
-    stt_engine = get_stt_engine(stt_config)
+    stt_schedule = TranscriptionSchedule.from_config(stt_config.get('schedule', {}))
+    stt_schedule.bind_loop_lag(lambda: loop_lag_monitor.current_lag)
+    transcription_queue = TranscriptionQueue(
+        storage_backend, max_attempts=stt_config.get('max_attempts', 3), schedule=stt_schedule
+    )
+    logger.info(f"STT 调度模式: {stt_schedule.mode}")
+    STT_QUEUE_DEPTH.set_function(transcription_queue.depth)
+    STT_BACKLOG_AGE.set_function(lambda: transcription_queue.oldest_pending_age() or 0.0)
+    STT_DEFERRED.set_function(lambda: 1 if transcription_queue.paused_reason else 0)
+
+    # 带帧头协议的流会话，断线后保留一段时间以便客户端恢复
+    stream_config = dict(config.get('stream', {}))
+    stream_sessions = SessionRegistry(grace_seconds=stream_config.pop('session_grace_seconds', 60))
+    STREAM_SESSIONS.set_function(lambda: len(stream_sessions))
+
+    # 客户端离线缓存音频的补传，使用独立的 VAD 模型，首次上传时加载
+    # 按设备覆盖的 VAD 参数
+    devices_config = config.get('devices') or {}
+    backlog_ingestor = BacklogIngestor(config.get('vad', {}), storage_backend, transcription_queue, on_speech_end, devices_config)
+
+
+async def on_speech_end(record_data: SleepRecordCreate):
+    """当检测到语音片段结束时的回调函数，将数据保存到数据库并返回记录 ID。"""
+    logger.info(f"接收到新的语音记录: {record_data}")
+    DEVICE_SEGMENTS.labels(record_data.device_id or "unknown").inc()
+    return add_record(record_data)
+
+
+def _load_vad_engine(vad_config: dict):
+    # 延迟导入，torch 和 silero 的导入本身就需要数秒
+    from vad.engine import VadEngine
+    return VadEngine(vad_config=vad_config)
+
+
+async def load_models():
+    """
+    在后台线程中加载并预热 VAD 和 STT 模型。
+    VAD 就绪后 /vad 即可接受连接（片段以 pending 状态入库）；STT 就绪后识别队列开始工作。
+    """
+    global vad_engine, stt_engine
+    config = load_config()
+
+    try:
+        vad_config = config.get('vad', {})
+        with startup.phase("vad_load"):
+            engine = await asyncio.to_thread(_load_vad_engine, vad_config)
+        with startup.phase("vad_warmup"):
+            await asyncio.to_thread(engine.warmup)
+        vad_engine = engine
+        startup.mark_ready("vad")
+    except Exception as e:
+        logger.error("VAD 模型加载失败", exc_info=True)
+        startup.mark_failed("vad", str(e))
+
+    try:
+        stt_config = config.get('stt', {})
+        with startup.phase("stt_load"):
+            engine = await asyncio.to_thread(get_stt_engine, stt_config)
+        with startup.phase("stt_warmup"):
+            await engine.warmup()
+        stt_engine = engine
+        transcription_queue.start(stt_engine)
+        startup.mark_ready("stt")
+    except Exception as e:
+        logger.error("STT 模型加载失败", exc_info=True)
+        startup.mark_failed("stt", str(e))
 
 
 @app.middleware("http")
@@ -106,6 +234,9 @@ async def auth_middleware(request: Request, call_next):
     exempt_paths = ["/api/login", "/api/webauthn/"]
     if ACCESS_CODE and path.startswith("/api/") and not any(path.startswith(p) for p in exempt_paths):
         auth_header = request.headers.get("Authorization")
+        # 浏览器的 EventSource 无法设置请求头，事件流允许通过查询参数携带 Token
+        if auth_header is None and path == "/api/events" and request.query_params.get("access_token"):
+            auth_header = f"Bearer {request.query_params['access_token']}"
         if auth_header is None:
             return JSONResponse(status_code=401, content={"detail": "未提供认证信息"})
         
@@ -120,6 +251,38 @@ async def auth_middleware(request: Request, call_next):
     return response
 
 
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """记录每个路由的 HTTP 请求耗时。注册在认证中间件之后，因此位于最外层。"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        HTTP_REQUEST.labels(request.method, route_path, status).observe(time.perf_counter() - start)
+
+
+@app.get("/ready")
+async def read_readiness():
+    """
+    就绪检查：各组件 (vad, stt) 的加载状态及启动各阶段耗时。全部就绪时返回 200，否则返回 503。
+    """
+    status = startup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics(request: Request):
+    """以 Prometheus 文本格式输出指标。不经过 /api 的访问码认证，可单独配置 metrics.token。"""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="无效的 metrics token")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 class LoginRequest(BaseModel):
     access_code: str
 
@@ -261,62 +424,245 @@ async def webauthn_login_verify(request: AuthenticationVerificationRequest, raw_
         logger.error(f"WebAuthn authentication verification failed: {e}")
         raise HTTPException(status_code=401, detail="无效的凭证")
 
+async def handle_stream_control(vad_wrapper, message: dict):
+    """
+    处理客户端边缘 VAD 的控制消息。
+    window_start / window_end 包围一个候选语音窗口，窗口之间的音频不连续，因此每个窗口使用独立的 VAD 状态，
+    片段时间戳按窗口的采集时间和采样位置推算。
+    """
+    message_type = message.get("type")
+    if message_type == "window_start":
+        await vad_wrapper.flush()
+        vad_wrapper.reset()
+        vad_wrapper.capture_start = to_shanghai(datetime.fromisoformat(message["captured_at"]))
+    elif message_type == "window_end":
+        # 窗口结束时仍在说话，也作为一个片段保存
+        await vad_wrapper.flush()
+        vad_wrapper.reset()
+        vad_wrapper.capture_start = None
+    elif message_type != "keepalive":
+        logger.warning(f"未知的控制消息: {message}")
+
+
 @app.websocket("/vad")
 async def websocket_binary(websocket: WebSocket):
-    """处理 WebSocket 二进制音频流的端点。"""
+    """
+    处理 WebSocket 音频流的端点。
+    二进制消息为音频；启用边缘 VAD 的客户端只发送语音窗口，并通过 JSON 文本消息标记窗口边界和心跳。
+    客户端先发送 hello 时使用带帧头的协议（见 stream_session.py），断线后可以恢复会话；否则为原始音频流。
+    设备 ID 由 hello 的 device_id 或查询参数 device_id 给出，记录按设备保存，并使用该设备的 VAD 参数。
+    """
     await websocket.accept()
-    logger.info("WebSocket 连接已接受。")
+    if not startup.is_ready("vad"):
+        # 1013: Try Again Later，客户端会自动重连
+        await websocket.close(code=1013, reason="VAD model is loading")
+        return
 
-    async def on_speech_end(record_data: SleepRecordCreate):
-        """当检测到语音片段结束时的回调函数，将数据保存到数据库。"""
-        logger.info(f"接收到新的语音记录: {record_data}")
-        add_record(record_data)
-
-    # 为当前 WebSocket 连接创建一个 VadWrapper 实例
-    vad_wrapper = vad_engine.get_vad_wrapper(on_speech_end, stt_engine, storage_backend)
+    # 客户端通过查询参数选择上行编码，默认原始 PCM
+    codec = websocket.query_params.get("codec", "pcm")
+    try:
+        decoder = get_decoder(codec)
+    except UnsupportedCodecError as e:
+        # 1003: Unsupported Data，客户端收到后回退到 PCM
+        logger.warning(str(e))
+        await websocket.close(code=1003, reason=str(e)[:120])
+        return
+    try:
+        device_id = validate_device_id(websocket.query_params.get("device_id"))
+    except ValueError as e:
+        # 1008: Policy Violation
+        await websocket.close(code=1008, reason=str(e)[:120])
+        return
+    uplink_bytes = AUDIO_UPLINK_BYTES.labels(codec)
+    logger.info(f"WebSocket 连接已接受，音频编码: {codec}，设备: {device_id}")
+
+    async def create_vad_wrapper(on_record=None):
+        """:param on_record: 片段保存后的回调 (记录 ID, 记录数据)"""
+        async def on_segment(record_data: SleepRecordCreate):
+            record_id = await on_speech_end(record_data)
+            if on_record is not None:
+                on_record(record_id, record_data)
+            return record_id
+
+        # STT 为流式引擎且已就绪时，说话过程中即开始识别
+        streaming_engine = stt_engine if isinstance(stt_engine, StreamingSTTEngine) else None
+        return await vad_engine.get_vad_wrapper(
+            on_segment, transcription_queue, storage_backend, streaming_engine,
+            device_id=device_id, vad_overrides=device_vad_overrides(devices_config, device_id),
+        )
 
+    def track_device(delta: int):
+        device = device_id or "unknown"
+        connected_devices[device] += delta
+        if connected_devices[device] <= 0:
+            del connected_devices[device]
+        DEVICE_STREAMS.labels(device).inc(delta)
+
+    # 原始音频流使用本连接的 VadWrapper（收到第一条原始音频或控制消息时才创建，带帧头的连接不占用模型实例）；
+    # 发送 hello 后改用可恢复的会话，并通过 feedback 向客户端发送确认和流控信号
+    vad_wrapper = None
+    session = None
+    feedback = None
+    connection_id = id(websocket)
+
+    track_device(1)
+    WEBSOCKET_STREAMS.inc()
     try:
         # 持续接收来自客户端的音频数据
         while True:
-            data: bytes = await websocket.receive_bytes()
-            # 将音频数据喂给 VAD 处理器
-            await vad_wrapper.process(data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            data = message.get("bytes")
+            if data is None:
+                control = json.loads(message["text"])
+                if control.get("type") == "hello" and session is None:
+                    try:
+                        hello_device_id = validate_device_id(control.get("device_id")) or device_id
+                    except ValueError as e:
+                        await websocket.close(code=1008, reason=str(e)[:120])
+                        return
+                    if hello_device_id != device_id:
+                        track_device(-1)
+                        device_id = hello_device_id
+                        track_device(1)
+                    session, resumed = await stream_sessions.attach(
+                        uuid.UUID(control["session_id"]),
+                        to_shanghai(datetime.fromisoformat(control["capture_start"])),
+                        connection_id,
+                        create_vad_wrapper,
+                    )
+                    await websocket.send_json({
+                        "type": "welcome",
+                        "session_id": str(session.session_id),
+                        "resumed": resumed,
+                        "next_sample": session.next_sample,
+                    })
+                    logger.info(f"{'恢复' if resumed else '开始'}设备 {device_id} 的流会话 {session.session_id}，从采样位置 {session.next_sample} 继续。")
+                    feedback = FeedbackChannel(websocket, session, **stream_config)
+                    feedback.start()
+                elif session is not None:
+                    await session.handle_control(control)
+                else:
+                    if vad_wrapper is None:
+                        vad_wrapper = await create_vad_wrapper()
+                    await handle_stream_control(vad_wrapper, control)
+                continue
+            received_at = time.perf_counter()
+            uplink_bytes.inc(len(data))
+            # 解码为 PCM 后喂给 VAD 处理器
+            if session is not None:
+                session_id, sequence, sample_index, payload = parse_frame(data)
+                if session_id != session.session_id:
+                    raise FrameError(f"帧的会话 ID {session_id} 与连接的会话 {session.session_id} 不符")
+                pcm = decoder.decode(payload)
+                await session.feed(sequence, sample_index, pcm)
+                feedback.on_processed(len(pcm) // 2, time.perf_counter() - received_at)
+            else:
+                if vad_wrapper is None:
+                    vad_wrapper = await create_vad_wrapper()
+                await vad_wrapper.process(decoder.decode(data))
+            AUDIO_MESSAGE_LAG.observe(time.perf_counter() - received_at)
     except WebSocketDisconnect:
-        # 当客户端断开连接时，重置 VAD 状态
-        vad_wrapper.reset()
-        logger.info("WebSocket 连接已断开。")
+        if session is not None:
+            # 保留会话状态，客户端在宽限期内重连即可从中断处继续
+            stream_sessions.detach(session, connection_id)
+            logger.info(f"WebSocket 连接已断开，流会话 {session.session_id} 保留 {stream_sessions.grace_seconds} 秒。")
+        else:
+            if vad_wrapper is not None:
+                # 当客户端断开连接时，保存进行中的语音并重置 VAD 状态；之后的音频由客户端缓存补传
+                await vad_wrapper.flush()
+                vad_wrapper.reset()
+            logger.info("WebSocket 连接已断开。")
     except Exception:
-        # 发生其他异常时，同样重置 VAD 状态
-        vad_wrapper.reset()
         logger.error("WebSocket 发生错误", exc_info=True)
+        if session is not None:
+            stream_sessions.detach(session, connection_id)
+        elif vad_wrapper is not None:
+            # 发生其他异常时，保存已检测到、暂存待合并的片段后同样重置 VAD 状态
+            await vad_wrapper.save_pending()
+            vad_wrapper.reset()
+    finally:
+        if feedback is not None:
+            await feedback.close()
+        # 原始音频流的 VadWrapper 随连接结束，会话的 VadWrapper 在会话过期时释放
+        if vad_wrapper is not None:
+            vad_wrapper.close()
+        track_device(-1)
+        WEBSOCKET_STREAMS.dec()
+
+
+@app.post("/api/ingest/upload")
+async def ingest_upload(
+    request: Request,
+    captured_at: datetime,
+    codec: str = "wav",
+    device_id: Optional[str] = None,
+    upload_id: Optional[str] = None,
+):
+    """
+    补传客户端在断线期间缓存的一段音频。
+    请求体为音频内容，codec 为 wav 或 /vad 支持的上行编码；captured_at 为第一个采样的采集时间。
+    upload_id 标识这段音频，重复上传同一段时返回之前的结果，不会重复生成记录。
+    """
+    if not startup.is_ready("vad"):
+        raise HTTPException(status_code=503, detail="VAD 模型尚未就绪")
+    try:
+        device_id = validate_device_id(device_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    data = await request.body()
+    try:
+        return await backlog_ingestor.ingest(data, codec, captured_at, device_id, upload_id)
+    except UnsupportedCodecError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except (ValueError, EOFError, wave.Error) as e:
+        raise HTTPException(status_code=400, detail=f"无法解析上传的音频: {e}")
 
 
 @app.get("/api/records", response_model=List[SleepRecord])
-async def read_records_by_date(date: date):
+async def read_records_by_date(date: date, device_id: Optional[str] = None):
     """
-    获取指定日期的梦话记录。
+    获取指定日期的梦话记录，可按设备过滤。
     """
-    return get_records_by_date(date)
+    return get_records_by_date(date, device_id)
 
 
 @app.get("/api/records/activity", response_model=MonthlyActivity)
-async def read_record_activity(year: int, month: int):
+async def read_record_activity(year: int, month: int, device_id: Optional[str] = None):
     """
-    获取指定月份每日的梦话记录数量。
+    获取指定月份每日的梦话记录数量，可按设备过滤。
     """
-    return get_monthly_record_activity(year, month)
+    return get_monthly_record_activity(year, month, device_id)
 
 
 @app.get("/api/statistics", response_model=StatisticsResponse)
-async def read_statistics(start_date: Optional[date] = None, end_date: Optional[date] = None, days: Optional[int] = None):
+async def read_statistics(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    days: Optional[int] = None,
+    device_id: Optional[str] = None,
+):
     """
-    获取统计数据。
+    获取统计数据，可按设备过滤。
     """
     if days is not None and start_date is None and end_date is None:
         end_date = date.today()
         start_date = end_date - timedelta(days=days-1)
         
-    return get_statistics(start_date, end_date)
+    return get_statistics(start_date, end_date, device_id)
+
+
+@app.get("/api/devices", response_model=List[DeviceSummary])
+async def read_devices():
+    """
+    列出产生过记录或当前已连接的设备。
+    """
+    devices = {summary.device_id: summary for summary in get_device_summaries()}
+    for device in connected_devices:
+        device_id = None if device == "unknown" else device
+        devices.setdefault(device_id, DeviceSummary(device_id=device_id)).connected = True
+    return list(devices.values())
 
 
 class UpdateFavoriteRequest(BaseModel):
@@ -345,6 +691,91 @@ async def delete_single_record(record_id: str):
     return {"status": "success", "message": "Record deleted"}
 
 
+class BulkSelectorRequest(BaseModel):
+    """批量操作的记录选择器：指定 ids，或者指定日期范围及过滤条件。"""
+    ids: Optional[List[str]] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    is_favorite: Optional[bool] = None
+    tag: Optional[str] = None
+    device_id: Optional[str] = None
+
+    def selector(self) -> dict:
+        return self.model_dump(include=set(BulkSelectorRequest.model_fields))
+
+
+class BulkTagsRequest(BulkSelectorRequest):
+    add: List[str] = []
+    remove: List[str] = []
+
+
+@app.post("/api/records/bulk/favorite", response_model=BulkOperationResult)
+async def bulk_favorite(request: BulkSelectorRequest):
+    """
+    批量收藏记录。
+    """
+    return bulk_update_favorite_status(True, **request.selector())
+
+
+@app.post("/api/records/bulk/unfavorite", response_model=BulkOperationResult)
+async def bulk_unfavorite(request: BulkSelectorRequest):
+    """
+    批量取消收藏记录。
+    """
+    return bulk_update_favorite_status(False, **request.selector())
+
+
+@app.post("/api/records/bulk/tags", response_model=BulkOperationResult)
+async def bulk_tags(request: BulkTagsRequest):
+    """
+    批量为记录添加或移除标签。
+    """
+    return bulk_update_tags(request.add, request.remove, **request.selector())
+
+
+@app.post("/api/records/bulk/delete", response_model=BulkOperationResult)
+async def bulk_delete(request: BulkSelectorRequest):
+    """
+    批量删除记录及其音频文件。
+    """
+    return bulk_delete_records(storage_backend, **request.selector())
+
+
+@app.post("/api/retention/run", response_model=RetentionReport)
+async def run_retention_now(dry_run: bool = True):
+    """
+    立即执行一次保留策略清理。默认为 dry-run，只报告将被删除的记录。
+    """
+    return await asyncio.to_thread(run_retention, retention_policy, storage_backend, dry_run)
+
+
+@app.get("/api/stt/queue")
+async def read_stt_queue_status():
+    """
+    获取 STT 识别队列的积压情况：任务数、最早任务的等待时间，以及是否被调度策略推迟。
+    """
+    return await asyncio.to_thread(transcription_queue.status)
+
+
+@app.get("/api/export")
+async def export_records(start_date: date, end_date: date, format: str = "zip"):
+    """
+    以 ZIP 或 TAR 流的形式导出日期范围内的录音和记录清单 (manifest.jsonl)。
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format, expected one of {EXPORT_FORMATS}")
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+
+    filename = f"dream-talker_{start_date.isoformat()}_{end_date.isoformat()}.{format}"
+    media_type = "application/zip" if format == "zip" else "application/x-tar"
+    return StreamingResponse(
+        stream_export(storage_backend, start_date, end_date, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 @app.get("/api/audio/{record_id}")
 async def stream_audio_file(record_id: str, request: Request):
     """
@@ -353,6 +784,90 @@ async def stream_audio_file(record_id: str, request: Request):
     return get_audio_file_by_id(record_id, storage_backend, request)
 
 
+@app.get("/api/audio/{record_id}/peaks")
+async def read_audio_peaks(record_id: str):
+    """
+    获取音频的波形峰值，二进制格式为 int8 的 [min, max] 交错数组。
+    """
+    result = get_peaks_by_record_id(record_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Peaks not found")
+    peaks, samples_per_peak = result
+    return Response(
+        content=peaks,
+        media_type="application/octet-stream",
+        headers={
+            "X-Samples-Per-Peak": str(samples_per_peak),
+            "Cache-Control": "private, max-age=86400",
+        }
+    )
+
+
+# 事件流心跳间隔（秒），防止代理因长时间无数据而断开连接
+EVENTS_KEEPALIVE_SECONDS = 15
+
+@app.get("/api/events")
+async def stream_events(request: Request, last_event_id: Optional[int] = None):
+    """
+    以 Server-Sent Events 推送记录的新增、更新和删除事件。
+    断线重连时可通过 Last-Event-ID 请求头（或 last_event_id 参数）续传错过的事件。
+    """
+    header_id = request.headers.get("last-event-id")
+    if header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+
+    subscription = broker.subscribe(last_event_id)
+
+    async def event_generator():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=EVENTS_KEEPALIVE_SECONDS)
+                    yield event.to_sse()
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/admin/profile")
+async def profile_server(seconds: float = 10, mode: str = "sampler", output: str = "text"):
+    """
+    对运行中的服务进行限时性能剖析。
+    - mode=sampler: 采样所有线程的调用栈，返回折叠栈格式（可生成火焰图）
+    - mode=cprofile: 使用 cProfile 剖析事件循环线程，output=text 返回文本报告，output=pstats 返回二进制统计数据
+    """
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {MAX_PROFILE_SECONDS}]")
+    if mode not in ("sampler", "cprofile"):
+        raise HTTPException(status_code=400, detail="mode must be 'sampler' or 'cprofile'")
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    async with profile_lock:
+        logger.info(f"Starting {mode} profile for {seconds}s")
+        if mode == "sampler":
+            collapsed = await asyncio.to_thread(sample_stacks, seconds)
+            return PlainTextResponse(collapsed)
+
+        result = await profile_event_loop(seconds, output)
+        if output == "pstats":
+            return Response(
+                content=result,
+                media_type="application/octet-stream",
+                headers={"Content-Disposition": 'attachment; filename="profile.pstats"'}
+            )
+        return PlainTextResponse(result.decode("utf-8"))
+
+
 if __name__ == "__main__":
     # FIXME: reload 会监听 logs 文件
     uvicorn.run(
@@ -0,0 +1,167 @@
+"""
+客户端 → 服务器音频上行流的编解码。
+
+客户端连接 /vad 时通过查询参数 codec 选择编码（默认 pcm），服务器把收到的每条消息解码回
+16kHz 单声道 int16 PCM，再交给原有的 VAD 处理路径。
+
+- pcm:  原始 int16 PCM，每条消息即 PCM 字节（256 kbit/s）
+- flac: 无损；每条消息是一段独立完整的 FLAC 流，依赖 soundfile (libsndfile)
+- opus: 有损；每条消息包含若干个 20ms 的 Opus 包，每个包前带 2 字节大端长度，依赖 opuslib (libopus)
+
+编码器在这里也实现了一份，供 codec_bench.py 使用；client/codec.py 中的编码器与此处的格式保持一致。
+"""
+import io
+import struct
+from typing import List
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Opus 每个包的时长：20ms
+OPUS_FRAME_SAMPLES = SAMPLE_RATE // 50
+OPUS_LENGTH_PREFIX = struct.Struct(">H")
+
+CODECS = ("pcm", "flac", "opus")
+
+
+class UnsupportedCodecError(ValueError):
+    """请求的编码未知，或服务器缺少对应的解码库。"""
+
+
+class PcmDecoder:
+    codec = "pcm"
+
+    def decode(self, data: bytes) -> bytes:
+        return data
+
+
+class FlacDecoder:
+    codec = "flac"
+
+    def __init__(self):
+        import soundfile
+        self._soundfile = soundfile
+
+    def decode(self, data: bytes) -> bytes:
+        samples, _ = self._soundfile.read(io.BytesIO(data), dtype="int16")
+        return samples.tobytes()
+
+
+class OpusDecoder:
+    """Opus 解码器是有状态的（包间预测），每条连接使用一个实例。"""
+    codec = "opus"
+
+    def __init__(self):
+        import opuslib
+        self._decoder = opuslib.Decoder(SAMPLE_RATE, 1)
+
+    def decode(self, data: bytes) -> bytes:
+        pcm = bytearray()
+        offset = 0
+        while offset < len(data):
+            (length,) = OPUS_LENGTH_PREFIX.unpack_from(data, offset)
+            offset += OPUS_LENGTH_PREFIX.size
+            pcm += self._decoder.decode(data[offset:offset + length], OPUS_FRAME_SAMPLES)
+            offset += length
+        return bytes(pcm)
+
+
+class PcmEncoder:
+    codec = "pcm"
+
+    def encode(self, samples: np.ndarray) -> List[bytes]:
+        return [samples.astype(np.int16).tobytes()] if len(samples) else []
+
+    def flush(self) -> List[bytes]:
+        return []
+
+
+class FlacEncoder:
+    """攒够 block_samples 个采样后编码成一段独立的 FLAC 流；块太小时 FLAC 的头部开销会抵消压缩收益。"""
+    codec = "flac"
+
+    def __init__(self, block_samples: int = SAMPLE_RATE // 2):
+        import soundfile
+        self._soundfile = soundfile
+        self.block_samples = block_samples
+        self._pending = np.zeros(0, dtype=np.int16)
+
+    def _encode_block(self, block: np.ndarray) -> bytes:
+        buffer = io.BytesIO()
+        self._soundfile.write(buffer, block, SAMPLE_RATE, format="FLAC", subtype="PCM_16")
+        return buffer.getvalue()
+
+    def encode(self, samples: np.ndarray) -> List[bytes]:
+        self._pending = np.concatenate([self._pending, samples.astype(np.int16)])
+        messages = []
+        while len(self._pending) >= self.block_samples:
+            messages.append(self._encode_block(self._pending[:self.block_samples]))
+            self._pending = self._pending[self.block_samples:]
+        return messages
+
+    def flush(self) -> List[bytes]:
+        if not len(self._pending):
+            return []
+        block, self._pending = self._pending, np.zeros(0, dtype=np.int16)
+        return [self._encode_block(block)]
+
+
+class OpusEncoder:
+    """按 20ms 一包编码，每攒够 frames_per_message 个包发送一条消息。"""
+    codec = "opus"
+
+    def __init__(self, bitrate: int = 24000, frames_per_message: int = 5):
+        import opuslib
+        self._encoder = opuslib.Encoder(SAMPLE_RATE, 1, opuslib.APPLICATION_VOIP)
+        self._encoder.bitrate = bitrate
+        self.frames_per_message = frames_per_message
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._packets: List[bytes] = []
+
+    def _take_message(self) -> bytes:
+        message = b"".join(OPUS_LENGTH_PREFIX.pack(len(p)) + p for p in self._packets)
+        self._packets = []
+        return message
+
+    def encode(self, samples: np.ndarray) -> List[bytes]:
+        self._pending = np.concatenate([self._pending, samples.astype(np.int16)])
+        messages = []
+        while len(self._pending) >= OPUS_FRAME_SAMPLES:
+            frame = self._pending[:OPUS_FRAME_SAMPLES]
+            self._pending = self._pending[OPUS_FRAME_SAMPLES:]
+            self._packets.append(self._encoder.encode(frame.tobytes(), OPUS_FRAME_SAMPLES))
+            if len(self._packets) >= self.frames_per_message:
+                messages.append(self._take_message())
+        return messages
+
+    def flush(self) -> List[bytes]:
+        if len(self._pending):
+            # 最后不足一包的部分补静音
+            frame = np.zeros(OPUS_FRAME_SAMPLES, dtype=np.int16)
+            frame[:len(self._pending)] = self._pending
+            self._pending = np.zeros(0, dtype=np.int16)
+            self._packets.append(self._encoder.encode(frame.tobytes(), OPUS_FRAME_SAMPLES))
+        return [self._take_message()] if self._packets else []
+
+
+_DECODERS = {"pcm": PcmDecoder, "flac": FlacDecoder, "opus": OpusDecoder}
+_ENCODERS = {"pcm": PcmEncoder, "flac": FlacEncoder, "opus": OpusEncoder}
+
+
+def _create(registry: dict, codec: str, **kwargs):
+    cls = registry.get(codec)
+    if cls is None:
+        raise UnsupportedCodecError(f"Unknown audio codec '{codec}', expected one of {CODECS}")
+    try:
+        return cls(**kwargs)
+    except (ImportError, OSError) as e:
+        # OSError: 已安装 Python 包但找不到 libsndfile / libopus
+        raise UnsupportedCodecError(f"Audio codec '{codec}' is not available: {e}") from e
+
+
+def get_decoder(codec: str):
+    return _create(_DECODERS, codec)
+
+
+def get_encoder(codec: str, **kwargs):
+    return _create(_ENCODERS, codec, **kwargs)
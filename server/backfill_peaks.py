@@ -0,0 +1,101 @@
+"""
+为已有录音补算波形峰值。
+
+用法:
+    python backfill_peaks.py [--workers 8] [--batch-size 100]
+
+从存储后端并行读取尚未计算峰值的音频，计算后分批写入 record_peaks 表。
+"""
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from config import load_config
+from database import get_db_connection, init_db
+from log import init_log
+from storage import StorageBackend, get_storage_backend
+from waveform import compute_peaks_from_wav, SAMPLES_PER_PEAK
+
+logger = logging.getLogger(__name__)
+
+
+def _read_all(stream) -> bytes:
+    try:
+        return stream.read()
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+        if hasattr(stream, 'release_conn'):
+            stream.release_conn()
+
+
+def _compute_for_record(storage: StorageBackend, record_id: str, audio_url: str) -> Optional[Tuple[str, bytes]]:
+    """读取单条录音并计算峰值。在线程池中运行：存储读取为 I/O，NumPy 计算会释放 GIL。"""
+    stream = storage.get_stream(audio_url)
+    if stream is None:
+        logger.warning(f"Audio not found for record {record_id}: {audio_url}")
+        return None
+    try:
+        return record_id, compute_peaks_from_wav(_read_all(stream))
+    except Exception as e:
+        logger.error(f"Failed to compute peaks for record {record_id}: {e}")
+        return None
+
+
+def _fetch_pending(batch_size: int, skip: set) -> List[Tuple[str, str]]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT r.id, r.audio_url
+            FROM records r
+            LEFT JOIN record_peaks p ON r.id = p.record_id
+            WHERE p.record_id IS NULL
+            ORDER BY r.timestamp DESC
+            LIMIT ?
+            """,
+            (batch_size + len(skip),)
+        )
+        rows = [(row['id'], row['audio_url']) for row in cursor.fetchall()]
+    return [row for row in rows if row[0] not in skip][:batch_size]
+
+
+def backfill_peaks(storage: StorageBackend, workers: int = 8, batch_size: int = 100) -> int:
+    """
+    为所有缺少峰值的记录补算峰值。
+    :return: 成功写入的记录数
+    """
+    done = 0
+    failed = set() # 读取或计算失败的记录，本次运行中不再重试
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            pending = _fetch_pending(batch_size, failed)
+            if not pending:
+                break
+
+            results = list(executor.map(lambda row: _compute_for_record(storage, *row), pending))
+            computed = [result for result in results if result is not None]
+            failed.update(record_id for (record_id, _), result in zip(pending, results) if result is None)
+
+            with get_db_connection() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO record_peaks (record_id, samples_per_peak, peaks) VALUES (?, ?, ?)",
+                    [(record_id, SAMPLES_PER_PEAK, peaks) for record_id, peaks in computed]
+                )
+                conn.commit()
+            done += len(computed)
+            logger.info(f"Backfilled peaks for {done} records ({len(failed)} failed).")
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="为已有录音补算波形峰值")
+    parser.add_argument("--workers", type=int, default=8, help="并行读取和计算的线程数")
+    parser.add_argument("--batch-size", type=int, default=100, help="每批写入数据库的记录数")
+    args = parser.parse_args()
+
+    init_log()
+    init_db()
+    storage = get_storage_backend(load_config().get('storage', {}))
+    backfill_peaks(storage, workers=args.workers, batch_size=args.batch_size)
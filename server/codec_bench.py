@@ -0,0 +1,184 @@
+"""
+上行音频编码基准。
+
+按客户端的发送方式（每次约 21ms 的录音块）把 WAV 文件逐块编码、再由服务器端解码，报告：
+- 上行码率 (kbit/s) 及相对 PCM 的压缩比
+- 客户端编码与服务器解码的 CPU 耗时（占音频时长的百分比）
+- VAD：解码后音频检测到的片段数，以及与原始 PCM 检测结果逐帧比较的语音重合度 (IoU)
+- STT（--stt）：按原始 PCM 的片段边界识别解码后的音频，相对原始 PCM 识别结果的字错误率 (CER)
+
+用法:
+    python codec_bench.py night.wav more_recordings/ --codecs pcm,flac,opus --opus-bitrate 16000,24000 --stt
+"""
+import argparse
+import asyncio
+import io
+import time
+import wave
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from audio_codec import get_encoder, get_decoder, UnsupportedCodecError
+from config import load_config
+from vad_replay import SAMPLE_RATE, load_pcm, segment_pcm, _collect_files, _init_worker
+
+# 客户端录音块：48kHz 下 1024 帧，重采样到 16kHz 后约 341 个采样
+CLIENT_BLOCK_SAMPLES = 341
+# 比较 VAD 结果时的帧长 (10ms)
+IOU_FRAME_SECONDS = 0.01
+
+
+def _codec_variants(args) -> List[Tuple[str, str, Dict]]:
+    """展开为 (显示名称, 编码, 编码器参数) 列表。"""
+    variants = []
+    for codec in args.codecs.split(","):
+        if codec == "opus":
+            for bitrate in args.opus_bitrate.split(","):
+                variants.append((f"opus@{int(bitrate) // 1000}k", codec, {"bitrate": int(bitrate)}))
+        elif codec == "flac":
+            variants.append((codec, codec, {"block_samples": args.flac_block_samples}))
+        else:
+            variants.append((codec, codec, {}))
+    return variants
+
+
+def roundtrip(pcm: np.ndarray, codec: str, encoder_kwargs: Dict) -> Tuple[np.ndarray, int, float, float]:
+    """
+    模拟一条连接：逐块编码、逐条消息解码。
+    返回 (解码后的 PCM, 上行字节数, 编码 CPU 秒数, 解码 CPU 秒数)。
+    """
+    encoder = get_encoder(codec, **encoder_kwargs)
+    decoder = get_decoder(codec)
+
+    start = time.process_time()
+    messages = []
+    for offset in range(0, len(pcm), CLIENT_BLOCK_SAMPLES):
+        messages.extend(encoder.encode(pcm[offset:offset + CLIENT_BLOCK_SAMPLES]))
+    messages.extend(encoder.flush())
+    encode_seconds = time.process_time() - start
+
+    start = time.process_time()
+    decoded = b"".join(decoder.decode(message) for message in messages)
+    decode_seconds = time.process_time() - start
+
+    decoded_pcm = np.frombuffer(decoded, dtype=np.int16)[:len(pcm)]
+    return decoded_pcm, sum(len(m) for m in messages), encode_seconds, decode_seconds
+
+
+def speech_iou(reference: List[Tuple[float, float]], candidate: List[Tuple[float, float]], duration: float) -> float:
+    frames = int(duration / IOU_FRAME_SECONDS) + 1
+
+    def mask(segments):
+        m = np.zeros(frames, dtype=bool)
+        for start, end in segments:
+            m[int(start / IOU_FRAME_SECONDS):int(end / IOU_FRAME_SECONDS) + 1] = True
+        return m
+
+    a, b = mask(reference), mask(candidate)
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+
+def character_error_rate(reference: str, hypothesis: str) -> float:
+    """编辑距离 / 参考文本长度，按字符计算。"""
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    previous = list(range(len(hypothesis) + 1))
+    for i, r in enumerate(reference, 1):
+        current = [i]
+        for j, h in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1] / len(reference)
+
+
+def _wav_bytes(pcm: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+async def transcribe_segments(stt_engine, pcm: np.ndarray, segments: List[Tuple[float, float]]) -> List[str]:
+    texts = []
+    for start, end in segments:
+        clip = pcm[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        texts.append(await stt_engine.transcribe_bytes(_wav_bytes(clip)))
+    return texts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比较上行音频编码的码率、CPU 开销以及对 VAD/STT 的影响")
+    parser.add_argument("paths", nargs="+", help="16kHz 单声道 WAV 文件或包含 WAV 文件的目录")
+    parser.add_argument("--codecs", default="pcm,flac,opus", help="逗号分隔的编码列表")
+    parser.add_argument("--opus-bitrate", dest="opus_bitrate", default="16000,24000,32000", help="逗号分隔的 Opus 码率 (bit/s)")
+    parser.add_argument("--flac-block-samples", dest="flac_block_samples", type=int, default=SAMPLE_RATE // 2)
+    parser.add_argument("--stt", action="store_true", help="同时比较 STT 结果（使用 .config.yaml 中的 stt 配置，不经过缓存）")
+    args = parser.parse_args()
+
+    config = load_config()
+    vad_params = config.get("vad", {})
+    stt_engine = None
+    if args.stt:
+        from stt import get_stt_engine
+        stt_engine = get_stt_engine({**config.get("stt", {}), "cache": {"enabled": False}})
+
+    _init_worker()
+    files = _collect_files(args.paths)
+    pcms = {path: load_pcm(path) for path in files}
+    total_audio = sum(len(pcm) for pcm in pcms.values()) / SAMPLE_RATE
+
+    # 原始 PCM 的 VAD 与 STT 结果作为参考
+    references = {}
+    for path, pcm in pcms.items():
+        segments, _ = segment_pcm(vad_params, pcm)
+        texts = asyncio.run(transcribe_segments(stt_engine, pcm, segments)) if stt_engine else []
+        references[path] = (segments, texts)
+    print(f"{len(files)} 个文件，共 {total_audio:.0f}s 音频，参考 VAD 片段 {sum(len(s) for s, _ in references.values())} 个。\n")
+
+    header = f"{'codec':<12} {'kbit/s':>8} {'ratio':>7} {'enc_cpu%':>9} {'dec_cpu%':>9} {'segments':>8} {'vad_iou':>8}"
+    if stt_engine:
+        header += f" {'cer':>7}"
+    print(header)
+    print("-" * len(header))
+
+    for name, codec, encoder_kwargs in _codec_variants(args):
+        total_bytes = encode_cpu = decode_cpu = 0.0
+        segment_count = 0
+        iou_weighted = 0.0
+        errors = reference_chars = 0.0
+        try:
+            for path, pcm in pcms.items():
+                decoded, size, encode_seconds, decode_seconds = roundtrip(pcm, codec, encoder_kwargs)
+                total_bytes += size
+                encode_cpu += encode_seconds
+                decode_cpu += decode_seconds
+
+                duration = len(pcm) / SAMPLE_RATE
+                reference_segments, reference_texts = references[path]
+                segments, _ = segment_pcm(vad_params, decoded)
+                segment_count += len(segments)
+                iou_weighted += speech_iou(reference_segments, segments, duration) * duration
+
+                if stt_engine:
+                    texts = asyncio.run(transcribe_segments(stt_engine, decoded, reference_segments))
+                    for reference, hypothesis in zip(reference_texts, texts):
+                        errors += character_error_rate(reference, hypothesis) * max(len(reference), 1)
+                        reference_chars += max(len(reference), 1)
+        except UnsupportedCodecError as e:
+            print(f"{name:<12} skipped: {e}")
+            continue
+
+        kbps = total_bytes * 8 / total_audio / 1000
+        line = (
+            f"{name:<12} {kbps:>8.1f} {SAMPLE_RATE * 16 / 1000 / kbps:>7.1f} "
+            f"{encode_cpu / total_audio * 100:>9.3f} {decode_cpu / total_audio * 100:>9.3f} "
+            f"{segment_count:>8} {iou_weighted / total_audio:>8.3f}"
+        )
+        if stt_engine:
+            line += f" {errors / reference_chars if reference_chars else 0:>7.3f}"
+        print(line)
@@ -0,0 +1,18 @@
+import os
+import yaml
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '.config.yaml')
+# 数据目录（数据库和本地录音），可通过环境变量 DREAM_TALKER_DATA_DIR 指向其他位置，例如压测时使用独立目录
+DATA_DIR = os.getenv("DREAM_TALKER_DATA_DIR", os.path.join(os.path.dirname(__file__), 'data'))
+
+
+def load_config(config_path: str = None) -> dict:
+    """
+    加载 YAML 配置文件。
+    路径优先级：参数 > 环境变量 DREAM_TALKER_CONFIG > server/.config.yaml
+    """
+    config_path = config_path or os.getenv("DREAM_TALKER_CONFIG", CONFIG_PATH)
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
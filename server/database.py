@@ -1,22 +1,97 @@
+import json
 import sqlite3
 import logging
 import os
+import re
+import time
 from datetime import datetime
+from functools import lru_cache
 from typing import List
 import uuid
 from schemas import SleepRecordCreate
+from config import DATA_DIR
+from events import broker, RECORD_CREATED
+from metrics import SQL_QUERY
 
 logger = logging.getLogger(__name__)
 
-DB_FILE = os.path.join(os.path.dirname(__file__), 'data', 'dream_talker.db')
+DB_FILE = os.path.join(DATA_DIR, 'dream_talker.db')
+
+# 慢查询阈值（秒），超过此耗时的 SQL 语句会被记录到日志
+SLOW_QUERY_THRESHOLD = 0.1
+
+def set_slow_query_threshold(threshold_ms: float):
+    """设置慢查询日志的阈值（毫秒）。"""
+    global SLOW_QUERY_THRESHOLD
+    SLOW_QUERY_THRESHOLD = threshold_ms / 1000.0
+
+_TABLE_PATTERN = re.compile(
+    r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+NOT\s+EXISTS\s+|IF\s+EXISTS\s+)?(\w+)",
+    re.IGNORECASE
+)
+
+@lru_cache(maxsize=512)
+def _statement_label(sql: str) -> str:
+    """将 SQL 语句归一化为 "动词 表名" 形式的指标标签，例如 "SELECT records"。"""
+    words = sql.split(None, 1)
+    if not words:
+        return "OTHER"
+    verb = words[0].upper()
+    match = _TABLE_PATTERN.search(sql)
+    return f"{verb} {match.group(1)}" if match else verb
+
+def _observe_query(sql: str, parameters, elapsed: float):
+    """记录 SQL 耗时指标，超过阈值时输出慢查询日志。"""
+    SQL_QUERY.labels(_statement_label(sql)).observe(elapsed)
+    if elapsed >= SLOW_QUERY_THRESHOLD:
+        params_repr = repr(parameters)
+        if len(params_repr) > 200:
+            params_repr = params_repr[:200] + "..."
+        logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {' '.join(sql.split())} with params: {params_repr}")
+
+class TimedCursor(sqlite3.Cursor):
+    """记录每条语句执行耗时的游标。"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe_query(sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe_query(sql, "<executemany>", time.perf_counter() - start)
+
+class TimedConnection(sqlite3.Connection):
+    """默认使用 TimedCursor 的数据库连接。"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
 
 def get_db_connection():
     """获取数据库连接"""
     os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
+def _ensure_column(cursor, table: str, column: str, definition: str):
+    """为已存在的表补充新增的列（CREATE TABLE IF NOT EXISTS 不会修改旧表）。"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row['name'] for row in cursor.fetchall()}:
+        logger.info(f"Adding column {table}.{column}")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
 def init_db():
     """初始化数据库，创建表结构"""
     logger.info("Initializing database...")
@@ -40,6 +115,13 @@ def init_db():
             );
             """)
 
+            # 识别状态: done 已识别, pending 等待 STT 队列, failed 多次识别失败
+            _ensure_column(cursor, "records", "transcription_status", "TEXT NOT NULL DEFAULT 'done'")
+            # 采集设备 ID，多个房间的麦克风接入同一服务器时区分记录；旧记录为 NULL
+            _ensure_column(cursor, "records", "device_id", "TEXT")
+            # 合并记录中各子片段的位置 (JSON 数组)，未合并的记录为 NULL
+            _ensure_column(cursor, "records", "segments", "TEXT")
+
             # 创建 tags 表
             cursor.execute("""
             CREATE TABLE IF NOT EXISTS tags (
@@ -72,6 +154,79 @@ def init_db():
             );
             """)
 
+            # 创建 record_peaks 表，存储预先计算的波形峰值 (int8 min/max 交错)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS record_peaks (
+                record_id TEXT PRIMARY KEY,
+                samples_per_peak INTEGER NOT NULL,
+                peaks BLOB NOT NULL,
+                FOREIGN KEY (record_id) REFERENCES records(id) ON DELETE CASCADE
+            );
+            """)
+
+            # 创建 reprocess_jobs 表，记录批量重新识别任务的进度，用于断点续跑
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reprocess_jobs (
+                name TEXT PRIMARY KEY,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                last_timestamp TEXT,
+                last_id TEXT,
+                processed INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                finished_at TEXT
+            );
+            """)
+
+            # 创建 stt_jobs 表，持久化等待识别的语音片段，服务重启或 STT 崩溃后可以继续识别
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stt_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                record_id TEXT UNIQUE NOT NULL,
+                audio_url TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                duration REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                FOREIGN KEY (record_id) REFERENCES records(id) ON DELETE CASCADE
+            );
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_stt_jobs_status ON stt_jobs (status, id);")
+
+            # 创建 stt_cache 表，按音频内容哈希缓存识别结果
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stt_cache (
+                key TEXT PRIMARY KEY,
+                model_id TEXT NOT NULL,
+                transcription TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                last_used_at TEXT NOT NULL
+            );
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_stt_cache_last_used ON stt_cache (last_used_at);")
+
+            # 创建 ingested_uploads 表，记录已处理的补传音频，客户端超时后重传同一段时直接返回之前的结果
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingested_uploads (
+                key TEXT PRIMARY KEY,
+                device_id TEXT,
+                captured_at TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            );
+            """)
+
+            # 按时间查找记录（日期查询、保留策略清理）所用的索引
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_records_timestamp ON records (timestamp);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_records_favorite_timestamp ON records (is_favorite, timestamp);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_record_tags_tag_id ON record_tags (tag_id);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_records_device_timestamp ON records (device_id, timestamp);")
+
             # 创建 webauthn_credentials 表
             cursor.execute("""
             CREATE TABLE IF NOT EXISTS webauthn_credentials (
@@ -102,8 +257,8 @@ def add_record(record_data: SleepRecordCreate):
     record_id = str(uuid.uuid4())
 
     sql_insert_record = """
-    INSERT INTO records (id, timestamp, duration, audio_url, transcription, confidence, is_favorite, created_at, updated_at)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+    INSERT INTO records (id, timestamp, duration, audio_url, transcription, confidence, is_favorite, transcription_status, device_id, segments, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
     """
     
     record_tuple = (
@@ -114,6 +269,9 @@ def add_record(record_data: SleepRecordCreate):
         record_data.transcription,
         record_data.confidence,
         0,  # is_favorite 默认为 0
+        record_data.transcription_status,
+        record_data.device_id,
+        json.dumps(record_data.segments) if record_data.segments else None,
         now,
         now
     )
@@ -139,14 +297,47 @@ def add_record(record_data: SleepRecordCreate):
                 
                 # 插入关联表
                 cursor.execute("INSERT INTO record_tags (record_id, tag_id) VALUES (?, ?);", (record_id, tag_id))
+
+            # 保存波形峰值
+            if record_data.peaks:
+                cursor.execute(
+                    "INSERT INTO record_peaks (record_id, samples_per_peak, peaks) VALUES (?, ?, ?);",
+                    (record_id, record_data.samples_per_peak, record_data.peaks)
+                )
+
+            # 等待识别的记录在同一事务中写入识别任务，保证音频一旦有记录就不会丢失识别
+            if record_data.transcription_status == "pending":
+                cursor.execute(
+                    """
+                    INSERT INTO stt_jobs (record_id, audio_url, timestamp, duration, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?);
+                    """,
+                    (record_id, record_data.audio_url, record_data.timestamp, record_data.duration, now, now)
+                )
             
             conn.commit()
             logger.info(f"Successfully added record with ID: {record_id}")
-            return record_id
     except sqlite3.Error as e:
         logger.error(f"Failed to add record: {e}")
         return None
 
+    broker.publish(RECORD_CREATED, {
+        "record": {
+            "id": record_id,
+            "timestamp": record_data.timestamp,
+            "duration": record_data.duration,
+            "audio_url": record_data.audio_url,
+            "transcription": record_data.transcription,
+            "confidence": record_data.confidence,
+            "is_favorite": False,
+            "tags": record_data.tags,
+            "transcription_status": record_data.transcription_status,
+            "device_id": record_data.device_id,
+            "segments": record_data.segments,
+        }
+    })
+    return record_id
+
 if __name__ == '__main__':
     # 作为脚本运行时，初始化数据库
     init_log_path = os.path.join(os.path.dirname(__file__), 'log.py')
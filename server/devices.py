@@ -0,0 +1,31 @@
+"""
+多设备接入。
+
+每个客户端（例如不同房间的麦克风）在 /vad 握手或补传时带上设备 ID，记录按设备保存，
+记录和统计接口可以按设备过滤。配置文件的 devices 段可以按设备覆盖 vad 段的参数：
+
+    devices:
+      bedroom:
+        vad:
+          threshold: 0.3
+"""
+import re
+from typing import Optional
+
+DEVICE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def validate_device_id(device_id: Optional[str]) -> Optional[str]:
+    """校验客户端上报的设备 ID，空值视为未指定设备。"""
+    if not device_id:
+        return None
+    if not DEVICE_ID_PATTERN.match(device_id):
+        raise ValueError(f"无效的设备 ID: {device_id!r}，只能包含字母、数字、'_'、'-'、'.'，最长 64 个字符")
+    return device_id
+
+
+def device_vad_overrides(devices_config: Optional[dict], device_id: Optional[str]) -> dict:
+    """设备覆盖的 vad 参数，未配置时为空。"""
+    if device_id is None:
+        return {}
+    return ((devices_config or {}).get(device_id) or {}).get("vad") or {}
@@ -0,0 +1,124 @@
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 事件类型
+RECORD_CREATED = "record.created"
+RECORD_UPDATED = "record.updated"
+RECORD_DELETED = "record.deleted"
+# 流式识别的中间结果，只推送给在线的订阅者，不进入历史
+RECORD_PARTIAL = "record.partial"
+# 订阅者队列溢出或请求的事件已不在历史中时发送，客户端应重新拉取完整数据
+RESYNC = "resync"
+
+
+@dataclass
+class Event:
+    id: int
+    type: str
+    data: dict
+
+    def to_sse(self) -> str:
+        """序列化为 Server-Sent Events 格式。"""
+        payload = json.dumps(self.data, ensure_ascii=False)
+        return f"id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n"
+
+
+class Subscription:
+    """单个订阅者，持有一个有界队列。"""
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def _deliver(self, event: Event):
+        """在事件循环线程中调用。队列满时丢弃积压的事件，改为发送一个 resync 事件。"""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(Event(id=event.id, type=RESYNC, data={"reason": "overflow"}))
+
+    async def get(self) -> Event:
+        return await self.queue.get()
+
+
+class EventBroker:
+    """
+    进程内的发布/订阅中心。
+    保留最近的事件历史，以便客户端断线重连后根据 Last-Event-ID 续传。
+    publish 可以在任意线程中调用（例如在 asyncio.to_thread 中执行的数据库操作）。
+    """
+
+    def __init__(self, history_size: int = 1000, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._history: Deque[Event] = deque(maxlen=history_size)
+        self._subscribers: Set[Subscription] = set()
+        self._lock = threading.Lock()
+        # 以启动时的毫秒时间戳作为起始 ID，使服务重启后的事件 ID 仍然单调递增
+        self._ids = itertools.count(int(time.time() * 1000))
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """绑定事件循环，订阅者队列只能在该循环中操作。"""
+        self._loop = loop
+
+    def publish(self, event_type: str, data: dict, transient: bool = False):
+        """
+        发布事件。
+        :param transient: 为 True 时不写入历史，断线重连的客户端不会补收（用于高频的中间结果）
+        """
+        with self._lock:
+            event = Event(id=next(self._ids), type=event_type, data=data)
+            if not transient:
+                self._history.append(event)
+            subscribers = list(self._subscribers)
+
+        if self._loop is None or not subscribers:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for subscription in subscribers:
+            if running is self._loop:
+                subscription._deliver(event)
+            else:
+                try:
+                    self._loop.call_soon_threadsafe(subscription._deliver, event)
+                except RuntimeError:
+                    # 事件循环已关闭
+                    pass
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Subscription:
+        """
+        创建订阅。若提供 last_event_id，先补发此后的历史事件；
+        若历史中已找不到该 ID 之后的连续事件，则先发送 resync。
+        """
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                missed = [event for event in self._history if event.id > last_event_id]
+                oldest = self._history[0].id if self._history else None
+                if oldest is None or last_event_id < oldest - 1:
+                    subscription._deliver(Event(id=last_event_id, type=RESYNC, data={"reason": "history_expired"}))
+                for event in missed:
+                    subscription._deliver(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+# 全局事件中心
+broker = EventBroker()
@@ -0,0 +1,261 @@
+import io
+import json
+import logging
+import tarfile
+import time
+import zipfile
+from datetime import date, datetime
+from typing import Generator, Iterator, Optional, Set, Tuple
+
+from database import get_db_connection
+from storage import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+# 分页读取记录，每页查询完即释放数据库读锁，避免长时间导出阻塞录音写入
+EXPORT_PAGE_SIZE = 100
+MANIFEST_NAME = "manifest.jsonl"
+EXPORT_FORMATS = ("zip", "tar")
+
+
+class _StreamSink(io.RawIOBase):
+    """
+    一个只写、不可 seek 的缓冲区。
+    zipfile 检测到输出不可 seek 时会使用 data descriptor 流式写入，
+    每写完一块数据我们就把缓冲区内容取走并交给 HTTP 响应。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._buffer.extend(b)
+        return len(b)
+
+    def drain(self) -> Iterator[bytes]:
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            yield data
+
+
+def _iter_record_rows(
+    start_date: date,
+    end_date: date,
+    created_before: Optional[str] = None,
+    until: Optional[Tuple[str, str]] = None,
+) -> Iterator[dict]:
+    """
+    按 (timestamp, id) 键集分页遍历日期范围内的记录。
+    :param created_before: 只包含在该时间（UTC ISO 格式）之前创建的记录
+    :param until: 只包含键不大于 (timestamp, id) 的记录
+    """
+    last_timestamp, last_id = "", ""
+    extra_sql, extra_params = "", []
+    if created_before is not None:
+        extra_sql += " AND r.created_at <= ?"
+        extra_params.append(created_before)
+    if until is not None:
+        extra_sql += " AND (r.timestamp < ? OR (r.timestamp = ? AND r.id <= ?))"
+        extra_params.extend([until[0], until[0], until[1]])
+    while True:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT r.id, r.timestamp, r.duration, r.audio_url, r.transcription, r.confidence,
+                       r.is_favorite, r.device_id, r.segments, r.created_at, r.updated_at,
+                       (SELECT GROUP_CONCAT(t.name) FROM record_tags rt JOIN tags t ON rt.tag_id = t.id
+                        WHERE rt.record_id = r.id) AS tags
+                FROM records r
+                WHERE SUBSTR(r.timestamp, 1, 10) BETWEEN ? AND ?
+                  AND (r.timestamp > ? OR (r.timestamp = ? AND r.id > ?)){extra_sql}
+                ORDER BY r.timestamp ASC, r.id ASC
+                LIMIT ?
+                """,
+                (
+                    start_date.strftime('%Y-%m-%d'),
+                    end_date.strftime('%Y-%m-%d'),
+                    last_timestamp, last_timestamp, last_id,
+                    *extra_params,
+                    EXPORT_PAGE_SIZE,
+                )
+            )
+            rows = cursor.fetchall()
+
+        for row in rows:
+            record = dict(row)
+            record['is_favorite'] = bool(record['is_favorite'])
+            record['tags'] = record['tags'].split(',') if record['tags'] else []
+            record['segments'] = json.loads(record['segments']) if record['segments'] else None
+            yield record
+
+        if len(rows) < EXPORT_PAGE_SIZE:
+            return
+        last_timestamp, last_id = rows[-1]['timestamp'], rows[-1]['id']
+
+
+class _ExportPass:
+    """
+    导出音频的一遍遍历。清单在音频之后按相同的查询再遍历一遍生成，不在内存中累积；
+    这里只记下范围（开始时间、最后一条记录的键）和缺少音频的记录，保证两遍看到的是同一批记录。
+    """
+
+    def __init__(self, start_date: date, end_date: date):
+        self.start_date = start_date
+        self.end_date = end_date
+        # 导出开始后新写入的记录（例如补传的历史音频）不在本次导出中
+        self.created_before = datetime.utcnow().isoformat()
+        self.last_key: Optional[Tuple[str, str]] = None
+        self.missing: Set[str] = set() # 缺少音频的记录 ID，通常为空
+
+    def records(self) -> Iterator[dict]:
+        for record in _iter_record_rows(self.start_date, self.end_date, self.created_before):
+            self.last_key = (record['timestamp'], record['id'])
+            yield record
+
+    def manifest_lines(self) -> Iterator[bytes]:
+        """第二遍：逐行生成清单。音频导出之后被删除的记录不出现在清单中。"""
+        if self.last_key is None:
+            return
+        for record in _iter_record_rows(self.start_date, self.end_date, self.created_before, self.last_key):
+            archive_path = None if record['id'] in self.missing else _archive_path(record)
+            yield _manifest_line(record, archive_path)
+
+
+def _iter_audio_chunks(stream) -> Iterator[bytes]:
+    """兼容 MinIO 的 HTTPResponse 和本地文件对象，按块读取音频数据。"""
+    try:
+        if hasattr(stream, 'stream'):
+            yield from stream.stream(EXPORT_CHUNK_SIZE)
+        else:
+            while True:
+                chunk = stream.read(EXPORT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+        if hasattr(stream, 'release_conn'):
+            stream.release_conn()
+
+
+def _archive_path(record: dict) -> str:
+    return f"audio/{record['audio_url'].replace(chr(92), '/')}"
+
+
+def _record_mtime(record: dict) -> float:
+    try:
+        return datetime.fromisoformat(record['timestamp']).timestamp()
+    except ValueError:
+        return time.time()
+
+
+def _manifest_line(record: dict, archive_path: Optional[str]) -> bytes:
+    entry = dict(record, archive_path=archive_path)
+    return (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _stream_zip(storage: StorageBackend, start_date: date, end_date: date) -> Generator[bytes, None, None]:
+    sink = _StreamSink()
+    export = _ExportPass(start_date, end_date)
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        for record in export.records():
+            stream = storage.get_stream(record['audio_url'])
+            if stream is None:
+                logger.warning(f"Audio missing for record {record['id']}, skipped in export: {record['audio_url']}")
+                export.missing.add(record['id'])
+                continue
+
+            archive_path = _archive_path(record)
+            zinfo = zipfile.ZipInfo(archive_path, date_time=time.localtime(_record_mtime(record))[:6])
+            # WAV 几乎无法压缩，直接存储以节省 CPU
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with zf.open(zinfo, mode="w") as dest:
+                for chunk in _iter_audio_chunks(stream):
+                    dest.write(chunk)
+                    yield from sink.drain()
+
+        # 流式写入时使用 data descriptor，清单不需要预先知道大小，边读边写
+        zinfo = zipfile.ZipInfo(MANIFEST_NAME, date_time=time.localtime()[:6])
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        with zf.open(zinfo, mode="w") as dest:
+            for line in export.manifest_lines():
+                dest.write(line)
+                yield from sink.drain()
+        yield from sink.drain()
+    # 写入中央目录
+    yield from sink.drain()
+
+
+def _tar_header(name: str, size: int, mtime: float) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def _tar_padding(size: int) -> bytes:
+    remainder = size % tarfile.BLOCKSIZE
+    return b"\0" * (tarfile.BLOCKSIZE - remainder) if remainder else b""
+
+
+def _stream_tar(storage: StorageBackend, start_date: date, end_date: date) -> Generator[bytes, None, None]:
+    # tar 头部需要预先知道文件大小，因此这里手动生成头部，然后直接透传音频数据块
+    export = _ExportPass(start_date, end_date)
+    for record in export.records():
+        size = storage.get_size(record['audio_url'])
+        stream = storage.get_stream(record['audio_url']) if size >= 0 else None
+        if stream is None:
+            logger.warning(f"Audio missing for record {record['id']}, skipped in export: {record['audio_url']}")
+            export.missing.add(record['id'])
+            continue
+
+        archive_path = _archive_path(record)
+        yield _tar_header(archive_path, size, _record_mtime(record))
+        written = 0
+        for chunk in _iter_audio_chunks(stream):
+            # 防御性处理：确保写入字节数与头部声明一致，否则归档会损坏
+            chunk = chunk[:size - written]
+            written += len(chunk)
+            if chunk:
+                yield chunk
+        if written < size:
+            logger.error(f"Audio stream for {record['audio_url']} ended early ({written}/{size} bytes), zero-padded.")
+            yield b"\0" * (size - written)
+        yield _tar_padding(size)
+
+    # 清单的大小同样要写在头部：先只计算大小遍历一遍，紧接着再遍历一遍写出
+    manifest_size = sum(len(line) for line in export.manifest_lines())
+    yield _tar_header(MANIFEST_NAME, manifest_size, time.time())
+    written = 0
+    for line in export.manifest_lines():
+        if written + len(line) > manifest_size:
+            # 两遍之间有记录被修改（例如识别完成），放不下的行不再写入，保证归档结构完整
+            logger.error(f"Export manifest changed while streaming, truncated at {written}/{manifest_size} bytes.")
+            break
+        written += len(line)
+        yield line
+    if written < manifest_size:
+        # 用换行补足头部声明的大小（JSON Lines 读取时跳过空行）
+        yield b"\n" * (manifest_size - written)
+    yield _tar_padding(manifest_size)
+    # tar 归档以两个全零块结尾
+    yield b"\0" * (tarfile.BLOCKSIZE * 2)
+
+
+def stream_export(storage: StorageBackend, start_date: date, end_date: date, fmt: str = "zip") -> Generator[bytes, None, None]:
+    """
+    以流的形式生成日期范围内录音及其记录清单的归档。
+    音频逐块从存储后端读取并直接写出，不使用临时文件；
+    清单 manifest.jsonl 写在归档末尾，按相同的查询再分页遍历一遍逐行生成，内存占用与日期范围无关。
+    """
+    if fmt == "tar":
+        return _stream_tar(storage, start_date, end_date)
+    return _stream_zip(storage, start_date, end_date)
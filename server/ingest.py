@@ -0,0 +1,179 @@
+"""
+客户端离线缓存音频的补传。
+
+客户端与服务器断开期间继续录音，把音频按段写入本地缓存；恢复连接后通过 POST /api/ingest/upload
+逐段上传，每段带有第一个采样的采集时间。这里对整段音频做 VAD，片段时间戳按采样位置推算，
+因此补传的记录与实时流生成的记录在时间线上的位置一致。
+
+补传音频使用独立的 Silero 模型（模型带有内部状态，不能与实时连接共用），并且每次只处理一段；
+每处理一小块音频就让出事件循环，实时 WebSocket 流始终优先。
+
+补传是幂等的：每段音频带有稳定的 upload_id（客户端使用文件内容的 SHA-256，未提供时服务器自行计算），
+处理完成后与生成的记录 ID 一起写入 ingested_uploads。客户端在服务器处理完之后才超时或丢失响应时会重传同一段，
+此时直接返回之前的结果，不会生成重复的记录。
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import time
+import wave
+from datetime import datetime
+from typing import Callable, Coroutine, Optional
+
+import pytz
+
+from audio_codec import get_decoder
+from database import get_db_connection
+from devices import device_vad_overrides
+from schemas import SleepRecordCreate
+from storage import StorageBackend
+from stt.queue import TranscriptionQueue
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# 每次送入 VAD 的音频时长，处理完一块后让出事件循环
+FEED_BYTES = SAMPLE_RATE * 2
+# 单次上传的最大音频时长，防止一次请求占用过多内存
+MAX_UPLOAD_SECONDS = 30 * 60
+MAX_UPLOAD_ID_LENGTH = 128
+
+
+def to_shanghai(captured_at: datetime) -> datetime:
+    """客户端上报的采集时间转换为上海时间，不带时区时视为上海时间。"""
+    shanghai_tz = pytz.timezone("Asia/Shanghai")
+    if captured_at.tzinfo is None:
+        return shanghai_tz.localize(captured_at)
+    return captured_at.astimezone(shanghai_tz)
+
+
+def decode_upload(data: bytes, codec: str) -> bytes:
+    """
+    把上传的音频解码为 16kHz 单声道 int16 PCM。
+    codec 为 wav 时读取 WAV 文件，否则与 /vad 的上行编码相同（整段内容视为一条消息）。
+    """
+    if codec == "wav":
+        with wave.open(io.BytesIO(data), "rb") as wf:
+            if wf.getframerate() != SAMPLE_RATE or wf.getsampwidth() != 2 or wf.getnchannels() != 1:
+                raise ValueError("需要 16kHz、16-bit、单声道的 WAV 文件")
+            return wf.readframes(wf.getnframes())
+    return get_decoder(codec).decode(data)
+
+
+def _find_upload(key: str) -> Optional[dict]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT result FROM ingested_uploads WHERE key = ?", (key,))
+        row = cursor.fetchone()
+    return json.loads(row['result']) if row else None
+
+
+def _save_upload(key: str, device_id: Optional[str], captured_at: datetime, result: dict):
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO ingested_uploads (key, device_id, captured_at, result, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, device_id, captured_at.isoformat(), json.dumps(result), datetime.utcnow().isoformat())
+        )
+        conn.commit()
+
+
+class BacklogIngestor:
+    def __init__(
+        self,
+        vad_config: dict,
+        storage_backend: StorageBackend,
+        transcription_queue: TranscriptionQueue,
+        on_speech_end: Callable[[SleepRecordCreate], Coroutine],
+        devices_config: Optional[dict] = None,
+    ):
+        """:param devices_config: 配置文件的 devices 段，按设备覆盖 vad 参数"""
+        self.vad_config = vad_config
+        self.devices_config = devices_config
+        self.storage = storage_backend
+        self.transcription_queue = transcription_queue
+        self.on_speech_end = on_speech_end
+        self._model = None
+        self._lock = asyncio.Lock()
+
+    def _load_model(self):
+        from silero_vad import load_silero_vad
+        return load_silero_vad()
+
+    async def ingest(
+        self,
+        data: bytes,
+        codec: str,
+        captured_at: datetime,
+        device_id: Optional[str] = None,
+        upload_id: Optional[str] = None,
+    ) -> dict:
+        """
+        对一段补传音频做 VAD 并生成记录。同一设备重复上传同一段时返回之前的结果（duplicate 为 true）。
+        :param captured_at: 第一个采样的采集时间
+        :param device_id: 采集设备
+        :param upload_id: 该段音频的稳定标识，默认为音频内容的 SHA-256
+        :return: 音频时长、检测到的片段数、生成的记录 ID 和处理耗时
+        """
+        if upload_id is not None and not 0 < len(upload_id) <= MAX_UPLOAD_ID_LENGTH:
+            raise ValueError(f"upload_id 的长度应为 1~{MAX_UPLOAD_ID_LENGTH} 个字符")
+        key = f"{device_id or ''}/{upload_id or hashlib.sha256(data).hexdigest()}"
+        pcm = decode_upload(data, codec)
+        audio_seconds = len(pcm) / (SAMPLE_RATE * 2)
+        if audio_seconds > MAX_UPLOAD_SECONDS:
+            raise ValueError(f"单次上传的音频不能超过 {MAX_UPLOAD_SECONDS} 秒")
+        captured_at = to_shanghai(captured_at)
+
+        # 在锁内检查，客户端超时重传时，前一次请求可能仍在处理
+        async with self._lock:
+            previous = await asyncio.to_thread(_find_upload, key)
+            if previous is not None:
+                logger.info(f"Backlog audio {key} was already ingested, returning the previous result.")
+                return {**previous, "duplicate": True}
+            if self._model is None:
+                self._model = await asyncio.to_thread(self._load_model)
+            from vad.engine import VadWrapper
+            segments = 0
+            record_ids = []
+
+            async def on_speech_end(record_data: SleepRecordCreate) -> Optional[str]:
+                nonlocal segments
+                segments += 1
+                record_id = await self.on_speech_end(record_data)
+                if record_id:
+                    record_ids.append(record_id)
+                return record_id
+
+            wrapper = VadWrapper(
+                self._model,
+                on_speech_end,
+                transcription_queue=self.transcription_queue,
+                storage_backend=self.storage,
+                capture_start=captured_at,
+                device_id=device_id,
+                **{**self.vad_config, **device_vad_overrides(self.devices_config, device_id)},
+            )
+            start = time.perf_counter()
+            try:
+                for offset in range(0, len(pcm), FEED_BYTES):
+                    await wrapper.process(pcm[offset:offset + FEED_BYTES])
+                    await asyncio.sleep(0)
+                # 上传的音频按段切分，段末仍在说话时也生成记录
+                await wrapper.flush()
+            finally:
+                wrapper.reset()
+            elapsed = time.perf_counter() - start
+            result = {
+                "audio_seconds": round(audio_seconds, 2),
+                "segments": segments,
+                "record_ids": record_ids,
+                "processing_seconds": round(elapsed, 2),
+            }
+            await asyncio.to_thread(_save_upload, key, device_id, captured_at, result)
+
+        logger.info(
+            f"Ingested {audio_seconds:.0f}s of backlog audio captured at {captured_at.isoformat()}: "
+            f"{segments} segments in {elapsed:.1f}s."
+        )
+        return {**result, "duplicate": False}
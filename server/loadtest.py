@@ -0,0 +1,430 @@
+"""
+/vad 实时压测工具：模拟 N 个卧室麦克风客户端。
+
+每个模拟客户端以实时速度向 /vad 推送 16kHz 16-bit PCM（与 client/app.py 一样按块发送），
+音频为录制的 WAV（循环播放）或合成的“语音 + 静音”信号。压测会依次尝试多个并发数，并报告：
+  - 消息处理延迟（服务端从收到消息到处理完成，来自 /metrics）
+  - 语音片段检测延迟（片段结束到服务端计数器增加）
+  - 片段结束到数据库出现记录的端到端延迟
+  - 每路音频流的服务端 CPU 和 RSS
+以及吞吐量在哪个并发数下饱和。
+
+建议使用 dummy STT 引擎和本地存储，并为压测使用独立的数据目录，例如：
+    python loadtest.py --spawn --streams 1,2,4,8,16 --duration 60 --wav sample.wav
+--spawn 会以临时配置 (stt.type=dummy, storage.type=local) 和临时数据目录启动一个服务进程。
+也可以针对已运行的服务：
+    python loadtest.py --url ws://127.0.0.1:8569/vad --metrics-url http://127.0.0.1:8569/metrics --pid <PID> --db data/dream_talker.db
+"""
+import argparse
+import asyncio
+import math
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import wave
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+import websockets
+import yaml
+
+SAMPLE_RATE = 16000
+# client/app.py 每次回调 1024 帧；这里按服务端收到的 16kHz 数据计，默认每条消息 1024 个采样
+DEFAULT_FRAMES_PER_MESSAGE = 1024
+
+
+# --- 测试音频 ---
+
+def load_wav(path: str) -> np.ndarray:
+    with wave.open(path, "rb") as wf:
+        if wf.getframerate() != SAMPLE_RATE or wf.getsampwidth() != 2:
+            raise ValueError("WAV 文件必须为 16kHz、16-bit PCM")
+        channels = wf.getnchannels()
+        pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    return pcm[::channels] if channels > 1 else pcm
+
+
+def synthesize_speech_and_silence(seconds: float, speech_seconds: float = 1.5, silence_seconds: float = 4.0, seed: int = 0) -> np.ndarray:
+    """
+    合成“语音 + 静音”交替的信号：带颤音的谐波基频乘以约 4Hz 的音节包络，间隔低电平噪声。
+    合成信号不一定能被 Silero 识别为语音，条件允许时请使用 --wav 提供真实录音。
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * SAMPLE_RATE)
+    pcm = rng.normal(0, 30, total)
+    period = int((speech_seconds + silence_seconds) * SAMPLE_RATE)
+    speech_len = int(speech_seconds * SAMPLE_RATE)
+    t = np.arange(speech_len) / SAMPLE_RATE
+    f0 = 140 + 20 * np.sin(2 * np.pi * 3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = 0.5 * (1 - np.cos(2 * np.pi * 4 * t)) * np.hanning(speech_len) ** 0.3
+    burst = 6000 * voiced * envelope
+    for start in range(0, total - speech_len, period):
+        pcm[start:start + speech_len] += burst
+    return np.clip(pcm, -32768, 32767).astype(np.int16)
+
+
+def speech_end_offsets(pcm: np.ndarray, frame: int = 320, threshold_db: float = -35.0) -> List[int]:
+    """用能量门限粗略估计测试音频中每段语音的结束采样位置，用于计算延迟。"""
+    n = len(pcm) // frame
+    frames = pcm[:n * frame].reshape(n, frame).astype(np.float32) / 32768.0
+    db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+    active = db > threshold_db
+    ends = []
+    silent_run = 0
+    in_speech = False
+    for i, is_active in enumerate(active):
+        if is_active:
+            in_speech, silent_run = True, 0
+        elif in_speech:
+            silent_run += 1
+            if silent_run * frame >= SAMPLE_RATE // 2:
+                ends.append((i - silent_run + 1) * frame)
+                in_speech = False
+    return ends
+
+
+# --- 服务端观测 ---
+
+_METRIC_LINE = re.compile(r'^([a-zA-Z_:][\w:]*)(\{[^}]*\})?\s+(\S+)$')
+
+
+def scrape_metrics(url: str, token: Optional[str] = None) -> Dict[str, float]:
+    request = urllib.request.Request(url)
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    with urllib.request.urlopen(request, timeout=5) as response:
+        text = response.read().decode("utf-8")
+    values = {}
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            values[name + (labels or "")] = float(value)
+    return values
+
+
+def histogram_mean(before: Dict[str, float], after: Dict[str, float], name: str) -> Optional[float]:
+    count = after.get(f"{name}_count", 0) - before.get(f"{name}_count", 0)
+    if count <= 0:
+        return None
+    return (after.get(f"{name}_sum", 0) - before.get(f"{name}_sum", 0)) / count
+
+
+def histogram_quantile(before: Dict[str, float], after: Dict[str, float], name: str, q: float) -> Optional[float]:
+    buckets = []
+    for key, value in after.items():
+        match = re.match(rf'^{name}_bucket\{{le="([^"]+)"\}}$', key)
+        if match:
+            bound = math.inf if match.group(1) == "+Inf" else float(match.group(1))
+            buckets.append((bound, value - before.get(key, 0)))
+    buckets.sort()
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    target = q * buckets[-1][1]
+    for bound, cumulative in buckets:
+        if cumulative >= target:
+            return bound
+    return None
+
+
+class ProcessSampler:
+    """读取服务进程的 CPU 时间和 RSS（Linux /proc，或已安装时使用 psutil）。"""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def cpu_seconds(self) -> Optional[float]:
+        if not self.pid:
+            return None
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self._ticks
+        except OSError:
+            try:
+                import psutil
+                times = psutil.Process(self.pid).cpu_times()
+                return times.user + times.system
+            except Exception:
+                return None
+
+    def rss_bytes(self) -> Optional[int]:
+        if not self.pid:
+            return None
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            try:
+                import psutil
+                return psutil.Process(self.pid).memory_info().rss
+            except Exception:
+                return None
+        return None
+
+
+def count_records(db_path: Optional[str], since_iso: str) -> Optional[int]:
+    """统计已完成识别的记录数，等待 STT 队列的记录不计入。"""
+    if not db_path or not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=1)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM records WHERE created_at >= ? AND transcription_status = 'done'", (since_iso,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+# --- 压测执行 ---
+
+@dataclass
+class RunResult:
+    streams: int
+    duration: float
+    messages_sent: int = 0
+    send_slip_max: float = 0.0 # 发送相对实时时间表的最大滞后（秒）
+    errors: int = 0
+    message_lag_mean: Optional[float] = None
+    message_lag_p95: Optional[float] = None
+    vad_inference_mean: Optional[float] = None
+    segments: int = 0
+    expected_segments: int = 0
+    detection_latency: List[float] = field(default_factory=list)
+    record_latency: List[float] = field(default_factory=list)
+    segment_to_record_mean: Optional[float] = None
+    cpu_per_stream: Optional[float] = None # 每路流占用的 CPU 核数
+    rss_delta_per_stream: Optional[float] = None
+
+
+async def _stream_client(url: str, pcm: np.ndarray, frames_per_message: int, duration: float,
+                         offset: int, ends: List[int], end_times: List[float], result: RunResult):
+    """一个模拟客户端：按实时节奏发送音频，并记录每段语音发送完成的时刻。"""
+    message_seconds = frames_per_message / SAMPLE_RATE
+    total_messages = int(duration / message_seconds)
+    try:
+        async with websockets.connect(url, max_size=None) as websocket:
+            start = time.perf_counter()
+            position = offset
+            for i in range(total_messages):
+                scheduled = start + i * message_seconds
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    result.send_slip_max = max(result.send_slip_max, -delay)
+
+                idx = np.arange(position, position + frames_per_message) % len(pcm)
+                await websocket.send(pcm[idx].tobytes())
+                result.messages_sent += 1
+
+                # 记录测试音频（循环播放）中每段语音发送完成的时刻
+                loop_pos = position % len(pcm)
+                for end in ends:
+                    if (end - loop_pos) % len(pcm) < frames_per_message:
+                        end_times.append(time.perf_counter())
+                position += frames_per_message
+    except Exception as e:
+        result.errors += 1
+        print(f"stream error: {e}", file=sys.stderr)
+
+
+async def _watch_server(args, end_times: List[float], result: RunResult, stop: asyncio.Event, since_iso: str):
+    """轮询 /metrics 和数据库，按先进先出将语音结束时刻与片段检测、记录写入匹配，计算延迟。"""
+    seen_segments = None
+    seen_records = None
+    detect_index = record_index = 0
+    while not stop.is_set():
+        now = time.perf_counter()
+        if args.metrics_url:
+            try:
+                segments = scrape_metrics(args.metrics_url, args.metrics_token).get("dreamtalker_speech_segments_total", 0)
+                if seen_segments is None:
+                    seen_segments = segments
+                for _ in range(int(segments - seen_segments)):
+                    if detect_index < len(end_times):
+                        result.detection_latency.append(now - end_times[detect_index])
+                        detect_index += 1
+                seen_segments = segments
+            except Exception:
+                pass
+        records = count_records(args.db, since_iso)
+        if records is not None:
+            if seen_records is None:
+                seen_records = records
+            for _ in range(records - seen_records):
+                if record_index < len(end_times):
+                    result.record_latency.append(now - end_times[record_index])
+                    record_index += 1
+            seen_records = records
+        await asyncio.sleep(0.1)
+
+
+async def run_level(args, pcm: np.ndarray, ends: List[int], streams: int, sampler: ProcessSampler) -> RunResult:
+    result = RunResult(streams=streams, duration=args.duration)
+    since_iso = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+    before = scrape_metrics(args.metrics_url, args.metrics_token) if args.metrics_url else {}
+    cpu_before, rss_before = sampler.cpu_seconds(), sampler.rss_bytes()
+
+    end_times: List[float] = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(_watch_server(args, end_times, result, stop, since_iso))
+    # 错开各路流在测试音频中的起点，避免所有流同时说话
+    stride = len(pcm) // max(streams, 1)
+    wall_start = time.perf_counter()
+    await asyncio.gather(*[
+        _stream_client(args.url, pcm, args.frames_per_message, args.duration, i * stride, ends, end_times, result)
+        for i in range(streams)
+    ])
+    elapsed = time.perf_counter() - wall_start
+    # 等待尾部的片段检测和 STT 完成
+    await asyncio.sleep(args.drain)
+    stop.set()
+    await watcher
+
+    cpu_after, rss_after = sampler.cpu_seconds(), sampler.rss_bytes()
+    if cpu_before is not None and cpu_after is not None:
+        result.cpu_per_stream = (cpu_after - cpu_before) / (elapsed + args.drain) / streams
+    if rss_before is not None and rss_after is not None:
+        result.rss_delta_per_stream = (rss_after - rss_before) / streams
+
+    if args.metrics_url:
+        after = scrape_metrics(args.metrics_url, args.metrics_token)
+        result.message_lag_mean = histogram_mean(before, after, "dreamtalker_audio_message_lag_seconds")
+        result.message_lag_p95 = histogram_quantile(before, after, "dreamtalker_audio_message_lag_seconds", 0.95)
+        result.vad_inference_mean = histogram_mean(before, after, "dreamtalker_vad_inference_seconds")
+        result.segment_to_record_mean = histogram_mean(before, after, "dreamtalker_segment_to_record_seconds")
+        result.segments = int(after.get("dreamtalker_speech_segments_total", 0) - before.get("dreamtalker_speech_segments_total", 0))
+    result.expected_segments = len(end_times)
+    return result
+
+
+def _fmt(value: Optional[float], scale: float = 1000.0, unit: str = "ms") -> str:
+    return "-" if value is None else f"{value * scale:.1f}{unit}"
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return sum(values) / len(values) if values else None
+
+
+def is_saturated(result: RunResult, frames_per_message: int) -> bool:
+    """
+    判断服务端是否已跟不上实时：消息处理延迟的 P95 超过一条消息的时长，
+    或发送端因背压明显滞后于实时时间表，或连接出错。
+    """
+    message_seconds = frames_per_message / SAMPLE_RATE
+    if result.errors:
+        return True
+    if result.message_lag_p95 is not None and result.message_lag_p95 > message_seconds:
+        return True
+    return result.send_slip_max > 1.0
+
+
+def print_report(results: List[RunResult], frames_per_message: int):
+    header = f"{'streams':>7} {'lag_mean':>9} {'lag_p95':>8} {'vad/chunk':>9} {'segments':>9} {'detect':>8} {'e2e_rec':>8} {'seg→rec':>8} {'cpu/str':>8} {'rss/str':>9} {'slip':>7}"
+    print(header)
+    print("-" * len(header))
+    saturation = None
+    for r in results:
+        print(
+            f"{r.streams:>7} {_fmt(r.message_lag_mean):>9} {_fmt(r.message_lag_p95):>8} {_fmt(r.vad_inference_mean):>9} "
+            f"{f'{r.segments}/{r.expected_segments}':>9} {_fmt(_mean(r.detection_latency)):>8} {_fmt(_mean(r.record_latency)):>8} "
+            f"{_fmt(r.segment_to_record_mean):>8} {_fmt(r.cpu_per_stream, 100, '%'):>8} "
+            f"{'-' if r.rss_delta_per_stream is None else f'{r.rss_delta_per_stream / 1048576:.1f}MB':>9} {_fmt(r.send_slip_max):>7}"
+        )
+        if saturation is None and is_saturated(r, frames_per_message):
+            saturation = r.streams
+    print()
+    if saturation is None:
+        print(f"在测试的最大并发 ({results[-1].streams} 路) 下服务端仍能跟上实时。")
+    else:
+        print(f"吞吐量在 {saturation} 路并发时饱和（消息处理延迟超过实时或发送端出现背压）。")
+
+
+def spawn_server(port: int) -> subprocess.Popen:
+    """以 dummy STT、本地存储和临时数据目录启动一个服务进程。"""
+    workdir = tempfile.mkdtemp(prefix="dreamtalker-loadtest-")
+    config_path = os.path.join(workdir, "config.yaml")
+    with open(config_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump({"stt": {"type": "dummy"}, "storage": {"type": "local"}}, f)
+    env = dict(os.environ, DREAM_TALKER_CONFIG=config_path, DREAM_TALKER_DATA_DIR=os.path.join(workdir, "data"))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    process.data_dir = env["DREAM_TALKER_DATA_DIR"]
+    return process
+
+
+def wait_until_up(ready_url: str, timeout: float = 300):
+    """等待 /ready 返回 200，即模型加载和预热完成。"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(ready_url, timeout=2).read()
+            return
+        except Exception:
+            time.sleep(1)
+    raise TimeoutError("服务未能在限定时间内启动")
+
+
+async def main(args):
+    pcm = load_wav(args.wav) if args.wav else synthesize_speech_and_silence(60)
+    ends = speech_end_offsets(pcm)
+    print(f"测试音频 {len(pcm) / SAMPLE_RATE:.1f}s，包含约 {len(ends)} 段语音。")
+
+    sampler = ProcessSampler(args.pid)
+    results = []
+    for streams in [int(n) for n in args.streams.split(",")]:
+        print(f"\n>>> {streams} 路并发，持续 {args.duration}s ...")
+        result = await run_level(args, pcm, ends, streams, sampler)
+        results.append(result)
+        if args.stop_on_saturation and is_saturated(result, args.frames_per_message):
+            break
+        await asyncio.sleep(args.pause)
+    print()
+    print_report(results, args.frames_per_message)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模拟多个客户端对 /vad 进行实时压测")
+    parser.add_argument("--url", default="ws://127.0.0.1:8569/vad")
+    parser.add_argument("--metrics-url", default="http://127.0.0.1:8569/metrics")
+    parser.add_argument("--metrics-token", default=None)
+    parser.add_argument("--db", default=None, help="服务使用的 SQLite 数据库路径，用于测量端到端写入延迟")
+    parser.add_argument("--pid", type=int, default=None, help="服务进程 PID，用于测量 CPU 和 RSS")
+    parser.add_argument("--spawn", action="store_true", help="启动一个使用 dummy STT 和临时数据目录的服务进程")
+    parser.add_argument("--port", type=int, default=8599, help="--spawn 时服务监听的端口")
+    parser.add_argument("--streams", default="1,2,4,8", help="逗号分隔的并发数列表")
+    parser.add_argument("--duration", type=float, default=60, help="每个并发级别的持续时间（秒）")
+    parser.add_argument("--drain", type=float, default=5, help="发送结束后等待尾部处理的时间（秒）")
+    parser.add_argument("--pause", type=float, default=3, help="各并发级别之间的间隔（秒）")
+    parser.add_argument("--wav", default=None, help="16kHz 16-bit 的测试录音，缺省时使用合成信号")
+    parser.add_argument("--frames-per-message", type=int, default=DEFAULT_FRAMES_PER_MESSAGE)
+    parser.add_argument("--stop-on-saturation", action="store_true")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        server = spawn_server(args.port)
+        args.url = f"ws://127.0.0.1:{args.port}/vad"
+        args.metrics_url = f"http://127.0.0.1:{args.port}/metrics"
+        args.db = os.path.join(server.data_dir, "dream_talker.db")
+        args.pid = server.pid
+        wait_until_up(f"http://127.0.0.1:{args.port}/ready")
+    try:
+        asyncio.run(main(args))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
@@ -1,81 +1,176 @@
+import atexit
+import json
 import logging
+import logging.config
+import logging.handlers
 import os
+import queue
+import threading
+import time
+from datetime import datetime
 
+# 后台写日志的监听器，进程内只启动一个
+_listener: logging.handlers.QueueListener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """将日志格式化为单行 JSON，便于检索和采集。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    按调用位置（文件 + 行号）限流的过滤器，使用令牌桶算法。
+    用于每个音频块、每条 SQL 这类高频日志；WARNING 及以上级别的日志不受限制。
+    被丢弃的条数会附加在该位置下一条放行的日志后面。
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 50):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} (同一位置此前有 {suppressed} 条日志因限流被丢弃)"
+            record.args = None
+        return True
+
+
+def init_log(config: dict = None):
+    """
+    初始化日志。
+    所有 logger 只挂一个 QueueHandler，真正的控制台和文件写入在后台线程的 QueueListener 中完成，
+    避免文件 I/O 阻塞事件循环。
+
+    :param config: .config.yaml 中的 logging 配置段，支持
+                   json (文件日志是否使用 JSON 格式)、rate_limit_per_second、rate_limit_burst
+    """
+    global _listener
+    config = config or {}
 
-def init_log():
     # Create logs directory if it doesn't exist
     if not os.path.exists("logs"):
         os.makedirs("logs")
 
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.DEBUG)
+    try:
+        from uvicorn.logging import DefaultFormatter
+        console_handler.setFormatter(DefaultFormatter(
+            fmt="%(levelprefix)s %(asctime)s [%(name)s] %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        ))
+    except ImportError:
+        console_handler.setFormatter(logging.Formatter("%(levelname)s %(asctime)s [%(name)s] %(message)s"))
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        "logs/server.log",
+        maxBytes=1024 * 1024 * 5,  # 5 MB
+        backupCount=3,
+        encoding="utf-8",
+    )
+    file_handler.setLevel(logging.DEBUG)
+    if config.get("json", True):
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(
+            "%(asctime)s [%(levelname)s] [%(name)s:%(module)s:%(lineno)d] %(message)s"
+        ))
+
+    if _listener is not None:
+        _listener.stop()
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(
+        rate=config.get("rate_limit_per_second", 10.0),
+        burst=config.get("rate_limit_burst", 50),
+    ))
+
     LOGGING_CONFIG = {
         "version": 1,
         "disable_existing_loggers": False,
-        "formatters": {
-            "default": {
-                "()": "uvicorn.logging.DefaultFormatter",
-                "fmt": "%(levelprefix)s %(asctime)s [%(name)s] %(message)s",
-                "datefmt": "%Y-%m-%d %H:%M:%S",
-            },
-            "file": {
-                "format": "%(asctime)s [%(levelname)s] [%(name)s:%(module)s:%(lineno)d] %(message)s"
-            },
-        },
         "handlers": {
-            "console": {
-                "class": "logging.StreamHandler",
-                "formatter": "default",
-                "level": "DEBUG",
-            },
-            "file": {
-                "class": "logging.handlers.RotatingFileHandler",
-                "formatter": "file",
-                "filename": "logs/server.log",
-                "maxBytes": 1024 * 1024 * 5,  # 5 MB
-                "backupCount": 3,
-                "encoding": "utf-8",
-                "level": "DEBUG",
+            "queue": {
+                "()": lambda: queue_handler,
             },
         },
         "loggers": {
             "uvicorn": {
-                "handlers": ["console", "file"],
+                "handlers": ["queue"],
                 "level": "INFO",
                 "propagate": False,
             },
             "uvicorn.error": {
-                "handlers": ["console", "file"],
+                "handlers": ["queue"],
                 "level": "INFO",
                 "propagate": False,
             },
             "uvicorn.access": {
-                "handlers": ["console", "file"],
+                "handlers": ["queue"],
                 "level": "INFO",
                 "propagate": False,
             },
             "watchfiles": {
-                "handlers": ["console", "file"],
+                "handlers": ["queue"],
                 "level": "WARNING",
                 "propagate": False,
             },
             # 为您自己的应用程序代码（例如 app.py, vad/engine.py）设置一个 logger
             "app": {
-                "handlers": ["console", "file"],
+                "handlers": ["queue"],
                 "level": "DEBUG",
                 "propagate": False,
             },
             "vad": {
-                "handlers": ["console", "file"],
+                "handlers": ["queue"],
                 "level": "DEBUG",
                 "propagate": False,
             },
              "stt": {
-                "handlers": ["console", "file"],
+                "handlers": ["queue"],
                 "level": "DEBUG",
                 "propagate": False,
             },
         },
         "root": {
-            "handlers": ["console", "file"],
+            "handlers": ["queue"],
             "level": "INFO", # 将 root logger 的默认级别提高到 INFO
         },
     }
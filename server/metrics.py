@@ -0,0 +1,260 @@
+"""
+轻量的 Prometheus 风格指标。
+
+计数器和直方图在热路径（如 VadWrapper.process）中调用，因此实现保持尽量简单：
+每个带标签的序列是一个预先绑定的对象，更新只是几次加法，用一把锁保证线程安全。
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# 默认的延迟分桶（秒），覆盖从亚毫秒的 VAD 推理到数秒的 STT 推理
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """获取某组标签值对应的序列。返回的对象可以缓存起来，在热路径中反复使用。"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _series(self) -> List[Tuple[Tuple[str, ...], object]]:
+        if not self.labelnames:
+            return [((), self._default)]
+        return list(self._children.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in self._series():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _GaugeChild:
+    __slots__ = ("value", "_lock", "_func")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+        self._func = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set_function(self, func: Callable[[], float]):
+        """设置在采集时才计算取值的函数（例如读取队列长度）。"""
+        self._func = func
+
+    def get(self) -> float:
+        return self._func() if self._func else self.value
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def set_function(self, func: Callable[[], float]):
+        self._default.set_function(func)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(float(child.get()))}"]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        """以上下文管理器的方式记录代码块的耗时（秒）。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render_metrics() -> str:
+    """以 Prometheus 文本格式输出所有指标。"""
+    return REGISTRY.render()
+
+
+# --- 录音摄取流水线的指标 ---
+
+WEBSOCKET_STREAMS = gauge("dreamtalker_websocket_streams", "当前活跃的 /vad WebSocket 音频流数量")
+AUDIO_CHUNKS = counter("dreamtalker_audio_chunks_total", "VAD 处理的音频块数量")
+AUDIO_UPLINK_BYTES = counter("dreamtalker_audio_uplink_bytes_total", "/vad 收到的音频字节数（解码前）", ["codec"])
+DEVICE_SEGMENTS = counter("dreamtalker_device_segments_total", "按采集设备统计的语音片段数量", ["device"])
+DEVICE_STREAMS = gauge("dreamtalker_device_streams", "按采集设备统计的 /vad 连接数量", ["device"])
+STREAM_SESSIONS = gauge("dreamtalker_stream_sessions", "保留中的 /vad 流会话数量（包括断线宽限期内的）")
+STREAM_FRAMES = counter("dreamtalker_stream_frames_total", "带帧头的音频帧数量", ["result"])
+STREAM_FLOW_SIGNALS = counter("dreamtalker_stream_flow_signals_total", "发送给客户端的流控信号", ["state"])
+AUDIO_MESSAGE_LAG = histogram("dreamtalker_audio_message_lag_seconds", "从收到 WebSocket 消息到处理完成的耗时")
+VAD_INFERENCE = histogram("dreamtalker_vad_inference_seconds", "每个音频块的 VAD 模型推理耗时")
+SPEECH_SEGMENTS = counter("dreamtalker_speech_segments_total", "检测到的语音片段数量")
+COALESCE_SAVED = counter("dreamtalker_coalesce_saved_total", "合并语音片段节省的存储对象和 STT 调用数量", ["resource"])
+SEGMENT_TO_RECORD = histogram("dreamtalker_segment_to_record_seconds", "从语音片段结束到记录写入数据库的耗时")
+STT_QUEUE_DEPTH = gauge("dreamtalker_stt_queue_depth", "等待或正在进行 STT 识别的片段数量")
+STT_BACKLOG_AGE = gauge("dreamtalker_stt_backlog_age_seconds", "最早的未完成 STT 任务已等待的时间")
+STT_DEFERRED = gauge("dreamtalker_stt_deferred", "STT 队列当前是否被调度策略推迟 (1 为是)")
+STT_CACHE_REQUESTS = counter("dreamtalker_stt_cache_requests_total", "STT 结果缓存的查询次数", ["result"])
+STT_CACHE_ENTRIES = gauge("dreamtalker_stt_cache_entries", "STT 结果缓存的条目数", ["tier"])
+STT_INFERENCE = histogram("dreamtalker_stt_inference_seconds", "STT 识别耗时", ["engine"])
+STORAGE_SAVE = histogram("dreamtalker_storage_save_seconds", "存储后端保存音频的耗时", ["backend"])
+STORAGE_FALLBACK = gauge("dreamtalker_storage_fallback_active", "MinIO 是否处于宕机回退到本地存储的状态 (1 为是)")
+SQL_QUERY = histogram("dreamtalker_sql_query_seconds", "SQL 语句执行耗时", ["statement"])
+HTTP_REQUEST = histogram("dreamtalker_http_request_seconds", "HTTP 请求耗时", ["method", "route", "status"])
+STARTUP_PHASE = gauge("dreamtalker_startup_phase_seconds", "服务启动各阶段的耗时", ["phase"])
+EVENT_LOOP_LAG = histogram("dreamtalker_event_loop_lag_seconds", "事件循环调度延迟")
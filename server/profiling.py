@@ -0,0 +1,134 @@
+"""
+运行中进程的诊断工具：限时性能剖析与事件循环延迟监控。
+"""
+import asyncio
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as FrequencyCounter
+from typing import Optional
+
+from metrics import EVENT_LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+# 单次剖析的最长时间（秒）
+MAX_PROFILE_SECONDS = 120
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})"
+
+
+def sample_stacks(duration: float, interval: float = 0.005) -> str:
+    """
+    在 duration 秒内以 interval 的间隔采样所有线程的调用栈，
+    包括 asyncio.to_thread 中的 STT 推理和 MinIO 同步线程。
+    这是一个阻塞函数，应在线程中运行。
+
+    :return: 折叠栈 (collapsed stack) 格式的文本，每行为 "线程;栈帧;...;栈帧 次数"，
+             可直接交给 flamegraph.pl 或 speedscope 生成火焰图。
+    """
+    samples = FrequencyCounter()
+    sampler_id = threading.get_ident()
+    deadline = time.monotonic() + duration
+
+    while time.monotonic() < deadline:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == sampler_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+            samples[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+
+    return "\n".join(f"{stack} {count}" for stack, count in samples.most_common()) + "\n"
+
+
+async def profile_event_loop(duration: float, output: str = "text") -> bytes:
+    """
+    使用 cProfile 剖析事件循环线程 duration 秒。
+    注意：cProfile 只能观察启用它的线程，线程池中的工作不在结果之内，需要时请使用 sample_stacks。
+
+    :param output: "text" 返回按累计耗时排序的文本报告；"pstats" 返回可用 pstats/snakeviz 打开的二进制数据
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        profiler.disable()
+
+    if output == "pstats":
+        profiler.create_stats()
+        return marshal.dumps(profiler.stats)
+
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(80)
+    return stream.getvalue().encode("utf-8")
+
+
+class LoopLagMonitor:
+    """
+    事件循环延迟监控。
+
+    一个协程定期记录心跳并测量 sleep 的实际超时（即循环延迟）；
+    一个看门狗线程在心跳停滞超过阈值时抓取事件循环线程的调用栈并记录日志，
+    从而定位阻塞循环的同步调用（如同步的存储或数据库操作）。
+    """
+
+    def __init__(self, threshold: float = 0.2, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    async def _heartbeat(self):
+        while True:
+            start = time.monotonic()
+            self._last_beat = start
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - start - self.interval
+            EVENT_LOOP_LAG.observe(max(lag, 0.0))
+
+    def _watchdog(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._last_beat
+            # 每次停滞只报告一次
+            if stalled > self.threshold and reported_beat != self._last_beat:
+                reported_beat = self._last_beat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    stack = "".join(traceback.format_stack(frame))
+                    logger.warning(f"Event loop blocked for {stalled * 1000:.0f} ms, current stack:\n{stack}")
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watchdog, name="loop-lag-watchdog", daemon=True).start()
+        logger.info(f"Event loop lag monitor started (threshold {self.threshold * 1000:.0f} ms).")
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    @property
+    def current_lag(self) -> float:
+        """距离上次心跳的时间超出间隔的部分（秒），可作为当前负载的参考。"""
+        return max(time.monotonic() - self._last_beat - self.interval, 0.0)
@@ -1,38 +1,44 @@
+import json
 import os
 import re
 from fastapi import HTTPException, Request, Response
 from starlette.responses import FileResponse, StreamingResponse
-from typing import Generator, Dict
+from typing import Generator, Dict, List, Optional, Iterable
 from datetime import date, datetime, timedelta
 import logging
 from database import get_db_connection
-from schemas import SleepRecord
+from config import DATA_DIR
+from schemas import SleepRecord, BulkOperationResult
 from storage import StorageBackend, LocalStorage
+from events import broker, RECORD_UPDATED, RECORD_DELETED
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+RECORDS_BASE_DIR = os.path.join(DATA_DIR, "records")
 
-RECORDS_BASE_DIR = os.path.join(os.path.dirname(__file__), "data", "records")
+def _device_condition(device_id: Optional[str], column: str = "device_id") -> tuple:
+    """按设备过滤的 SQL 条件和参数；未指定设备时不过滤。"""
+    if device_id is None:
+        return "", ()
+    return f" AND {column} = ?", (device_id,)
 
-def get_records_by_date(target_date: date) -> list[SleepRecord]:
+def get_records_by_date(target_date: date, device_id: Optional[str] = None) -> list[SleepRecord]:
     """
-    根据指定日期从数据库获取梦话记录。
+    根据指定日期从数据库获取梦话记录，可按设备过滤。
     """
+    device_sql, device_params = _device_condition(device_id, "r.device_id")
     records = []
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            query = """
-                SELECT r.id, r.timestamp, r.duration, r.audio_url, r.transcription, r.confidence, r.is_favorite, GROUP_CONCAT(t.name) as tags
+            query = f"""
+                SELECT r.id, r.timestamp, r.duration, r.audio_url, r.transcription, r.confidence, r.is_favorite, r.transcription_status, r.device_id, r.segments, GROUP_CONCAT(t.name) as tags
                 FROM records r
                 LEFT JOIN record_tags rt ON r.id = rt.record_id
                 LEFT JOIN tags t ON rt.tag_id = t.id
-                WHERE SUBSTR(r.timestamp, 1, 10) = ?
+                WHERE SUBSTR(r.timestamp, 1, 10) = ?{device_sql}
                 GROUP BY r.id
                 ORDER BY r.is_favorite DESC, r.timestamp DESC
             """
-            params = (target_date.strftime('%Y-%m-%d'),)
-            logging.info(f"Executing query: {query.strip()} with params: {params}")
+            params = (target_date.strftime('%Y-%m-%d'), *device_params)
             cursor.execute(query, params)
             
             for row in cursor.fetchall():
@@ -46,7 +52,10 @@ def get_records_by_date(target_date: date) -> list[SleepRecord]:
                     transcription=row['transcription'],
                     confidence=row['confidence'],
                     is_favorite=bool(row['is_favorite']), # 将数据库的 0/1 转换为布尔值
-                    tags=tags
+                    tags=tags,
+                    transcription_status=row['transcription_status'],
+                    device_id=row['device_id'],
+                    segments=json.loads(row['segments']) if row['segments'] else None,
                 )
                 records.append(record)
     except Exception as e:
@@ -65,7 +74,6 @@ def get_audio_file_by_id(record_id: str, storage: StorageBackend, request: Reque
             cursor = conn.cursor()
             query = "SELECT audio_url FROM records WHERE id = ?"
             params = (record_id,)
-            logging.info(f"Executing query: {query} with params: {params}")
             cursor.execute(query, params)
             record = cursor.fetchone()
     except Exception as e:
@@ -154,15 +162,17 @@ def get_audio_file_by_id(record_id: str, storage: StorageBackend, request: Reque
             media_type="audio/wav"
         )
 
-from schemas import SleepRecord, MonthlyActivity, DailyActivitySummary, StatisticsResponse, DailyStat, HourlyStat, TagStat, KeywordStat
+from schemas import SleepRecord, MonthlyActivity, DailyActivitySummary, StatisticsResponse, DailyStat, HourlyStat, TagStat, KeywordStat, DeviceStat, DeviceSummary
 
-def get_statistics(start_date: date = None, end_date: date = None) -> StatisticsResponse:
+def get_statistics(start_date: date = None, end_date: date = None, device_id: Optional[str] = None) -> StatisticsResponse:
     """
-    获取指定日期范围内的统计数据。
+    获取指定日期范围内的统计数据，可按设备过滤；deviceStats 给出每个设备的记录数和总时长。
     """
     daily_stats = []
     hourly_stats = []
     tag_stats = []
+    device_stats = []
+    device_sql, device_params = _device_condition(device_id)
     
     # 默认最近 7 天
     if end_date is None:
@@ -179,18 +189,17 @@ def get_statistics(start_date: date = None, end_date: date = None) -> Statistics
             cursor = conn.cursor()
             
             # 1. Daily Stats
-            query_daily = """
+            query_daily = f"""
                 SELECT
                     SUBSTR(timestamp, 1, 10) as record_date,
                     COUNT(id) as count,
                     AVG(duration) as avg_duration
                 FROM records
-                WHERE SUBSTR(timestamp, 1, 10) BETWEEN ? AND ?
+                WHERE SUBSTR(timestamp, 1, 10) BETWEEN ? AND ?{device_sql}
                 GROUP BY record_date
                 ORDER BY record_date ASC
             """
-            params_daily = (start_str, end_str)
-            logging.info(f"Executing daily stats query with params: {params_daily}")
+            params_daily = (start_str, end_str, *device_params)
             cursor.execute(query_daily, params_daily)
             for row in cursor.fetchall():
                 daily_stats.append(DailyStat(
@@ -200,17 +209,16 @@ def get_statistics(start_date: date = None, end_date: date = None) -> Statistics
                 ))
                 
             # 2. Hourly Stats
-            query_hourly = """
+            query_hourly = f"""
                 SELECT
                     SUBSTR(timestamp, 12, 2) as hour_str,
                     COUNT(id) as count
                 FROM records
-                WHERE SUBSTR(timestamp, 1, 10) BETWEEN ? AND ?
+                WHERE SUBSTR(timestamp, 1, 10) BETWEEN ? AND ?{device_sql}
                 GROUP BY hour_str
                 ORDER BY hour_str ASC
             """
-            params_hourly = (start_str, end_str)
-            logging.info(f"Executing hourly stats query with params: {params_hourly}")
+            params_hourly = (start_str, end_str, *device_params)
             cursor.execute(query_hourly, params_hourly)
             
             hourly_map = {f"{h:02d}": 0 for h in range(24)}
@@ -224,19 +232,19 @@ def get_statistics(start_date: date = None, end_date: date = None) -> Statistics
                 ))
             
             # 3. Tag Stats
-            query_tags = """
+            tag_device_sql, _ = _device_condition(device_id, "r.device_id")
+            query_tags = f"""
                 SELECT
                     t.name,
                     COUNT(rt.record_id) as value
                 FROM tags t
                 JOIN record_tags rt ON t.id = rt.tag_id
                 JOIN records r ON rt.record_id = r.id
-                WHERE SUBSTR(r.timestamp, 1, 10) BETWEEN ? AND ?
+                WHERE SUBSTR(r.timestamp, 1, 10) BETWEEN ? AND ?{tag_device_sql}
                 GROUP BY t.name
                 ORDER BY value DESC
             """
-            params_tags = (start_str, end_str)
-            logging.info(f"Executing tags stats query with params: {params_tags}")
+            params_tags = (start_str, end_str, *device_params)
             cursor.execute(query_tags, params_tags)
             for row in cursor.fetchall():
                 tag_stats.append(TagStat(
@@ -244,6 +252,25 @@ def get_statistics(start_date: date = None, end_date: date = None) -> Statistics
                     value=row['value']
                 ))
 
+            # 4. Device Stats
+            query_devices = f"""
+                SELECT
+                    device_id,
+                    COUNT(id) as count,
+                    SUM(duration) as total_duration
+                FROM records
+                WHERE SUBSTR(timestamp, 1, 10) BETWEEN ? AND ?{device_sql}
+                GROUP BY device_id
+                ORDER BY count DESC
+            """
+            cursor.execute(query_devices, (start_str, end_str, *device_params))
+            for row in cursor.fetchall():
+                device_stats.append(DeviceStat(
+                    device=row['device_id'],
+                    count=row['count'],
+                    totalDuration=round(row['total_duration'] or 0, 1)
+                ))
+
     except Exception as e:
         print(f"Error fetching statistics: {e}")
         # Return empty on error or raise?
@@ -253,29 +280,30 @@ def get_statistics(start_date: date = None, end_date: date = None) -> Statistics
         dailyStats=daily_stats,
         hourlyStats=hourly_stats,
         tagStats=tag_stats,
-        keywordData=[] # 暂时不实现 Keyword Heatmap
+        keywordData=[], # 暂时不实现 Keyword Heatmap
+        deviceStats=device_stats,
     )
 
-def get_monthly_record_activity(year: int, month: int) -> MonthlyActivity:
+def get_monthly_record_activity(year: int, month: int, device_id: Optional[str] = None) -> MonthlyActivity:
     """
-    获取指定月份每日的梦话记录数量。
+    获取指定月份每日的梦话记录数量，可按设备过滤。
     """
     activity_data: Dict[str, DailyActivitySummary] = {}
+    device_sql, device_params = _device_condition(device_id)
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            query = """
+            query = f"""
                 SELECT
                     SUBSTR(timestamp, 1, 10) as record_date,
                     COUNT(id) as total_records,
                     SUM(CASE WHEN is_favorite = 1 THEN 1 ELSE 0 END) as favorite_records
                 FROM records
-                WHERE SUBSTR(timestamp, 1, 7) = ?
+                WHERE SUBSTR(timestamp, 1, 7) = ?{device_sql}
                 GROUP BY record_date
             """
             year_month_str = f"{year}-{month:02d}"
-            params_monthly = (year_month_str,)
-            logging.info(f"Executing monthly activity query with params: {params_monthly}")
+            params_monthly = (year_month_str, *device_params)
             cursor.execute(query, params_monthly)
             
             for row in cursor.fetchall():
@@ -289,6 +317,32 @@ def get_monthly_record_activity(year: int, month: int) -> MonthlyActivity:
 
     return MonthlyActivity(activity=activity_data)
 
+def get_device_summaries() -> List[DeviceSummary]:
+    """
+    列出产生过记录的设备：记录数、总时长和最近一条记录的时间。
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT device_id, COUNT(id) as count, SUM(duration) as total_duration, MAX(timestamp) as last_timestamp
+                FROM records
+                GROUP BY device_id
+                ORDER BY last_timestamp DESC
+            """)
+            return [
+                DeviceSummary(
+                    device_id=row['device_id'],
+                    record_count=row['count'],
+                    total_duration=round(row['total_duration'] or 0, 1),
+                    last_record_at=row['last_timestamp'],
+                )
+                for row in cursor.fetchall()
+            ]
+    except Exception as e:
+        print(f"Error fetching devices: {e}")
+        raise HTTPException(status_code=500, detail="Could not fetch devices")
+
 def update_record_favorite_status(record_id: str, is_favorite: bool) -> bool:
     """
     更新指定记录的收藏状态。
@@ -302,14 +356,17 @@ def update_record_favorite_status(record_id: str, is_favorite: bool) -> bool:
             
             query_fav = "UPDATE records SET is_favorite = ?, updated_at = ? WHERE id = ?"
             params_fav = (favorite_value, now, record_id)
-            logging.info(f"Executing favorite update query with params: {params_fav}")
             cursor.execute(query_fav, params_fav)
             conn.commit()
-            return cursor.rowcount > 0 # 如果更新了一行或多行，则返回 True
+            updated = cursor.rowcount > 0 # 如果更新了一行或多行，则返回 True
     except Exception as e:
         print(f"Error updating favorite status for record {record_id}: {e}")
         raise HTTPException(status_code=500, detail="Could not update favorite status")
 
+    if updated:
+        broker.publish(RECORD_UPDATED, {"ids": [record_id], "is_favorite": is_favorite})
+    return updated
+
 def delete_record(record_id: str, storage: StorageBackend) -> bool:
     """
     删除指定的梦话记录及对应的音频文件。
@@ -341,8 +398,10 @@ def delete_record(record_id: str, storage: StorageBackend) -> bool:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # 删除标签关联
+            # 删除标签关联、波形峰值和未完成的识别任务
             cursor.execute("DELETE FROM record_tags WHERE record_id = ?", (record_id,))
+            cursor.execute("DELETE FROM record_peaks WHERE record_id = ?", (record_id,))
+            cursor.execute("DELETE FROM stt_jobs WHERE record_id = ?", (record_id,))
             
             # 删除记录
             cursor.execute("DELETE FROM records WHERE id = ?", (record_id,))
@@ -356,6 +415,8 @@ def delete_record(record_id: str, storage: StorageBackend) -> bool:
         print(f"Error deleting record from database: {e}")
         raise HTTPException(status_code=500, detail="Could not delete record from database")
 
+    broker.publish(RECORD_DELETED, {"ids": [record_id]})
+
     # 3. 删除文件
     # 如果文件删除失败，我们只记录日志，不回滚数据库，因为记录已经不存在了
     try:
@@ -365,3 +426,182 @@ def delete_record(record_id: str, storage: StorageBackend) -> bool:
         # 不抛出异常，因为记录已经删除了
 
     return True
+
+
+# SQLite 单条语句的参数个数有上限（旧版本为 999），批量操作时按此大小拆分 IN 子句
+SQL_IN_BATCH_SIZE = 500
+
+def _chunked(items: List, size: int) -> Iterable[List]:
+    """将列表按固定大小切分。"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def select_record_ids(
+    cursor,
+    ids: Optional[List[str]] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    is_favorite: Optional[bool] = None,
+    tag: Optional[str] = None,
+    device_id: Optional[str] = None,
+) -> List[str]:
+    """
+    根据 ID 列表或日期/过滤条件解析出要操作的记录 ID。
+    给出 ids 时只返回其中实际存在的记录；否则按日期范围和过滤条件查询。
+    """
+    if ids:
+        found = []
+        for batch in _chunked(list(dict.fromkeys(ids)), SQL_IN_BATCH_SIZE):
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(f"SELECT id FROM records WHERE id IN ({placeholders})", batch)
+            found.extend(row['id'] for row in cursor.fetchall())
+        return found
+
+    conditions = []
+    params = []
+    if start_date is not None:
+        conditions.append("SUBSTR(r.timestamp, 1, 10) >= ?")
+        params.append(start_date.strftime('%Y-%m-%d'))
+    if end_date is not None:
+        conditions.append("SUBSTR(r.timestamp, 1, 10) <= ?")
+        params.append(end_date.strftime('%Y-%m-%d'))
+    if is_favorite is not None:
+        conditions.append("r.is_favorite = ?")
+        params.append(1 if is_favorite else 0)
+    if tag is not None:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM record_tags rt JOIN tags t ON rt.tag_id = t.id "
+            "WHERE rt.record_id = r.id AND t.name = ?)"
+        )
+        params.append(tag)
+    if device_id is not None:
+        conditions.append("r.device_id = ?")
+        params.append(device_id)
+
+    if not conditions:
+        # 没有任何选择条件时拒绝执行，避免误操作全部记录
+        raise HTTPException(status_code=400, detail="A record selector (ids or date range) is required")
+
+    query = f"SELECT r.id FROM records r WHERE {' AND '.join(conditions)}"
+    cursor.execute(query, params)
+    return [row['id'] for row in cursor.fetchall()]
+
+def _missing_ids(requested: Optional[List[str]], found: List[str]) -> Dict[str, str]:
+    """找出请求中不存在的记录 ID。"""
+    if not requested:
+        return {}
+    found_set = set(found)
+    return {record_id: "Record not found" for record_id in requested if record_id not in found_set}
+
+def bulk_update_favorite_status(is_favorite: bool, ids: Optional[List[str]] = None, **filters) -> BulkOperationResult:
+    """
+    在单个事务中批量更新记录的收藏状态。
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            record_ids = select_record_ids(cursor, ids=ids, **filters)
+            favorite_value = 1 if is_favorite else 0
+            now = datetime.now().isoformat()
+            for batch in _chunked(record_ids, SQL_IN_BATCH_SIZE):
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(
+                    f"UPDATE records SET is_favorite = ?, updated_at = ? WHERE id IN ({placeholders})",
+                    [favorite_value, now, *batch]
+                )
+            conn.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error bulk updating favorite status: {e}")
+        raise HTTPException(status_code=500, detail="Could not update favorite status")
+
+    if record_ids:
+        broker.publish(RECORD_UPDATED, {"ids": record_ids, "is_favorite": is_favorite})
+
+    return BulkOperationResult(succeeded=record_ids, failed=_missing_ids(ids, record_ids))
+
+def bulk_update_tags(
+    add_tags: List[str],
+    remove_tags: List[str],
+    ids: Optional[List[str]] = None,
+    **filters
+) -> BulkOperationResult:
+    """
+    在单个事务中为一批记录添加或移除标签。
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            record_ids = select_record_ids(cursor, ids=ids, **filters)
+
+            if record_ids and add_tags:
+                cursor.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(name,) for name in add_tags])
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO record_tags (record_id, tag_id) SELECT ?, id FROM tags WHERE name = ?",
+                    [(record_id, name) for record_id in record_ids for name in add_tags]
+                )
+
+            if record_ids and remove_tags:
+                cursor.executemany(
+                    "DELETE FROM record_tags WHERE record_id = ? AND tag_id IN (SELECT id FROM tags WHERE name = ?)",
+                    [(record_id, name) for record_id in record_ids for name in remove_tags]
+                )
+
+            now = datetime.now().isoformat()
+            for batch in _chunked(record_ids, SQL_IN_BATCH_SIZE):
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(f"UPDATE records SET updated_at = ? WHERE id IN ({placeholders})", [now, *batch])
+            conn.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error bulk updating tags: {e}")
+        raise HTTPException(status_code=500, detail="Could not update tags")
+
+    if record_ids:
+        broker.publish(RECORD_UPDATED, {"ids": record_ids, "tags_added": add_tags, "tags_removed": remove_tags})
+
+    return BulkOperationResult(succeeded=record_ids, failed=_missing_ids(ids, record_ids))
+
+def bulk_delete_records(storage: StorageBackend, ids: Optional[List[str]] = None, **filters) -> BulkOperationResult:
+    """
+    批量删除记录及其音频文件。
+    数据库删除在单个事务中完成；音频文件随后通过存储后端的批量删除接口清理。
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            record_ids = select_record_ids(cursor, ids=ids, **filters)
+
+            audio_urls: Dict[str, str] = {}
+            for batch in _chunked(record_ids, SQL_IN_BATCH_SIZE):
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(f"SELECT id, audio_url FROM records WHERE id IN ({placeholders})", batch)
+                audio_urls.update({row['id']: row['audio_url'] for row in cursor.fetchall()})
+                cursor.execute(f"DELETE FROM record_tags WHERE record_id IN ({placeholders})", batch)
+                cursor.execute(f"DELETE FROM record_peaks WHERE record_id IN ({placeholders})", batch)
+                cursor.execute(f"DELETE FROM stt_jobs WHERE record_id IN ({placeholders})", batch)
+                cursor.execute(f"DELETE FROM records WHERE id IN ({placeholders})", batch)
+            conn.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error bulk deleting records from database: {e}")
+        raise HTTPException(status_code=500, detail="Could not delete records from database")
+
+    if record_ids:
+        broker.publish(RECORD_DELETED, {"ids": record_ids})
+
+    result = BulkOperationResult(failed=_missing_ids(ids, record_ids))
+
+    # 记录已从数据库删除即算成功；音频在某个存储层删除失败时单独报告，不回滚数据库
+    result.succeeded = list(record_ids)
+    delete_results = storage.delete_many(list(set(audio_urls.values())))
+    for record_id, audio_url in audio_urls.items():
+        failed_tiers = [tier for tier, deleted in delete_results.get(audio_url, {}).items() if not deleted]
+        if failed_tiers:
+            logging.error(f"Failed to delete audio file {audio_url} for record {record_id} from: {', '.join(failed_tiers)}")
+            result.audio_failed[record_id] = f"Record deleted but audio file remains in: {', '.join(failed_tiers)}"
+
+    return result
@@ -0,0 +1,313 @@
+"""
+使用新的 STT 模型或新的 VAD 参数批量重新识别已有录音。
+
+用法:
+    python reprocess.py --start 2024-01-01 --end 2024-06-30 [--job my-job]
+                        [--workers 2] [--batch-size 50] [--resegment] [--tag reprocessed] [--clear-no-speech]
+
+按 (timestamp, id) 顺序从存储后端读取日期范围内的录音，由工作池并行识别，
+每批结果与任务进度在同一个事务中写回 records 表。任务中断后使用相同的 --job 再次运行即可从断点继续。
+识别出错或没有识别出文本时保留原有文本；只有指定 --clear-no-speech 时才清空没有语音的记录的文本。
+任务以较低的调度优先级运行，避免与实时录音争抢 CPU。
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import threading
+import time
+import wave
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import List, Optional
+
+from config import load_config
+from database import get_db_connection, init_db
+from log import init_log
+from stt import STTEngine, get_stt_engine
+from stt.queue import DEFAULT_CONFIDENCE
+from storage import StorageBackend, get_storage_backend
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReprocessResult:
+    record_id: str
+    transcription: Optional[str] # None 表示读取或识别失败（或结果为空），不更新该记录
+
+
+def _read_all(stream) -> bytes:
+    try:
+        return stream.read()
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+        if hasattr(stream, 'release_conn'):
+            stream.release_conn()
+
+
+class Resegmenter:
+    """
+    使用新的 VAD 参数对录音重新切分，只把检测到的语音部分送去识别。
+    存储中的原始音频不会被修改。Silero 模型带有内部状态，同一时间只允许一个线程使用。
+    """
+
+    def __init__(self, vad_config: dict):
+        from silero_vad import load_silero_vad
+        from vad.engine import VadWrapper
+
+        class _CollectingVadWrapper(VadWrapper):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.segments: List[bytes] = []
+
+            async def _handle_segment(self, speech_data: bytes, timestamp: datetime, segment_end_time: float, stream_session=None):
+                self.segments.append(speech_data)
+
+        self._wrapper_class = _CollectingVadWrapper
+        self._model = load_silero_vad()
+        self._vad_config = vad_config
+        self._lock = threading.Lock()
+
+    def speech_only(self, wav_data: bytes) -> Optional[bytes]:
+        """返回只包含语音片段的 WAV 数据；未检测到语音时返回 None。"""
+        with wave.open(io.BytesIO(wav_data), "rb") as wf:
+            sample_rate = wf.getframerate()
+            pcm = wf.readframes(wf.getnframes())
+
+        with self._lock:
+            wrapper = self._wrapper_class(
+                self._model, on_speech_end=None, transcription_queue=None, storage_backend=None,
+                **{**self._vad_config, "sample_rate": sample_rate}
+            )
+            asyncio.run(wrapper.process(pcm))
+            segments = wrapper.segments
+            # 录音结尾仍处于说话状态时，剩余部分也算作一个片段
+            if wrapper._is_speaking and wrapper._speech_buffer:
+                segments.append(bytes(wrapper._speech_buffer))
+
+        if not segments:
+            return None
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(sample_rate)
+            wf.writeframes(b"".join(segments))
+        return buffer.getvalue()
+
+
+def _get_or_create_job(name: str, start_date: date, end_date: date) -> dict:
+    now = datetime.utcnow().isoformat()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM reprocess_jobs WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute(
+                "INSERT INTO reprocess_jobs (name, start_date, end_date, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (name, start_date.isoformat(), end_date.isoformat(), now, now)
+            )
+            conn.commit()
+            cursor.execute("SELECT * FROM reprocess_jobs WHERE name = ?", (name,))
+            row = cursor.fetchone()
+    job = dict(row)
+    if (job['start_date'], job['end_date']) != (start_date.isoformat(), end_date.isoformat()):
+        raise ValueError(
+            f"任务 '{name}' 已存在，日期范围为 {job['start_date']} ~ {job['end_date']}，请使用新的任务名"
+        )
+    return job
+
+
+def _fetch_batch(job: dict, batch_size: int) -> List[dict]:
+    last_timestamp, last_id = job['last_timestamp'] or "", job['last_id'] or ""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT id, timestamp, audio_url
+            FROM records
+            WHERE SUBSTR(timestamp, 1, 10) BETWEEN ? AND ?
+              AND (timestamp > ? OR (timestamp = ? AND id > ?))
+            ORDER BY timestamp ASC, id ASC
+            LIMIT ?
+            """,
+            (job['start_date'], job['end_date'], last_timestamp, last_timestamp, last_id, batch_size)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def _commit_batch(job: dict, batch: List[dict], results: List[ReprocessResult], tags: List[str]):
+    """在同一个事务中写入识别结果、标签和任务进度，保证断点与已写入的数据一致。"""
+    now = datetime.utcnow().isoformat()
+    succeeded = [result for result in results if result.transcription is not None]
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "UPDATE records SET transcription = ?, confidence = ?, transcription_status = 'done', updated_at = ? WHERE id = ?",
+            [(result.transcription, DEFAULT_CONFIDENCE, now, result.record_id) for result in succeeded]
+        )
+        # 已重新识别的记录不再需要 STT 队列中的任务
+        cursor.executemany("DELETE FROM stt_jobs WHERE record_id = ?", [(result.record_id,) for result in succeeded])
+        if tags and succeeded:
+            cursor.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(name,) for name in tags])
+            cursor.executemany(
+                "INSERT OR IGNORE INTO record_tags (record_id, tag_id) SELECT ?, id FROM tags WHERE name = ?",
+                [(result.record_id, name) for result in succeeded for name in tags]
+            )
+        job['last_timestamp'], job['last_id'] = batch[-1]['timestamp'], batch[-1]['id']
+        job['processed'] += len(succeeded)
+        job['failed'] += len(results) - len(succeeded)
+        cursor.execute(
+            """
+            UPDATE reprocess_jobs
+            SET last_timestamp = ?, last_id = ?, processed = ?, failed = ?, updated_at = ?
+            WHERE name = ?
+            """,
+            (job['last_timestamp'], job['last_id'], job['processed'], job['failed'], now, job['name'])
+        )
+        conn.commit()
+
+
+def _finish_job(job: dict):
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE reprocess_jobs SET finished_at = ?, updated_at = ? WHERE name = ?",
+            (datetime.utcnow().isoformat(), datetime.utcnow().isoformat(), job['name'])
+        )
+        conn.commit()
+
+
+async def _reprocess_record(
+    record: dict,
+    storage: StorageBackend,
+    stt_engine: STTEngine,
+    resegmenter: Optional[Resegmenter],
+    semaphore: asyncio.Semaphore,
+    clear_no_speech: bool = False,
+) -> ReprocessResult:
+    """:param clear_no_speech: 没有检测到语音或识别结果为空时清空原有文本，否则不更新该记录"""
+    async with semaphore:
+        try:
+            stream = await asyncio.to_thread(storage.get_stream, record['audio_url'])
+            if stream is None:
+                logger.warning(f"Audio not found for record {record['id']}: {record['audio_url']}")
+                return ReprocessResult(record['id'], None)
+            wav_data = await asyncio.to_thread(_read_all, stream)
+
+            if resegmenter is not None:
+                wav_data = await asyncio.to_thread(resegmenter.speech_only, wav_data)
+                if wav_data is None:
+                    logger.info(f"No speech detected in record {record['id']} with the new VAD parameters.")
+                    return ReprocessResult(record['id'], "" if clear_no_speech else None)
+
+            transcription = await stt_engine.transcribe_bytes(wav_data)
+            if not transcription and not clear_no_speech:
+                logger.info(f"Empty transcript for record {record['id']}, keeping the existing one.")
+                return ReprocessResult(record['id'], None)
+            return ReprocessResult(record['id'], transcription)
+        except Exception as e:
+            logger.error(f"Failed to reprocess record {record['id']}: {e}")
+            return ReprocessResult(record['id'], None)
+
+
+async def reprocess(
+    storage: StorageBackend,
+    stt_engine: STTEngine,
+    job_name: str,
+    start_date: date,
+    end_date: date,
+    workers: int = 2,
+    batch_size: int = 50,
+    resegmenter: Optional[Resegmenter] = None,
+    tags: Optional[List[str]] = None,
+    batch_pause_seconds: float = 0.0,
+    clear_no_speech: bool = False,
+) -> dict:
+    """
+    重新识别日期范围内的录音。
+    :param clear_no_speech: 清空没有检测到语音的记录的文本，默认保留原有文本
+    :return: 任务进度 (reprocess_jobs 中的一行)
+    """
+    job = _get_or_create_job(job_name, start_date, end_date)
+    if job['finished_at']:
+        logger.info(f"Reprocess job '{job_name}' already finished at {job['finished_at']}.")
+        return job
+    if job['last_id']:
+        logger.info(f"Resuming reprocess job '{job_name}' after record {job['last_id']} ({job['processed']} done).")
+
+    semaphore = asyncio.Semaphore(workers)
+    while True:
+        batch = await asyncio.to_thread(_fetch_batch, job, batch_size)
+        if not batch:
+            break
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            _reprocess_record(record, storage, stt_engine, resegmenter, semaphore, clear_no_speech) for record in batch
+        ))
+        await asyncio.to_thread(_commit_batch, job, batch, results, tags or [])
+        logger.info(
+            f"Reprocess job '{job_name}': {job['processed']} done, {job['failed']} failed "
+            f"(last batch of {len(batch)} took {time.perf_counter() - start:.1f}s)."
+        )
+        if batch_pause_seconds:
+            await asyncio.sleep(batch_pause_seconds)
+
+    _finish_job(job)
+    logger.info(f"Reprocess job '{job_name}' finished.")
+    return job
+
+
+def lower_priority(niceness: int):
+    """降低本进程的调度优先级，并限制 PyTorch 线程数，让出 CPU 给实时录音。"""
+    if hasattr(os, "nice"):
+        try:
+            os.nice(niceness)
+        except OSError as e:
+            logger.warning(f"Could not lower process priority: {e}")
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="使用新的 STT 模型或 VAD 参数批量重新识别已有录音")
+    parser.add_argument("--start", required=True, type=date.fromisoformat, help="开始日期 (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, type=date.fromisoformat, help="结束日期 (YYYY-MM-DD)")
+    parser.add_argument("--job", default=None, help="任务名，用于断点续跑；默认由日期范围生成")
+    parser.add_argument("--workers", type=int, default=2, help="同时识别的录音数")
+    parser.add_argument("--batch-size", type=int, default=50, help="每批写入数据库的记录数")
+    parser.add_argument("--resegment", action="store_true", help="使用 .config.yaml 中的 vad 参数重新切分后再识别")
+    parser.add_argument("--clear-no-speech", action="store_true", help="没有检测到语音时清空记录原有的文本（默认保留）")
+    parser.add_argument("--tag", action="append", default=[], help="为重新识别的记录添加标签，可重复")
+    parser.add_argument("--nice", type=int, default=10, help="降低的调度优先级 (nice 值)")
+    parser.add_argument("--batch-pause", type=float, default=0.0, help="每批之间暂停的秒数")
+    args = parser.parse_args()
+
+    init_log()
+    init_db()
+    lower_priority(args.nice)
+
+    config = load_config()
+    storage = get_storage_backend(config.get('storage', {}))
+    stt_engine = get_stt_engine(config.get('stt', {}))
+    resegmenter = Resegmenter(config.get('vad', {})) if args.resegment else None
+
+    asyncio.run(reprocess(
+        storage,
+        stt_engine,
+        job_name=args.job or f"reprocess-{args.start.isoformat()}-{args.end.isoformat()}",
+        start_date=args.start,
+        end_date=args.end,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        resegmenter=resegmenter,
+        tags=args.tag,
+        batch_pause_seconds=args.batch_pause,
+        clear_no_speech=args.clear_no_speech,
+    ))
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import pytz
+
+from database import get_db_connection
+from records import bulk_delete_records
+from schemas import RetentionReport
+from storage import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+# 所有音频均由 VadWrapper 以 16kHz、16-bit、单声道 WAV 保存，
+# 因此可以由时长估算文件大小，无需逐个访问存储后端
+WAV_HEADER_BYTES = 44
+WAV_BYTES_PER_SECOND = 16000 * 2
+
+SIZE_EXPR = f"(CAST(r.duration * {WAV_BYTES_PER_SECOND} AS INTEGER) + {WAV_HEADER_BYTES})"
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    录音保留策略。
+    满足 max_age_days 的旧录音会被清理；若总量仍超过 max_total_bytes，
+    则继续从最旧的可删除录音开始清理，直到总量回到上限以内。
+    """
+    enabled: bool = False
+    max_age_days: Optional[int] = 30
+    keep_favorites: bool = True
+    keep_tags: List[str] = field(default_factory=list)
+    max_total_bytes: Optional[int] = None
+    interval_minutes: int = 60      # 定时任务执行间隔
+    batch_size: int = 200           # 每批删除的记录数
+    batch_pause_seconds: float = 1.0 # 批次之间的暂停时间，避免长时间占用数据库和存储
+    dry_run: bool = False
+
+    @classmethod
+    def from_config(cls, config: dict) -> "RetentionPolicy":
+        known = {k: v for k, v in (config or {}).items() if k in cls.__dataclass_fields__}
+        return cls(**known)
+
+
+def _protection_clause(policy: RetentionPolicy) -> Tuple[str, list]:
+    """生成排除受保护记录（收藏、指定标签）的 SQL 条件。"""
+    conditions = []
+    params = []
+    if policy.keep_favorites:
+        conditions.append("r.is_favorite = 0")
+    if policy.keep_tags:
+        placeholders = ",".join("?" * len(policy.keep_tags))
+        conditions.append(
+            "NOT EXISTS (SELECT 1 FROM record_tags rt JOIN tags t ON rt.tag_id = t.id "
+            f"WHERE rt.record_id = r.id AND t.name IN ({placeholders}))"
+        )
+        params.extend(policy.keep_tags)
+    return " AND ".join(conditions) or "1 = 1", params
+
+
+def find_retention_candidates(policy: RetentionPolicy, now: datetime = None) -> Tuple[List[Tuple[str, int]], int]:
+    """
+    找出按策略应被清理的记录。
+    :return: ([(记录 ID, 估算字节数)], 清理前的估算总字节数)
+    """
+    if now is None:
+        now = datetime.now(pytz.timezone("Asia/Shanghai"))
+
+    protection, protection_params = _protection_clause(policy)
+    candidates: List[Tuple[str, int]] = []
+    seen = set()
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(f"SELECT COALESCE(SUM({SIZE_EXPR}), 0) AS total FROM records r")
+        total_bytes = cursor.fetchone()['total']
+
+        # 1. 超过保留天数的记录；timestamp 为 ISO 字符串，可直接利用索引做范围比较
+        if policy.max_age_days is not None:
+            cutoff = (now - timedelta(days=policy.max_age_days)).isoformat()
+            cursor.execute(
+                f"""
+                SELECT r.id, {SIZE_EXPR} AS size
+                FROM records r
+                WHERE r.timestamp < ? AND {protection}
+                ORDER BY r.timestamp ASC
+                """,
+                [cutoff, *protection_params]
+            )
+            for row in cursor.fetchall():
+                candidates.append((row['id'], row['size']))
+                seen.add(row['id'])
+
+        # 2. 总量仍超出上限时，从最旧的可删除记录继续清理
+        if policy.max_total_bytes is not None:
+            remaining = total_bytes - sum(size for _, size in candidates)
+            if remaining > policy.max_total_bytes:
+                cursor.execute(
+                    f"""
+                    SELECT r.id, {SIZE_EXPR} AS size
+                    FROM records r
+                    WHERE {protection}
+                    ORDER BY r.timestamp ASC
+                    """,
+                    protection_params
+                )
+                while remaining > policy.max_total_bytes:
+                    rows = cursor.fetchmany(policy.batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        if remaining <= policy.max_total_bytes:
+                            break
+                        if row['id'] in seen:
+                            continue
+                        candidates.append((row['id'], row['size']))
+                        seen.add(row['id'])
+                        remaining -= row['size']
+
+    return candidates, total_bytes
+
+
+def run_retention(policy: RetentionPolicy, storage: StorageBackend, dry_run: bool = None) -> RetentionReport:
+    """
+    执行一次保留策略清理。这是一个阻塞函数，应在线程中运行。
+    :param dry_run: 为 True 时只报告将被删除的记录，不做任何修改；默认使用策略中的设置
+    """
+    if dry_run is None:
+        dry_run = policy.dry_run
+
+    candidates, total_bytes = find_retention_candidates(policy)
+    report = RetentionReport(
+        dry_run=dry_run,
+        candidates=len(candidates),
+        total_bytes_before=total_bytes,
+    )
+
+    if dry_run:
+        report.record_ids = [record_id for record_id, _ in candidates]
+        report.bytes_reclaimed = sum(size for _, size in candidates)
+        logger.info(
+            f"Retention dry run: {report.candidates} records would be deleted, "
+            f"reclaiming ~{report.bytes_reclaimed} bytes of {total_bytes}."
+        )
+        return report
+
+    sizes = dict(candidates)
+    for i in range(0, len(candidates), policy.batch_size):
+        batch = [record_id for record_id, _ in candidates[i:i + policy.batch_size]]
+        result = bulk_delete_records(storage, ids=batch)
+        report.deleted += len(result.succeeded)
+        report.failed += len(result.failed)
+        report.audio_failed += len(result.audio_failed)
+        # 音频仍留在某个存储层的记录没有真正释放空间
+        report.bytes_reclaimed += sum(
+            sizes[record_id] for record_id in result.succeeded if record_id not in result.audio_failed
+        )
+        report.record_ids.extend(result.succeeded)
+        if i + policy.batch_size < len(candidates):
+            time.sleep(policy.batch_pause_seconds)
+
+    logger.info(
+        f"Retention finished: deleted {report.deleted} records ({report.failed} failed, "
+        f"{report.audio_failed} with audio left in storage), "
+        f"reclaimed ~{report.bytes_reclaimed} bytes of {total_bytes}."
+    )
+    return report
+
+
+async def retention_loop(policy: RetentionPolicy, storage: StorageBackend):
+    """按配置的间隔定期执行保留策略的后台任务。"""
+    logger.info(f"Retention job started: {policy}")
+    while True:
+        try:
+            await asyncio.to_thread(run_retention, policy, storage)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.error("Retention job failed", exc_info=True)
+        await asyncio.sleep(policy.interval_minutes * 60)
@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import List, Dict, Union
+from typing import List, Dict, Optional, Union
 
 @dataclass
 class SleepRecordCreate:
@@ -10,6 +10,11 @@ class SleepRecordCreate:
     transcription: str
     confidence: float = 0.0
     tags: List[str] = field(default_factory=list)
+    peaks: Optional[bytes] = field(default=None, repr=False) # 波形峰值 (int8 min/max 交错)
+    samples_per_peak: int = 160
+    transcription_status: str = "done" # "pending" 表示音频已保存，等待 STT 队列识别
+    device_id: Optional[str] = None # 采集设备，未指定时为 None
+    segments: Optional[List[Dict[str, float]]] = None # 合并记录中每个子片段的 offset/duration（秒），未合并时为 None
 
 
 @dataclass
@@ -23,6 +28,9 @@ class SleepRecord:
     confidence: float = 0.0
     is_favorite: bool = False # 添加 is_favorite 字段
     tags: List[str] = field(default_factory=list)
+    transcription_status: str = "done" # done / pending / failed
+    device_id: Optional[str] = None
+    segments: Optional[List[Dict[str, float]]] = None
 
 
 @dataclass
@@ -56,6 +64,22 @@ class TagStat:
     name: str
     value: int
 
+@dataclass
+class DeviceStat:
+    """按设备的统计数据，device 为 None 表示未指定设备的记录"""
+    device: Optional[str]
+    count: int
+    totalDuration: float
+
+@dataclass
+class DeviceSummary:
+    """设备列表中的一项，device_id 为 None 表示未指定设备的记录"""
+    device_id: Optional[str]
+    record_count: int = 0
+    total_duration: float = 0.0
+    last_record_at: Optional[str] = None
+    connected: bool = False # 当前是否有该设备的 /vad 连接
+
 @dataclass
 class KeywordStat:
     """关键词统计数据"""
@@ -70,3 +94,23 @@ class StatisticsResponse:
     hourlyStats: List[HourlyStat]
     tagStats: List[TagStat]
     keywordData: List[KeywordStat]
+    deviceStats: List[DeviceStat] = field(default_factory=list)
+
+@dataclass
+class BulkOperationResult:
+    """批量操作结果，按记录 ID 报告成功与失败"""
+    succeeded: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict) # 记录 ID -> 失败原因
+    audio_failed: Dict[str, str] = field(default_factory=dict) # 已删除但音频未能从所有存储层删除的记录 ID -> 原因
+
+@dataclass
+class RetentionReport:
+    """保留策略执行结果"""
+    dry_run: bool
+    candidates: int = 0
+    deleted: int = 0
+    failed: int = 0
+    audio_failed: int = 0 # 记录已删除但音频仍留在某个存储层（例如 MinIO 不可用）的数量
+    bytes_reclaimed: int = 0 # 按音频时长估算的字节数
+    total_bytes_before: int = 0
+    record_ids: List[str] = field(default_factory=list)
@@ -0,0 +1,68 @@
+"""
+服务启动进度与就绪状态。
+
+模型在后台加载，只读 API 在此期间即可使用；/vad 和 STT 在对应组件就绪前返回未就绪。
+每个启动阶段的耗时都会记录到日志和指标中，并通过 /ready 返回。
+"""
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from metrics import STARTUP_PHASE
+
+logger = logging.getLogger(__name__)
+
+# 需要等待加载的组件
+COMPONENTS = ("vad", "stt")
+
+
+class StartupTracker:
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.components: Dict[str, str] = {name: "loading" for name in COMPONENTS}
+        self.errors: Dict[str, str] = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        """记录一个启动阶段的耗时（秒）。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = round(elapsed, 3)
+            STARTUP_PHASE.labels(name).set(elapsed)
+            logger.info(f"Startup phase '{name}' took {elapsed * 1000:.0f} ms.")
+
+    def mark_ready(self, component: str):
+        self.components[component] = "ready"
+        logger.info(f"Component '{component}' is ready ({time.perf_counter() - self._started:.1f}s after startup).")
+        if self.ready:
+            self.phases["total"] = round(time.perf_counter() - self._started, 3)
+
+    def mark_failed(self, component: str, error: str):
+        self.components[component] = "failed"
+        self.errors[component] = error
+        logger.error(f"Component '{component}' failed to load: {error}")
+
+    def is_ready(self, component: Optional[str] = None) -> bool:
+        if component is not None:
+            return self.components.get(component) == "ready"
+        return self.ready
+
+    @property
+    def ready(self) -> bool:
+        return all(state == "ready" for state in self.components.values())
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "components": dict(self.components),
+            "errors": dict(self.errors),
+            "phases": dict(self.phases),
+        }
+
+
+startup = StartupTracker()
@@ -3,10 +3,10 @@ import abc
 import io
 import logging
 from datetime import datetime
+from typing import Dict, List
 import urllib3
 import threading
-from minio import Minio
-from minio.error import S3Error
+from config import DATA_DIR
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +15,7 @@ class StorageBackend(abc.ABC):
     存储后端抽象基类。
     定义了保存和获取文件的标准接口。
     """
+    TIER = "storage" # 批量删除结果中该后端的存储层名称
 
     @abc.abstractmethod
     def save(self, data: bytes, filename: str) -> str:
@@ -66,10 +67,25 @@ class StorageBackend(abc.ABC):
         """
         pass
 
+    def delete_many(self, file_paths: List[str]) -> Dict[str, Dict[str, bool]]:
+        """
+        批量删除文件。默认实现逐个调用 delete，支持批量接口的后端应重写此方法。
+        :return: 文件标识符 -> {存储层: 是否删除成功}，文件在所有存储层都删除成功时才算彻底删除
+        """
+        results = {}
+        for file_path in file_paths:
+            try:
+                results[file_path] = {self.TIER: self.delete(file_path)}
+            except Exception as e:
+                logger.error(f"Failed to delete file {file_path}: {e}")
+                results[file_path] = {self.TIER: False}
+        return results
+
 class LocalStorage(StorageBackend):
     """
     本地文件系统存储实现。
     """
+    TIER = "local"
     def __init__(self, base_dir: str):
         self.base_dir = base_dir
         if not os.path.exists(self.base_dir):
@@ -129,6 +145,7 @@ class MinioStorage(StorageBackend):
     MinIO 对象存储实现。
     包含本地存储作为灾备方案。
     """
+    TIER = "minio"
     def __init__(self, endpoint: str, access_key: str, secret_key: str, bucket_name: str, secure: bool = False):
         # 配置短超时 HTTP 客户端，确保容灾判断迅速
         # connect: 1s, read: 2s
@@ -142,6 +159,8 @@ class MinioStorage(StorageBackend):
             maxsize=20 # 增加连接池大小，避免并发请求时阻塞
         )
         
+        # 延迟导入，仅使用本地存储时不加载 minio
+        from minio import Minio
         self.client = Minio(
             endpoint,
             access_key=access_key,
@@ -153,7 +172,7 @@ class MinioStorage(StorageBackend):
         
         # 初始化本地存储作为 fallback
         # 使用默认的数据目录 server/data/records
-        base_dir = os.path.join(os.path.dirname(__file__), "data", "records")
+        base_dir = os.path.join(DATA_DIR, "records")
         self.local_backup = LocalStorage(base_dir)
 
         # 同步任务控制
@@ -429,6 +448,43 @@ class MinioStorage(StorageBackend):
                 
         return success
 
+    # MinIO (S3) 的多对象删除接口单次最多支持 1000 个对象
+    DELETE_BATCH_SIZE = 1000
+
+    def delete_many(self, file_paths: List[str]) -> Dict[str, Dict[str, bool]]:
+        """
+        批量删除文件。使用 MinIO 的多对象删除接口按批次删除，
+        随后清理本地备份中残留的副本。两层分别报告结果：MinIO 不可用时本地副本仍会被删除。
+        """
+        from minio.deleteobjects import DeleteObject
+        results = {file_path: {self.TIER: True} for file_path in file_paths}
+
+        for i in range(0, len(file_paths), self.DELETE_BATCH_SIZE):
+            batch = file_paths[i:i + self.DELETE_BATCH_SIZE]
+            try:
+                # remove_objects 是惰性的，必须遍历返回的错误迭代器才会真正执行删除
+                errors = self.client.remove_objects(
+                    self.bucket_name,
+                    [DeleteObject(file_path) for file_path in batch]
+                )
+                for error in errors:
+                    logger.error(f"Failed to delete file from MinIO {error.name}: {error.message}")
+                    results[error.name][self.TIER] = False
+                logger.info(f"Deleted {len(batch)} files from MinIO in one batch.")
+            except Exception as e:
+                logger.error(f"MinIO batch delete failed for {len(batch)} files: {e}")
+                for file_path in batch:
+                    results[file_path][self.TIER] = False
+
+        # 尝试从本地备份删除（MinIO 宕机期间写入的文件可能只存在于本地）
+        for file_path in file_paths:
+            if self.local_backup.exists(file_path):
+                results[file_path][self.local_backup.TIER] = self.local_backup.delete(file_path)
+                if not results[file_path][self.local_backup.TIER]:
+                    logger.error(f"Failed to delete file from local backup {file_path}")
+
+        return results
+
 def get_storage_backend(config: dict) -> StorageBackend:
     """
     工厂函数，根据配置创建存储后端实例。
@@ -445,5 +501,5 @@ def get_storage_backend(config: dict) -> StorageBackend:
         )
     else:
         # 默认为本地存储
-        base_dir = os.path.join(os.path.dirname(__file__), "data", "records")
+        base_dir = os.path.join(DATA_DIR, "records")
         return LocalStorage(base_dir)
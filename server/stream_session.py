@@ -0,0 +1,335 @@
+"""
+带帧头的 /vad 协议与可恢复的流会话。
+
+客户端连接后先发送 hello 文本消息：
+    {"type": "hello", "session_id": "<uuid>", "capture_start": "<第 0 个采样的采集时间, ISO 8601>", "sample_rate": 16000, "device_id": "bedroom"}
+服务器回复 welcome，告知是否恢复了已有会话，以及已经收到的采样位置，客户端从该位置继续发送：
+    {"type": "welcome", "session_id": "<uuid>", "resumed": true, "next_sample": 123456}
+之后每条二进制消息都带有 32 字节的帧头，后面是按协商的编码编码的音频：
+    magic "DT" | 版本 (1B) | 标志 (1B) | 会话 ID (16B UUID) | 序号 (uint32) | 第一个采样的采集位置 (uint64)，均为大端
+
+记录的时间戳由会话的 capture_start 加上采样位置推算，与服务器何时处理无关。
+连接断开后会话（包括 VAD 状态和未结束的语音）保留 grace_seconds，期间重连的客户端可以从中断处继续；
+超时后把进行中的语音作为一个片段保存，再释放会话。
+
+服务器通过 FeedbackChannel 向客户端发送 JSON 控制消息：
+    {"type": "ack", "seq": 已处理的最后一条消息序号, "next_sample": ..., "lag_ms": 采集到处理完成的延迟, "rtf": 处理耗时/音频时长}
+    {"type": "flow", "state": "ok" | "slow" | "overloaded", "rtf": ...}  处理速度变化时发送，slow 时客户端合并成更大的帧，
+        overloaded 时客户端暂停实时发送、改为本地缓存后补传
+    {"type": "segment", "record_id": ..., "timestamp": ..., "duration": ..., "transcription_status": ...}  检测到一个语音片段
+    {"type": "transcribed", "record_id": ..., "status": "done" | "failed" | "discarded", "transcription": ...}
+"""
+import asyncio
+import logging
+import struct
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import pytz
+
+from events import broker, RECORD_UPDATED, RECORD_DELETED
+from metrics import STREAM_FRAMES, STREAM_FLOW_SIGNALS
+from schemas import SleepRecordCreate
+
+logger = logging.getLogger(__name__)
+
+FRAME_MAGIC = b"DT"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct(">2sBB16sIQ")
+SAMPLE_RATE = 16000
+FLOW_STATES = ("ok", "slow", "overloaded")
+
+
+class FrameError(ValueError):
+    """帧头无法解析或与会话不符。"""
+
+
+def parse_frame(data: bytes) -> Tuple[uuid.UUID, int, int, bytes]:
+    """解析一条二进制消息，返回 (会话 ID, 序号, 采样位置, 音频数据)。"""
+    if len(data) < FRAME_HEADER.size:
+        raise FrameError(f"消息长度 {len(data)} 小于帧头长度")
+    magic, version, _flags, session_id, sequence, sample_index = FRAME_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise FrameError(f"未知的帧头: magic={magic!r}, version={version}")
+    return uuid.UUID(bytes=session_id), sequence, sample_index, data[FRAME_HEADER.size:]
+
+
+class StreamSession:
+    def __init__(self, session_id: uuid.UUID, capture_start: datetime, vad_wrapper=None):
+        self.session_id = session_id
+        self.capture_start = capture_start
+        self.vad_wrapper = vad_wrapper
+        self.next_sample = 0 # 已处理到的采样位置
+        self.next_sequence = 0
+        self.last_sequence = -1 # 已处理的最后一条消息（音频或控制消息）的序号
+        self.record_ids: deque = deque(maxlen=256) # 本会话生成的记录，用于转发识别结果
+        self.listener: Optional[Callable[[dict], None]] = None # 当前连接的控制消息通道
+        self.connection_id: Optional[int] = None # 当前附着的连接，None 表示处于断线宽限期
+        self._origin: Optional[int] = None # VadWrapper 内第 0 个采样对应的流位置，None 表示需要重新定位
+        self._expiry: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def _restart_vad(self):
+        await self.vad_wrapper.flush()
+        self.vad_wrapper.reset()
+        self._origin = None
+
+    async def feed(self, sequence: int, sample_index: int, pcm: bytes):
+        """按采样位置处理一帧音频：重复的部分丢弃，位置跳跃时视为音频不连续，重新开始 VAD。"""
+        async with self._lock:
+            if sequence != self.next_sequence and self.next_sequence:
+                logger.debug(f"Session {self.session_id}: expected frame {self.next_sequence}, got {sequence}")
+            self.next_sequence = sequence + 1
+            self.last_sequence = sequence
+
+            samples = len(pcm) // 2
+            if sample_index + samples <= self.next_sample:
+                STREAM_FRAMES.labels("duplicate").inc()
+                return
+            if sample_index < self.next_sample:
+                # 重传的帧与已处理的音频部分重叠
+                pcm = pcm[(self.next_sample - sample_index) * 2:]
+                sample_index = self.next_sample
+
+            if self._origin is None or sample_index > self.next_sample:
+                if self._origin is not None:
+                    STREAM_FRAMES.labels("gap").inc()
+                    await self._restart_vad()
+                self._origin = sample_index
+                self.vad_wrapper.capture_start = self.capture_start + timedelta(seconds=sample_index / SAMPLE_RATE)
+
+            STREAM_FRAMES.labels("ok").inc()
+            await self.vad_wrapper.process(pcm)
+            self.next_sample = sample_index + len(pcm) // 2
+
+    async def handle_control(self, message: dict):
+        """边缘 VAD 的语音窗口边界：窗口之间的音频不连续，每个窗口使用独立的 VAD 状态。"""
+        message_type = message.get("type")
+        if "seq" in message:
+            self.last_sequence = message["seq"]
+        if message_type in ("window_start", "window_end"):
+            async with self._lock:
+                await self._restart_vad()
+        elif message_type != "keepalive":
+            logger.warning(f"未知的控制消息: {message}")
+
+    def on_record(self, record_id, record_data: SleepRecordCreate):
+        """VadWrapper 保存了一个语音片段。"""
+        self.record_ids.append(record_id)
+        self.notify({
+            "type": "segment",
+            "record_id": record_id,
+            "timestamp": record_data.timestamp,
+            "duration": record_data.duration,
+            "transcription_status": record_data.transcription_status,
+        })
+
+    def notify(self, message: dict):
+        """发送给当前连接的客户端；断线期间的消息直接丢弃。"""
+        if self.listener is not None:
+            self.listener(message)
+
+    async def close(self):
+        """保存进行中的语音并释放 VAD 状态（归还模型实例）。"""
+        async with self._lock:
+            await self.vad_wrapper.flush()
+            self.vad_wrapper.close()
+
+
+class SessionRegistry:
+    def __init__(self, grace_seconds: float = 60):
+        self.grace_seconds = grace_seconds
+        self.sessions: Dict[uuid.UUID, StreamSession] = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    async def attach(
+        self,
+        session_id: uuid.UUID,
+        capture_start: datetime,
+        connection_id: int,
+        create_vad_wrapper: Callable[[Callable], Awaitable],
+    ) -> Tuple[StreamSession, bool]:
+        """
+        把连接附着到会话上，返回 (会话, 是否为恢复的已有会话)。
+        同一会话的旧连接尚未被发现断开时，新连接直接接管。
+        :param create_vad_wrapper: 接收片段保存后的回调 (记录 ID, 记录数据)，返回新的 VadWrapper 的协程
+        """
+        session = self.sessions.get(session_id)
+        resumed = session is not None
+        if session is None:
+            session = StreamSession(session_id, capture_start)
+            vad_wrapper = await create_vad_wrapper(session.on_record)
+            existing = self.sessions.get(session_id)
+            if existing is None:
+                session.vad_wrapper = vad_wrapper
+                self.sessions[session_id] = session
+            else:
+                # 等待模型实例期间，同一会话已被另一个连接创建
+                vad_wrapper.close()
+                session, resumed = existing, True
+        if session._expiry is not None:
+            session._expiry.cancel()
+            session._expiry = None
+        session.connection_id = connection_id
+        return session, resumed
+
+    def detach(self, session: StreamSession, connection_id: int):
+        """连接断开后保留会话 grace_seconds 秒。"""
+        if session.connection_id != connection_id:
+            # 已被新连接接管
+            return
+        session.connection_id = None
+        session.listener = None
+        session._expiry = asyncio.create_task(self._expire(session))
+
+    async def _expire(self, session: StreamSession):
+        await asyncio.sleep(self.grace_seconds)
+        if self.sessions.get(session.session_id) is session and session.connection_id is None:
+            del self.sessions[session.session_id]
+            logger.info(f"Stream session {session.session_id} expired after {self.grace_seconds}s without reconnect.")
+            await session.close()
+
+
+class FeedbackChannel:
+    """
+    一个连接上服务器→客户端的控制消息。确认按 ack_interval 定期发送，所有消息经由同一个发送任务按顺序发出；
+    客户端读取太慢时丢弃最旧的消息，不阻塞音频处理。
+    """
+
+    def __init__(
+        self,
+        websocket,
+        session: StreamSession,
+        ack_interval_ms: int = 500,
+        slow_rtf: float = 0.5,
+        overload_rtf: float = 0.9,
+    ):
+        """
+        :param slow_rtf: 处理耗时与音频时长之比（滑动平均）超过该值时通知客户端合并帧
+        :param overload_rtf: 超过该值时通知客户端暂停实时发送，改为本地缓存后补传
+        """
+        self.websocket = websocket
+        self.session = session
+        self.ack_interval = ack_interval_ms / 1000
+        self.slow_rtf = slow_rtf
+        self.overload_rtf = overload_rtf
+        self.rtf = 0.0
+        self.state = "ok"
+        self._processed = False # 上一次确认后是否处理过音频
+        self._messages: asyncio.Queue = asyncio.Queue(maxsize=256)
+        self._tasks = []
+
+    def start(self):
+        self.session.listener = self.send
+        self._tasks = [
+            asyncio.create_task(self._send_loop()),
+            asyncio.create_task(self._ack_loop()),
+            asyncio.create_task(self._forward_records()),
+        ]
+
+    async def close(self):
+        if self.session.listener == self.send:
+            self.session.listener = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def send(self, message: dict):
+        try:
+            self._messages.put_nowait(message)
+        except asyncio.QueueFull:
+            self._messages.get_nowait()
+            self._messages.put_nowait(message)
+
+    async def _send_loop(self):
+        while True:
+            message = await self._messages.get()
+            try:
+                await self.websocket.send_json(message)
+            except Exception:
+                # 连接已断开，由接收循环处理
+                return
+
+    async def _forward_records(self):
+        """转发本会话生成的记录的识别结果。"""
+        subscription = broker.subscribe()
+        try:
+            while True:
+                event = await subscription.get()
+                ids = [record_id for record_id in event.data.get("ids", []) if record_id in self.session.record_ids]
+                if not ids:
+                    continue
+                if event.type == RECORD_DELETED:
+                    # 没有识别出文本的片段由识别队列删除
+                    status = "discarded"
+                elif event.type == RECORD_UPDATED and event.data.get("transcription_status") in ("done", "failed"):
+                    status = event.data["transcription_status"]
+                else:
+                    continue
+                for record_id in ids:
+                    self.send({
+                        "type": "transcribed",
+                        "record_id": record_id,
+                        "status": status,
+                        "transcription": event.data.get("transcription"),
+                    })
+        finally:
+            broker.unsubscribe(subscription)
+
+    def on_processed(self, samples: int, elapsed: float):
+        """
+        处理完一条音频消息后调用，更新处理速度；处理速度跨过阈值时立即发送流控信号。
+        :param elapsed: 处理这条消息的耗时（秒）
+        """
+        if samples:
+            self.rtf += 0.1 * (elapsed * SAMPLE_RATE / samples - self.rtf)
+        self._processed = True
+        self._update_state()
+
+    def _update_state(self):
+        if self.rtf >= self.overload_rtf:
+            state = "overloaded"
+        elif self.rtf >= self.slow_rtf:
+            state = "slow"
+        else:
+            state = "ok"
+        if FLOW_STATES.index(state) < FLOW_STATES.index(self.state):
+            # 降级需要低于当前阈值的 80%，避免在阈值附近反复切换
+            threshold = self.overload_rtf if self.state == "overloaded" else self.slow_rtf
+            if self.rtf > threshold * 0.8:
+                state = self.state
+        if state != self.state:
+            self.state = state
+            STREAM_FLOW_SIGNALS.labels(state).inc()
+            logger.info(f"Stream session {self.session.session_id}: flow {state} (rtf={self.rtf:.2f})")
+            self.send({"type": "flow", "state": state, "rtf": round(self.rtf, 3)})
+
+    async def _ack_loop(self):
+        """
+        每隔 ack_interval 确认新处理的消息。客户端暂停发送时没有新的音频，
+        处理速度按空闲衰减，使流控状态能够恢复。
+        """
+        acked = None
+        while True:
+            await asyncio.sleep(self.ack_interval)
+            if not self._processed:
+                self.rtf *= 0.5
+                self._update_state()
+            self._processed = False
+            session = self.session
+            if (session.last_sequence, session.next_sample) == acked:
+                continue
+            acked = (session.last_sequence, session.next_sample)
+            processed_until = session.capture_start + timedelta(seconds=session.next_sample / SAMPLE_RATE)
+            lag = (datetime.now(pytz.utc) - processed_until).total_seconds()
+            self.send({
+                "type": "ack",
+                "seq": session.last_sequence,
+                "next_sample": session.next_sample,
+                "lag_ms": round(lag * 1000),
+                "rtf": round(self.rtf, 3),
+            })
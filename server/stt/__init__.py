@@ -1,19 +1,25 @@
+import importlib
 import logging
-from .base import STTEngine
-from .dummy_engine import DummySTTEngine
-from .funasr_engine import FunasrEngine
+from .base import STTEngine, StreamingSTTEngine
 
 logger = logging.getLogger(__name__)
 
 # STT 引擎注册表
 # 当你添加新的 STT 引擎实现时，请在这里注册。
-# 键是你在 config.yaml 中使用的引擎类型名称。
+# 键是你在 config.yaml 中使用的引擎类型名称，值为 "模块:类名"。
+# 引擎模块在创建时才导入，避免启动服务时加载未使用的模型依赖（如 funasr、torch）。
 ENGINE_REGISTRY = {
-    "dummy": DummySTTEngine,
-    "funasr": FunasrEngine,
-    # "whisper": WhisperEngine, # 示例：未来可以添加 Whisper 引擎
+    "dummy": "stt.dummy_engine:DummySTTEngine",
+    "funasr": "stt.funasr_engine:FunasrEngine",
+    "dummy_streaming": "stt.dummy_engine:DummyStreamingSTTEngine",
+    "funasr_streaming": "stt.funasr_streaming_engine:FunasrStreamingEngine",
+    # "whisper": "stt.whisper_engine:WhisperEngine", # 示例：未来可以添加 Whisper 引擎
 }
 
+def _load_engine_class(path: str) -> type:
+    module_name, class_name = path.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
 def get_stt_engine(config: dict) -> STTEngine:
     """
     STT 引擎工厂函数。
@@ -28,12 +34,24 @@ def get_stt_engine(config: dict) -> STTEngine:
     engine_type = config.get("type", "dummy")
     logger.info(f"正在根据配置创建 STT 引擎，类型: '{engine_type}'")
 
-    engine_class = ENGINE_REGISTRY.get(engine_type)
+    engine_path = ENGINE_REGISTRY.get(engine_type)
 
-    if engine_class is None:
+    if engine_path is None:
         raise ValueError(
             f"无效的 STT 引擎类型: '{engine_type}'。 "
             f"有效选项为: {list(ENGINE_REGISTRY.keys())}"
         )
 
-    return engine_class(config)
\ No newline at end of file
+    engine = _load_engine_class(engine_path)(config)
+
+    # 流式引擎在说话过程中识别，结果缓存对它没有意义
+    cache_config = config.get("cache", {})
+    if cache_config.get("enabled", False) and not isinstance(engine, StreamingSTTEngine):
+        from .cache import CachedSTTEngine
+        logger.info("已启用 STT 识别结果缓存。")
+        engine = CachedSTTEngine(
+            engine,
+            memory_entries=cache_config.get("memory_entries", 256),
+            max_entries=cache_config.get("max_entries", 100000),
+        )
+    return engine
@@ -1,4 +1,10 @@
+import logging
+import os
+import tempfile
 from abc import ABC, abstractmethod
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
 
 class STTEngine(ABC):
     """
@@ -12,6 +18,92 @@ class STTEngine(ABC):
         将指定的 WAV 音频文件转换为文本。
 
         :param wav_file_path: 输入的 WAV 文件的路径。
+        :return: 识别出的文本内容，没有语音时为空字符串。
+        :raises Exception: 识别出错时抛出，不能用空字符串表示失败，否则片段会被当作噪声删除。
+        """
+        pass
+
+    @property
+    def model_id(self) -> str:
+        """
+        模型及解码参数的标识，用作识别结果缓存键的一部分。
+        更换模型或修改解码参数的引擎应返回不同的值，以免命中旧结果。
+        """
+        return type(self).__name__
+
+    async def warmup(self):
+        """
+        预热模型，在服务开始接受音频前执行一次推理，避免首个片段承担初始化开销。
+        默认不做任何事情。
+        """
+        pass
+
+    async def transcribe_bytes(self, wav_data: bytes) -> str:
+        """
+        将内存中的 WAV 数据转换为文本。
+        默认实现写入临时文件后调用 transcribe；能直接接受内存数据的引擎可以覆盖此方法。
+
+        :param wav_data: 完整的 WAV 文件内容。
         :return: 识别出的文本内容。
         """
-        pass
\ No newline at end of file
+        # 在 Windows 上，我们需要先关闭文件，然后才能让另一个进程（如 ffmpeg）读取它。
+        # 因此，我们不能在 'with' 块内调用 transcribe。这种修改方式对 Linux 和 macOS 也是安全的。
+        temp_wav_path = None
+        try:
+            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_f:
+                temp_f.write(wav_data)
+                temp_wav_path = temp_f.name
+            return await self.transcribe(temp_wav_path)
+        finally:
+            if temp_wav_path and os.path.exists(temp_wav_path):
+                try:
+                    os.remove(temp_wav_path)
+                except OSError as e:
+                    logger.error(f"删除临时文件失败: {temp_wav_path}", exc_info=e)
+
+
+class StreamingSession(ABC):
+    """
+    一次流式识别会话，对应一个语音片段。
+    feed 只负责缓冲，推理在后台进行；新的中间结果通过 on_partial 回调通知。
+    """
+
+    def __init__(self, on_partial: Optional[Callable[[str], None]] = None):
+        self.on_partial = on_partial
+        # 由调用方设置，用于把中间结果和最终记录对应起来
+        self.segment_id: Optional[str] = None
+
+    @abstractmethod
+    def feed(self, pcm: bytes):
+        """
+        送入一段 16kHz 16-bit 单声道 PCM。不阻塞，可以在 VAD 循环中直接调用。
+        """
+        pass
+
+    @abstractmethod
+    async def finish(self) -> str:
+        """
+        片段结束：处理剩余音频并返回最终文本。
+        识别失败时返回空字符串，记录以 pending 状态入库，由 STT 队列重新识别整段音频。
+        """
+        pass
+
+    def cancel(self):
+        """放弃会话（例如连接断开），释放后台资源。"""
+        pass
+
+
+class StreamingSTTEngine(STTEngine):
+    """
+    支持流式识别的 STT 引擎。
+    说话过程中即可产生中间结果，片段结束时只需处理最后一小段音频。
+    仍需实现 transcribe，用于 STT 队列中的离线识别。
+    """
+
+    @abstractmethod
+    def create_session(self, on_partial: Optional[Callable[[str], None]] = None) -> StreamingSession:
+        """
+        为一个新的语音片段创建流式识别会话。
+        :param on_partial: 中间结果更新时的回调，参数为当前的完整中间文本
+        """
+        pass
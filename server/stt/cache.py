@@ -0,0 +1,167 @@
+"""
+以音频内容哈希为键的识别结果缓存。
+
+键为 sha256(归一化 PCM + 模型标识)，模型标识包含解码参数，因此更换模型或参数后不会命中旧结果。
+两级缓存：进程内的 LRU 字典，以及持久化在 SQLite stt_cache 表中的结果（按最近使用时间淘汰）。
+重新识别任务、断线重传的音频以及反复出现的相同噪声片段都可以直接命中缓存。
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import threading
+import wave
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from database import get_db_connection
+from metrics import STT_CACHE_REQUESTS, STT_CACHE_ENTRIES
+from .base import STTEngine
+
+logger = logging.getLogger(__name__)
+
+
+def _normalized_pcm(wav_data: bytes) -> bytes:
+    """
+    提取 WAV 中的 PCM 数据并统一为单声道 16-bit，使 WAV 头部的差异（如元数据块）不影响缓存键。
+    """
+    with wave.open(io.BytesIO(wav_data), "rb") as wf:
+        channels, sample_width, sample_rate = wf.getnchannels(), wf.getsampwidth(), wf.getframerate()
+        frames = wf.readframes(wf.getnframes())
+    if sample_width != 2 or channels != 1:
+        import numpy as np
+        dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[sample_width]
+        samples = np.frombuffer(frames, dtype=dtype).reshape(-1, channels)[:, 0].astype(np.int32)
+        if sample_width == 1:
+            samples = (samples - 128) << 8
+        elif sample_width == 4:
+            samples >>= 16
+        frames = samples.astype(np.int16).tobytes()
+    return sample_rate.to_bytes(4, "little") + frames
+
+
+class CachedSTTEngine(STTEngine):
+    """
+    在任意 STTEngine 前面加一层识别结果缓存。
+    只缓存非空结果；引擎出错时抛出异常，不会进入缓存。
+    """
+
+    def __init__(self, engine: STTEngine, memory_entries: int = 256, max_entries: int = 100000):
+        self.engine = engine
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts_since_evict = 0
+        self._memory_hit = STT_CACHE_REQUESTS.labels("memory_hit")
+        self._disk_hit = STT_CACHE_REQUESTS.labels("disk_hit")
+        self._miss = STT_CACHE_REQUESTS.labels("miss")
+        STT_CACHE_ENTRIES.labels("memory").set_function(lambda: len(self._memory))
+        STT_CACHE_ENTRIES.labels("disk").set_function(self.entry_count)
+
+    @property
+    def model_id(self) -> str:
+        return self.engine.model_id
+
+    def cache_key(self, wav_data: bytes) -> str:
+        digest = hashlib.sha256(_normalized_pcm(wav_data))
+        digest.update(b"\0" + self.engine.model_id.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+            return text
+
+    def _memory_put(self, key: str, text: str):
+        with self._lock:
+            self._memory[key] = text
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT transcription FROM stt_cache WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute("UPDATE stt_cache SET last_used_at = ? WHERE key = ?", (datetime.utcnow().isoformat(), key))
+            conn.commit()
+            return row['transcription']
+
+    def _disk_put(self, key: str, text: str):
+        now = datetime.utcnow().isoformat()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO stt_cache (key, model_id, transcription, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (key, self.engine.model_id, text, now, now)
+            )
+            self._inserts_since_evict += 1
+            # 每写入一定数量再检查一次容量，避免每次写入都统计全表
+            if self._inserts_since_evict >= max(self.max_entries // 100, 1):
+                self._inserts_since_evict = 0
+                self._evict(cursor)
+            conn.commit()
+
+    def _evict(self, cursor):
+        cursor.execute("SELECT COUNT(*) FROM stt_cache")
+        excess = cursor.fetchone()[0] - self.max_entries
+        if excess > 0:
+            cursor.execute(
+                "DELETE FROM stt_cache WHERE key IN (SELECT key FROM stt_cache ORDER BY last_used_at LIMIT ?)",
+                (excess,)
+            )
+            logger.info(f"Evicted {excess} entries from the STT cache.")
+
+    def entry_count(self) -> int:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM stt_cache")
+            return cursor.fetchone()[0]
+
+    async def transcribe_bytes(self, wav_data: bytes) -> str:
+        try:
+            key = self.cache_key(wav_data)
+        except (wave.Error, EOFError, KeyError) as e:
+            logger.warning(f"Could not compute STT cache key, bypassing cache: {e}")
+            return await self.engine.transcribe_bytes(wav_data)
+
+        text = self._memory_get(key)
+        if text is not None:
+            self._memory_hit.inc()
+            return text
+
+        text = await asyncio.to_thread(self._disk_get, key)
+        if text is not None:
+            self._disk_hit.inc()
+            self._memory_put(key, text)
+            return text
+
+        self._miss.inc()
+        text = await self.engine.transcribe_bytes(wav_data)
+        if text:
+            # 只缓存非空结果：空文本可能是一次性的识别问题，重试和重新识别时应再次调用引擎
+            self._memory_put(key, text)
+            try:
+                await asyncio.to_thread(self._disk_put, key, text)
+            except Exception as e:
+                logger.warning(f"Failed to persist STT cache entry: {e}")
+        return text
+
+    async def transcribe(self, wav_file_path: str) -> str:
+        with open(wav_file_path, "rb") as f:
+            wav_data = f.read()
+        return await self.transcribe_bytes(wav_data)
+
+    async def warmup(self):
+        # 预热必须真正执行推理，不经过缓存
+        await self.engine.warmup()
@@ -1,6 +1,7 @@
 import asyncio
 import logging
-from .base import STTEngine
+from .base import STTEngine, StreamingSTTEngine, StreamingSession
+from .streaming import BufferedStreamingSession
 
 logger = logging.getLogger(__name__)
 
@@ -29,4 +30,27 @@ class DummySTTEngine(STTEngine):
         await asyncio.sleep(0.1)
         result = "这是一个来自虚拟 STT 引擎的测试结果。"
         logger.info(f"DummySTTEngine 返回结果: {result}")
-        return result
\ No newline at end of file
+        return result
+
+class DummyStreamingSession(BufferedStreamingSession):
+    """每秒音频输出一个中间结果，结束时返回固定文本。"""
+
+    def __init__(self, on_partial=None):
+        super().__init__(16000 * 2, on_partial)
+        self._seconds = 0
+
+    async def _infer(self, chunk: bytes, is_final: bool) -> str:
+        await asyncio.sleep(0.01)
+        if is_final:
+            return "这是一个来自虚拟流式 STT 引擎的测试结果。"
+        self._seconds += 1
+        return f"[{self._seconds}s]"
+
+
+class DummyStreamingSTTEngine(DummySTTEngine, StreamingSTTEngine):
+    """
+    虚拟的流式 STT 引擎，用于在没有模型的环境中测试中间结果推送。
+    """
+
+    def create_session(self, on_partial=None) -> StreamingSession:
+        return DummyStreamingSession(on_partial)
@@ -1,5 +1,8 @@
 import logging
 import asyncio
+import io
+import json
+import wave
 from .base import STTEngine
 from funasr import AutoModel
 from funasr.utils.postprocess_utils import rich_transcription_postprocess
@@ -14,18 +17,41 @@ class FunasrEngine(STTEngine):
     这是一个本地 STT 实现
     """
 
+    MODEL_DIR = "iic/SenseVoiceSmall"
+    # 解码参数，同时参与识别结果缓存的键
+    GENERATE_KWARGS = {
+        "language": "auto",  # "zn", "en", "yue", "ja", "ko", "nospeech"
+        "use_itn": True,
+        "batch_size_s": 60,
+        "merge_vad": True,
+        "merge_length_s": 15,
+    }
+
     def __init__(
         self,
         model_name="",
     ):
-        model_dir = "iic/SenseVoiceSmall"
         self.model = AutoModel(
-            model=model_dir,
+            model=self.MODEL_DIR,
             vad_model="fsmn-vad",
             vad_kwargs={"max_single_segment_time": 30000},
             device="cpu",
         )
 
+    @property
+    def model_id(self) -> str:
+        return f"funasr:{self.MODEL_DIR}+fsmn-vad:{json.dumps(self.GENERATE_KWARGS, sort_keys=True)}"
+
+    async def warmup(self):
+        """用 1 秒静音跑一次完整推理，触发模型和 fsmn-vad 的惰性初始化。"""
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(16000)
+            wf.writeframes(b"\x00\x00" * 16000)
+        await self.transcribe_bytes(buffer.getvalue())
+
     async def transcribe(self, wav_file_path: str) -> str:
         try:
             # 将阻塞的同步模型推理放入线程池中运行，避免阻塞事件循环
@@ -33,14 +59,12 @@ class FunasrEngine(STTEngine):
                 self.model.generate,
                 input=wav_file_path,
                 cache={},
-                language="auto",  # "zn", "en", "yue", "ja", "ko", "nospeech"
-                use_itn=True,
-                batch_size_s=60,
-                merge_vad=True,
-                merge_length_s=15,
+                **self.GENERATE_KWARGS,
             )
-            text = rich_transcription_postprocess(res[0]["text"])
+            # 没有检测到语音时 FunASR 可能返回空列表
+            text = rich_transcription_postprocess(res[0]["text"]) if res else ""
             return text
         except Exception:
+            # 识别出错时抛出异常，由调用方重试；空文本只表示没有语音
             logger.error(f"语音识别失败: {wav_file_path}", exc_info=True)
-            return ""
+            raise
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import wave
+from typing import Callable, Optional
+
+import numpy as np
+from funasr import AutoModel
+
+from .base import StreamingSTTEngine, StreamingSession
+from .streaming import BufferedStreamingSession
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# paraformer 流式模型的块配置: [0, 10, 5] 表示每块 600ms，向后看 300ms
+CHUNK_SIZE = [0, 10, 5]
+CHUNK_SAMPLES = CHUNK_SIZE[1] * 960
+ENCODER_CHUNK_LOOK_BACK = 4
+DECODER_CHUNK_LOOK_BACK = 1
+
+
+class FunasrStreamingSession(BufferedStreamingSession):
+    def __init__(self, engine: "FunasrStreamingEngine", on_partial: Optional[Callable[[str], None]] = None):
+        super().__init__(CHUNK_SAMPLES * 2, on_partial)
+        self.engine = engine
+        self._cache = {}
+
+    async def _infer(self, chunk: bytes, is_final: bool) -> str:
+        return await asyncio.to_thread(self.engine._generate, chunk, self._cache, is_final)
+
+
+class FunasrStreamingEngine(StreamingSTTEngine):
+    """
+    使用 FunASR paraformer-zh-streaming 的流式识别引擎。
+    说话过程中每 600ms 输出一次中间结果；片段结束时只需识别最后不足一块的音频。
+    """
+
+    def __init__(self, config: dict = None):
+        config = config or {}
+        self.model_name = config.get("streaming_model", "paraformer-zh-streaming")
+        self.model = AutoModel(
+            model=self.model_name,
+            device="cpu",
+            disable_update=True,
+        )
+
+    @property
+    def model_id(self) -> str:
+        return (
+            f"funasr_streaming:{self.model_name}:chunk={CHUNK_SIZE}:"
+            f"look_back={ENCODER_CHUNK_LOOK_BACK},{DECODER_CHUNK_LOOK_BACK}"
+        )
+
+    def _generate(self, chunk: bytes, cache: dict, is_final: bool) -> str:
+        speech = np.frombuffer(chunk, dtype=np.int16).astype(np.float32) / 32768.0
+        res = self.model.generate(
+            input=speech,
+            cache=cache,
+            is_final=is_final,
+            chunk_size=CHUNK_SIZE,
+            encoder_chunk_look_back=ENCODER_CHUNK_LOOK_BACK,
+            decoder_chunk_look_back=DECODER_CHUNK_LOOK_BACK,
+        )
+        return res[0]["text"] if res else ""
+
+    def _transcribe_pcm(self, pcm: bytes) -> str:
+        cache = {}
+        chunk_bytes = CHUNK_SAMPLES * 2
+        starts = range(0, max(len(pcm), 1), chunk_bytes)
+        text = ""
+        for index, offset in enumerate(starts):
+            text += self._generate(pcm[offset:offset + chunk_bytes], cache, index == len(starts) - 1)
+        return text
+
+    def create_session(self, on_partial: Optional[Callable[[str], None]] = None) -> StreamingSession:
+        return FunasrStreamingSession(self, on_partial)
+
+    async def warmup(self):
+        await asyncio.to_thread(self._transcribe_pcm, b"\x00\x00" * SAMPLE_RATE)
+
+    async def transcribe(self, wav_file_path: str) -> str:
+        try:
+            with wave.open(wav_file_path, "rb") as wf:
+                pcm = wf.readframes(wf.getnframes())
+            return await asyncio.to_thread(self._transcribe_pcm, pcm)
+        except Exception:
+            logger.error(f"语音识别失败: {wav_file_path}", exc_info=True)
+            raise
@@ -0,0 +1,252 @@
+"""
+持久化的 STT 识别队列。
+
+语音片段保存后，记录和识别任务 (stt_jobs) 在同一事务中写入数据库，记录的识别状态为 pending；
+队列的后台工作协程按先后顺序识别并回填记录。服务重启后，未完成的任务会自动继续，
+因此录音高峰期可以全速摄取，STT 积压稍后再慢慢消化，不会丢失任何片段。
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+from database import get_db_connection
+from events import broker, RECORD_UPDATED
+from metrics import STT_INFERENCE
+from storage import StorageBackend
+from .base import STTEngine
+from .schedule import TranscriptionSchedule
+
+logger = logging.getLogger(__name__)
+
+# 与实时识别写入的置信度保持一致，STT 引擎目前不返回置信度
+DEFAULT_CONFIDENCE = 0.9
+# 内存中暂存的最多片段数，超过后改为从存储后端读取音频
+MAX_CACHED_AUDIO = 64
+
+
+def _read_all(stream) -> bytes:
+    try:
+        return stream.read()
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+        if hasattr(stream, 'release_conn'):
+            stream.release_conn()
+
+
+class TranscriptionQueue:
+    """
+    基于 SQLite stt_jobs 表的识别队列，单个后台协程顺序消费。
+    每个任务开始前都会询问调度策略，负载高或不在识别时间段内时推迟识别。
+    """
+
+    def __init__(
+        self,
+        storage: StorageBackend,
+        max_attempts: int = 3,
+        schedule: Optional[TranscriptionSchedule] = None,
+    ):
+        self.stt_engine: Optional[STTEngine] = None # 模型加载完成后由 start 设置
+        self.storage = storage
+        self.max_attempts = max_attempts
+        self.schedule = schedule or TranscriptionSchedule()
+        self.paused_reason: Optional[str] = None # 当前被调度策略推迟的原因
+        self._stt_metric = None
+        # 刚保存的片段的 WAV 数据，避免识别时再从存储读取一遍
+        self._audio_cache: Dict[str, bytes] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, stt_engine: STTEngine):
+        """
+        STT 模型就绪后启动后台工作协程。上次运行中被中断的任务 (running) 会重新排队。
+        启动前提交的任务已保存在数据库中，启动后会按顺序识别。
+        """
+        self.stt_engine = stt_engine
+        # 启用缓存时按被缓存的引擎打标签
+        self._stt_metric = STT_INFERENCE.labels(type(getattr(stt_engine, "engine", stt_engine)).__name__)
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE stt_jobs SET status = 'pending', updated_at = ? WHERE status = 'running'",
+                (datetime.utcnow().isoformat(),)
+            )
+            conn.commit()
+        pending = self.depth()
+        if pending:
+            logger.info(f"Resuming {pending} unfinished transcription jobs.")
+        self._task = asyncio.create_task(self._worker())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def submit(self, record_id: str, wav_data: Optional[bytes] = None):
+        """
+        通知队列有新的任务。任务本身已由 add_record 写入数据库。
+        :param wav_data: 可选的 WAV 数据，提供时识别不再读取存储后端
+        """
+        if wav_data is not None and len(self._audio_cache) < MAX_CACHED_AUDIO:
+            self._audio_cache[record_id] = wav_data
+        self._wakeup.set()
+
+    def depth(self) -> int:
+        """等待或正在识别的任务数量。"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM stt_jobs WHERE status IN ('pending', 'running')")
+            return cursor.fetchone()[0]
+
+    def oldest_pending_age(self) -> Optional[float]:
+        """最早的未完成任务已等待的秒数，没有积压时返回 None。"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MIN(created_at) FROM stt_jobs WHERE status IN ('pending', 'running')")
+            oldest = cursor.fetchone()[0]
+        if oldest is None:
+            return None
+        return (datetime.utcnow() - datetime.fromisoformat(oldest)).total_seconds()
+
+    def status(self) -> dict:
+        """队列状态，用于 /api/stt/queue。"""
+        return {
+            "engine_ready": self.stt_engine is not None,
+            "depth": self.depth(),
+            "oldest_pending_age_seconds": self.oldest_pending_age(),
+            "schedule_mode": self.schedule.mode,
+            "paused_reason": self.paused_reason,
+        }
+
+    async def _wait_for_schedule(self):
+        """按调度策略等待，直到允许识别。"""
+        while True:
+            backlog_age = await asyncio.to_thread(self.oldest_pending_age)
+            if backlog_age is None:
+                # 没有积压，交给 _claim_next 返回空并等待新任务
+                return
+            allowed, reason = self.schedule.check(backlog_age)
+            if allowed:
+                if self.paused_reason is not None:
+                    logger.info(f"Resuming transcription: {reason}.")
+                self.paused_reason = None
+                return
+            if self.paused_reason is None:
+                logger.info(f"Deferring transcription: {reason}.")
+            self.paused_reason = reason
+            await asyncio.sleep(self.schedule.check_interval_seconds)
+
+    def _claim_next(self) -> Optional[dict]:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, record_id, audio_url, attempts FROM stt_jobs WHERE status = 'pending' ORDER BY id LIMIT 1"
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                "UPDATE stt_jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (datetime.utcnow().isoformat(), row['id'])
+            )
+            conn.commit()
+        job = dict(row)
+        job['attempts'] += 1
+        return job
+
+    def _complete(self, job: dict, transcript: str):
+        now = datetime.utcnow().isoformat()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE records SET transcription = ?, confidence = ?, transcription_status = 'done', updated_at = ?
+                WHERE id = ?
+                """,
+                (transcript, DEFAULT_CONFIDENCE, now, job['record_id'])
+            )
+            cursor.execute("DELETE FROM stt_jobs WHERE id = ?", (job['id'],))
+            conn.commit()
+        broker.publish(RECORD_UPDATED, {
+            "ids": [job['record_id']],
+            "transcription": transcript,
+            "confidence": DEFAULT_CONFIDENCE,
+            "transcription_status": "done",
+        })
+
+    def _fail(self, job: dict, error: str):
+        now = datetime.utcnow().isoformat()
+        give_up = job['attempts'] >= self.max_attempts
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE stt_jobs SET status = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                ("failed" if give_up else "pending", error, now, job['id'])
+            )
+            if give_up:
+                cursor.execute(
+                    "UPDATE records SET transcription_status = 'failed', updated_at = ? WHERE id = ?",
+                    (now, job['record_id'])
+                )
+            conn.commit()
+        if give_up:
+            logger.error(f"Transcription of record {job['record_id']} failed {job['attempts']} times, giving up: {error}")
+            broker.publish(RECORD_UPDATED, {"ids": [job['record_id']], "transcription_status": "failed"})
+        else:
+            logger.warning(f"Transcription of record {job['record_id']} failed (attempt {job['attempts']}): {error}")
+
+    def _discard(self, job: dict):
+        """没有识别出文本的片段（噪声、呼吸声等）不保留，与之前不生成记录的行为一致。"""
+        from records import delete_record
+        logger.info(f"No transcript for record {job['record_id']}, deleting it.")
+        try:
+            delete_record(job['record_id'], self.storage)
+        except Exception as e:
+            # 记录可能已被用户删除
+            logger.warning(f"Could not delete record {job['record_id']} without transcript: {e}")
+
+    async def _load_audio(self, job: dict) -> bytes:
+        wav_data = self._audio_cache.pop(job['record_id'], None)
+        if wav_data is not None:
+            return wav_data
+        stream = await asyncio.to_thread(self.storage.get_stream, job['audio_url'])
+        if stream is None:
+            raise FileNotFoundError(f"Audio not found: {job['audio_url']}")
+        return await asyncio.to_thread(_read_all, stream)
+
+    async def _process(self, job: dict):
+        try:
+            wav_data = await self._load_audio(job)
+            with self._stt_metric.time():
+                transcript = await self.stt_engine.transcribe_bytes(wav_data)
+        except Exception as e:
+            # 引擎出错时抛出异常，按 max_attempts 重试；只有正常返回的空文本才表示没有语音
+            await asyncio.to_thread(self._fail, job, str(e) or type(e).__name__)
+            return
+
+        logger.info(f"STT 识别结果: {transcript}")
+        if transcript:
+            await asyncio.to_thread(self._complete, job, transcript)
+        else:
+            await asyncio.to_thread(self._discard, job)
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self._wait_for_schedule()
+                job = await asyncio.to_thread(self._claim_next)
+            except Exception:
+                logger.error("Failed to fetch transcription job", exc_info=True)
+                job = None
+
+            if job is None:
+                # 队列已空，缓存中剩下的是已被删除的记录的音频
+                self._audio_cache.clear()
+                await self._wakeup.wait()
+                continue
+
+            try:
+                await self._process(job)
+            except Exception:
+                logger.error(f"Unexpected error while transcribing record {job['record_id']}", exc_info=True)
@@ -0,0 +1,92 @@
+"""
+STT 队列的调度策略。
+
+录音摄取只做 VAD 和保存音频，识别何时进行由策略决定：
+- immediate: 有任务就立即识别（默认）
+- adaptive: 只在 CPU 有余量且事件循环延迟较低时识别，负载高时推迟
+- window: 只在配置的时间段内识别，例如 "07:00-09:00"（上海时间）
+任何模式下，积压任务等待超过 max_backlog_age_hours 时都会强制开始识别，避免积压无限增长。
+"""
+import os
+from dataclasses import dataclass
+from datetime import datetime, time
+from typing import Callable, Optional, Tuple
+
+import pytz
+
+SCHEDULE_MODES = ("immediate", "adaptive", "window")
+
+
+def _parse_window(window: str) -> Tuple[time, time]:
+    start, end = (part.strip() for part in window.split("-"))
+    return time.fromisoformat(start), time.fromisoformat(end)
+
+
+@dataclass
+class TranscriptionSchedule:
+    mode: str = "immediate"
+    window: str = "07:00-09:00"
+    max_load_per_cpu: float = 0.7 # 1 分钟平均负载 / CPU 核数
+    max_loop_lag_ms: float = 100.0
+    max_backlog_age_hours: Optional[float] = None
+    check_interval_seconds: float = 30.0
+
+    def __post_init__(self):
+        if self.mode not in SCHEDULE_MODES:
+            raise ValueError(f"无效的 STT 调度模式: '{self.mode}'。有效选项为: {list(SCHEDULE_MODES)}")
+        self._window = _parse_window(self.window)
+        self._loop_lag: Callable[[], float] = lambda: 0.0
+
+    @classmethod
+    def from_config(cls, config: dict) -> "TranscriptionSchedule":
+        """从 .config.yaml 的 stt.schedule 配置段创建调度策略。"""
+        known = {k: v for k, v in (config or {}).items() if k in cls.__dataclass_fields__}
+        return cls(**known)
+
+    def bind_loop_lag(self, loop_lag: Callable[[], float]):
+        """设置读取当前事件循环延迟（秒）的函数，通常为 LoopLagMonitor.current_lag。"""
+        self._loop_lag = loop_lag
+
+    def _in_window(self, now: datetime) -> bool:
+        start, end = self._window
+        current = now.time()
+        if start <= end:
+            return start <= current < end
+        # 跨越午夜的时间段，例如 "23:00-01:00"
+        return current >= start or current < end
+
+    @staticmethod
+    def _load_per_cpu() -> Optional[float]:
+        if not hasattr(os, "getloadavg"):
+            return None
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+    def check(self, backlog_age: Optional[float]) -> Tuple[bool, str]:
+        """
+        判断此刻是否允许进行识别。
+        :param backlog_age: 最早的未完成任务已等待的秒数，没有任务时为 None
+        :return: (是否允许, 原因)
+        """
+        if self.mode == "immediate":
+            return True, "immediate"
+
+        if (
+            self.max_backlog_age_hours is not None
+            and backlog_age is not None
+            and backlog_age >= self.max_backlog_age_hours * 3600
+        ):
+            return True, "backlog too old"
+
+        if self.mode == "window":
+            now = datetime.now(pytz.timezone("Asia/Shanghai"))
+            if self._in_window(now):
+                return True, f"inside window {self.window}"
+            return False, f"outside window {self.window}"
+
+        lag_ms = self._loop_lag() * 1000
+        if lag_ms > self.max_loop_lag_ms:
+            return False, f"event loop lag {lag_ms:.0f} ms"
+        load = self._load_per_cpu()
+        if load is not None and load > self.max_load_per_cpu:
+            return False, f"load {load:.2f} per CPU"
+        return True, "CPU headroom available"
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from abc import abstractmethod
+from typing import Callable, Optional
+
+from .base import StreamingSession
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedStreamingSession(StreamingSession):
+    """
+    按固定块大小推理的流式会话。
+    feed 把 PCM 攒成 chunk_bytes 大小的块放入队列，由一个后台任务依次调用 _infer，
+    因此 VAD 循环不会等待模型推理。子类只需实现 _infer。
+    """
+
+    def __init__(self, chunk_bytes: int, on_partial: Optional[Callable[[str], None]] = None):
+        super().__init__(on_partial)
+        self.chunk_bytes = chunk_bytes
+        self.text = ""
+        self.failed = False # 有音频块识别失败，text 不完整
+        self._pending = bytearray()
+        self._chunks: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    @abstractmethod
+    async def _infer(self, chunk: bytes, is_final: bool) -> str:
+        """
+        识别一个音频块，返回本块新增的文本。
+        :param is_final: 是否为片段的最后一块，流式模型需要据此输出剩余结果
+        """
+        pass
+
+    async def _run(self):
+        while True:
+            chunk, is_final = await self._chunks.get()
+            try:
+                delta = await self._infer(chunk, is_final)
+            except Exception:
+                logger.error("流式识别失败", exc_info=True)
+                self.failed = True
+                delta = ""
+            if delta:
+                self.text += delta
+                if self.on_partial and not is_final:
+                    self.on_partial(self.text)
+            if is_final:
+                return
+
+    def _enqueue(self, chunk: bytes, is_final: bool):
+        self._chunks.put_nowait((chunk, is_final))
+
+    def feed(self, pcm: bytes):
+        self._pending.extend(pcm)
+        while len(self._pending) >= self.chunk_bytes:
+            self._enqueue(bytes(self._pending[:self.chunk_bytes]), False)
+            del self._pending[:self.chunk_bytes]
+
+    async def finish(self) -> str:
+        self._enqueue(bytes(self._pending), True)
+        self._pending.clear()
+        await self._task
+        # 部分音频块识别失败时不返回不完整的文本，记录交给 STT 队列重新识别整段音频
+        return "" if self.failed else self.text
+
+    def cancel(self):
+        self._task.cancel()
@@ -0,0 +1,115 @@
+"""
+语音片段合并。
+
+梦话常常是断断续续的几句，VAD 会把它们切成很多很短的片段，每个片段单独保存、单独识别，
+存储对象和 STT 调用的固定开销都按片段数计算。这里在 VAD 之后、保存和识别之前，
+把间隔小于 max_gap 的相邻片段（连同中间的音频）合并成一条记录，合并后的长度不超过 max_bytes。
+合并记录保留每个子片段在音频中的位置。
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+
+@dataclass
+class SpeechPart:
+    """VAD 切出的一个片段"""
+    pcm: bytes
+    timestamp: datetime # 片段结束时的时间
+    end_time: float # 检测到片段结束时的 perf_counter 值
+    prefix_bytes: int = 0 # pcm 开头来自语音开始前历史缓冲区的字节数
+    transcript: str = ""
+    segment_id: Optional[str] = None # 流式识别会话的片段 ID
+
+
+@dataclass
+class CoalescedSegment:
+    """一个或多个片段合并后的音频，spans 为每个子片段在 pcm 中的 (起始字节, 字节数)"""
+    pcm: bytearray
+    parts: List[SpeechPart] = field(default_factory=list)
+    spans: List[Tuple[int, int]] = field(default_factory=list)
+
+    @classmethod
+    def start(cls, part: SpeechPart) -> "CoalescedSegment":
+        return cls(bytearray(part.pcm), [part], [(0, len(part.pcm))])
+
+    @property
+    def timestamp(self) -> datetime:
+        return self.parts[-1].timestamp
+
+    @property
+    def end_time(self) -> float:
+        return self.parts[-1].end_time
+
+    @property
+    def transcript(self) -> str:
+        """各子片段的流式识别文本；任一子片段没有文本（识别失败）时为空，整段交给 STT 队列识别。"""
+        if not all(part.transcript for part in self.parts):
+            return ""
+        return " ".join(part.transcript for part in self.parts)
+
+    def offsets(self, sample_rate: int) -> List[dict]:
+        """子片段相对记录音频开头的位置（秒）"""
+        bytes_per_second = sample_rate * 2
+        return [
+            {"offset": round(start / bytes_per_second, 3), "duration": round(length / bytes_per_second, 3)}
+            for start, length in self.spans
+        ]
+
+
+class SegmentCoalescer:
+    """
+    暂存最近的片段，直到之后的静音超过 max_gap 或合并长度将超过上限时才交出。
+    :param max_gap_bytes: 可以合并的最大间隔（PCM 字节数）
+    :param max_bytes: 合并后音频的最大长度（PCM 字节数）
+    """
+
+    def __init__(self, max_gap_bytes: int, max_bytes: int):
+        self.max_gap_bytes = max_gap_bytes
+        self.max_bytes = max_bytes
+        self._pending: Optional[CoalescedSegment] = None
+        # 暂存片段之后、下一个片段之前的音频，合并时用于填补间隔
+        self._gap = bytearray()
+
+    def add(self, part: SpeechPart) -> Optional[CoalescedSegment]:
+        """
+        加入一个片段，能合并时并入暂存的片段。
+        :return: 因长度超限无法合并而交出的上一个合并片段
+        """
+        done = None
+        if self._pending is not None:
+            # 片段开头的前缀与间隔的末尾是同一段音频；间隔比前缀短时，前缀还会与上一个片段的结尾重叠
+            gap = self._gap[:max(len(self._gap) - part.prefix_bytes, 0)]
+            pcm = part.pcm[max(part.prefix_bytes - len(self._gap), 0):]
+            if len(self._pending.pcm) + len(gap) + len(pcm) <= self.max_bytes:
+                self._pending.pcm.extend(gap)
+                self._pending.spans.append((len(self._pending.pcm), len(pcm)))
+                self._pending.pcm.extend(pcm)
+                self._pending.parts.append(part)
+                self._gap.clear()
+                return None
+            done = self.take()
+        self._pending = CoalescedSegment.start(part)
+        return done
+
+    def add_gap(self, chunk: bytes) -> Optional[CoalescedSegment]:
+        """
+        记录片段之间（未在说话时）的音频。
+        :return: 间隔达到 max_gap 时交出暂存的片段
+        """
+        if self._pending is None:
+            return None
+        self._gap.extend(chunk)
+        if len(self._gap) >= self.max_gap_bytes:
+            return self.take()
+        return None
+
+    def take(self) -> Optional[CoalescedSegment]:
+        """交出暂存的片段（音频流结束时调用），之后的间隔音频不再需要。"""
+        pending, self._pending = self._pending, None
+        self._gap.clear()
+        return pending
+
+    def clear(self):
+        self._pending = None
+        self._gap.clear()
@@ -1,20 +1,36 @@
+import asyncio
 import torch
 import numpy as np
-from typing import Callable, Coroutine
+from typing import Callable, Coroutine, List, Optional
 import logging
 from silero_vad import VADIterator, load_silero_vad
-import os
 import io
-import tempfile
-from datetime import datetime
+from datetime import datetime, timedelta
 import wave
+import time
+import uuid
 import pytz # 导入 pytz 库
-from stt import STTEngine
+from stt import StreamingSTTEngine
+from stt.base import StreamingSession
+from stt.queue import TranscriptionQueue, DEFAULT_CONFIDENCE
+from events import broker, RECORD_PARTIAL
 from schemas import SleepRecordCreate
 from storage import StorageBackend
+from waveform import compute_peaks, SAMPLES_PER_PEAK
+from vad.coalescer import CoalescedSegment, SegmentCoalescer, SpeechPart
+from metrics import (
+    AUDIO_CHUNKS,
+    VAD_INFERENCE,
+    SPEECH_SEGMENTS,
+    SEGMENT_TO_RECORD,
+    STORAGE_SAVE,
+    COALESCE_SAVED,
+)
 
 logger = logging.getLogger(__name__)
 
+SHANGHAI_TZ = pytz.timezone("Asia/Shanghai")
+
 
 class VadWrapper:
     """
@@ -26,7 +42,7 @@ class VadWrapper:
         self,
         model,
         on_speech_end: Callable[[SleepRecordCreate], Coroutine],
-        stt_engine: STTEngine,
+        transcription_queue: TranscriptionQueue,
         storage_backend: StorageBackend,
         sample_rate: int = 16000,
         chunk_samples: int = 512,
@@ -34,6 +50,11 @@ class VadWrapper:
         speech_prefix_ms: int = 500, # 用于设置语音开始前缀的毫秒数
         threshold: float = 0.5,
         min_silence_duration_ms: int = 100, # 新增 VAD 参数
+        streaming_engine: Optional[StreamingSTTEngine] = None,
+        capture_start: Optional[datetime] = None,
+        device_id: Optional[str] = None,
+        coalesce_gap_ms: int = 0, # 间隔小于该值的相邻片段合并成一条记录，0 表示不合并
+        coalesce_max_ms: int = 30000, # 合并后片段的最大时长
     ):
         # VAD 模型相关参数
         self.SAMPLE_RATE = sample_rate
@@ -44,10 +65,15 @@ class VadWrapper:
         self.THRESHOLD = threshold
 
         self.storage = storage_backend
+        self._storage_save_metric = STORAGE_SAVE.labels(type(storage_backend).__name__)
 
         # 当检测到语音片段结束时调用的异步回调函数
         self._on_speech_end = on_speech_end
-        self.stt_engine = stt_engine
+        self.transcription_queue = transcription_queue
+        # 流式识别引擎：说话过程中就开始识别并推送中间结果，未设置时由 STT 队列在片段结束后识别
+        self.streaming_engine = streaming_engine
+        self._stream_session: Optional[StreamingSession] = None
+        self._streamed_bytes = 0 # 当前片段中已送入流式会话的字节数
 
         # 初始化 VAD 迭代器
         self.vad_iterator = VADIterator(
@@ -68,8 +94,50 @@ class VadWrapper:
 
         # 用于存储当前正在检测的语音数据
         self._speech_buffer = bytearray()
+        # 当前片段开头来自历史缓冲区的字节数，合并片段时用于去掉与间隔重复的音频
+        self._prefix_bytes = 0
+        bytes_per_ms = self.SAMPLE_RATE // 1000 * 2
+        self._coalescer = (
+            SegmentCoalescer(coalesce_gap_ms * bytes_per_ms, coalesce_max_ms * bytes_per_ms)
+            if coalesce_gap_ms > 0 else None
+        )
         # 标记当前是否处于说话状态
         self._is_speaking = False
+        # 已送入 VAD 的采样数，用于定位片段在流中的位置
+        self._samples_processed = 0
+        # 回放客户端缓存的音频时，第一个采样的采集时间；设置后片段时间戳按采样位置推算，而不是使用接收时间
+        self.capture_start = capture_start
+        self.device_id = device_id # 写入记录的采集设备
+        # 由 VadEngine 设置，close 时把模型实例交还模型池
+        self._release_model: Optional[Callable] = None
+
+    def _stream_time(self) -> datetime:
+        """当前处理位置对应的时间（上海时间）。"""
+        if self.capture_start is None:
+            return datetime.now(SHANGHAI_TZ)
+        return self.capture_start + timedelta(seconds=self._samples_processed / self.SAMPLE_RATE)
+
+    def _start_stream_session(self, timestamp: datetime):
+        """语音开始时创建流式识别会话，中间结果通过事件推送给 UI（不入库）。"""
+        segment_id = str(uuid.uuid4())
+
+        def on_partial(text: str):
+            broker.publish(RECORD_PARTIAL, {
+                "segment_id": segment_id,
+                "timestamp": timestamp.isoformat(),
+                "text": text,
+                "final": False,
+            }, transient=True)
+
+        self._stream_session = self.streaming_engine.create_session(on_partial)
+        self._stream_session.segment_id = segment_id
+        self._streamed_bytes = 0
+
+    def _feed_stream_session(self):
+        """把语音缓冲区中尚未送出的部分送入流式会话。"""
+        if self._stream_session is not None and len(self._speech_buffer) > self._streamed_bytes:
+            self._stream_session.feed(bytes(self._speech_buffer[self._streamed_bytes:]))
+            self._streamed_bytes = len(self._speech_buffer)
 
     def _create_wav_bytes(self, audio_bytes: bytes) -> bytes:
         """将 PCM 数据封装为 WAV 格式的 bytes。"""
@@ -81,27 +149,117 @@ class VadWrapper:
             wf.writeframes(audio_bytes)
         return buffer.getvalue()
 
-    def _save_audio(self, audio_bytes: bytes) -> str | None:
+    def _save_audio(self, wav_data: bytes, timestamp: Optional[datetime] = None) -> str | None:
         """
         将音频数据保存到存储后端。
+        :param timestamp: 片段的时间，决定保存路径；默认为当前时间
         :return: 成功则返回文件标识符 (如相对路径或 Object Key)，失败返回 None。
         """
-        shanghai_tz = pytz.timezone("Asia/Shanghai")
-        now_shanghai = datetime.now(shanghai_tz)
+        now_shanghai = timestamp or datetime.now(SHANGHAI_TZ)
         today_str = now_shanghai.strftime("%Y-%m-%d")
         filename = now_shanghai.strftime("%Y%m%d_%H%M%S_%f") + ".wav"
         # 统一使用 "日期/文件名" 的结构作为 key
         relative_path = f"{today_str}/{filename}"
 
         try:
-            wav_data = self._create_wav_bytes(audio_bytes)
-            saved_path = self.storage.save(wav_data, relative_path)
+            with self._storage_save_metric.time():
+                saved_path = self.storage.save(wav_data, relative_path)
             logger.info(f"语音片段已保存至存储后端: {saved_path}")
             return saved_path
         except Exception:
             logger.error("保存音频文件失败", exc_info=True)
             return None
 
+    async def _handle_segment(
+        self,
+        speech_data: bytes,
+        timestamp: datetime,
+        segment_end_time: float,
+        stream_session: Optional[StreamingSession] = None,
+    ):
+        """
+        处理一个完整的语音片段。使用流式识别时，结束会话即得到最终文本。
+        开启片段合并时先暂存，与之后间隔很短的片段合并成一条记录；否则直接保存。
+        :param speech_data: 片段的 PCM 数据
+        :param timestamp: 记录的时间戳
+        :param segment_end_time: 检测到片段结束时的 perf_counter 值，用于统计延迟
+        :param stream_session: 该片段的流式识别会话
+        """
+        transcript = await stream_session.finish() if stream_session is not None else ""
+        part = SpeechPart(
+            pcm=speech_data,
+            timestamp=timestamp,
+            end_time=segment_end_time,
+            prefix_bytes=self._prefix_bytes,
+            transcript=transcript,
+            segment_id=stream_session.segment_id if stream_session is not None else None,
+        )
+        if self._coalescer is None:
+            await self._save_segment(CoalescedSegment.start(part))
+            return
+        done = self._coalescer.add(part)
+        if done is not None:
+            await self._save_segment(done)
+
+    async def _save_segment(self, segment: CoalescedSegment):
+        """
+        保存（合并后的）片段：保存音频，通过回调生成记录。
+        有识别文本时直接写入；否则生成等待识别的记录，交给 STT 队列识别。
+        """
+        speech_data = bytes(segment.pcm)
+        timestamp = segment.timestamp
+        transcript = segment.transcript
+
+        wav_data = self._create_wav_bytes(speech_data)
+        saved_path = self._save_audio(wav_data, timestamp)
+        if not saved_path:
+            return
+
+        # 16-bit PCM = 2 bytes per sample
+        duration_seconds = len(speech_data) / (self.SAMPLE_RATE * 2)
+        # PCM 仍在内存中，顺便计算波形峰值，避免之后再从存储读取整段音频
+        peaks = compute_peaks(np.frombuffer(speech_data, dtype=np.int16))
+        merged = len(segment.parts) > 1
+        record_data = SleepRecordCreate(
+            timestamp=timestamp.isoformat(), # 使用上海时间
+            duration=round(duration_seconds, 2),
+            audio_url=saved_path,  # 这里存储的是 StorageBackend 返回的路径/Key
+            # 流式识别没有结果时（或识别失败）仍交给 STT 队列，由离线识别决定是否保留
+            transcription=transcript,
+            confidence=DEFAULT_CONFIDENCE if transcript else 0.0,
+            tags=[],  # 标签可以后续通过分析 transcription 生成
+            peaks=peaks,
+            samples_per_peak=SAMPLES_PER_PEAK,
+            transcription_status="done" if transcript else "pending",
+            device_id=self.device_id,
+            segments=segment.offsets(self.SAMPLE_RATE) if merged else None,
+        )
+        record_id = await self._on_speech_end(record_data)
+        SEGMENT_TO_RECORD.observe(time.perf_counter() - segment.end_time)
+        for part in segment.parts:
+            if part.segment_id is not None:
+                # 通知 UI 中间结果已结束，并给出对应的记录 ID
+                broker.publish(RECORD_PARTIAL, {
+                    "segment_id": part.segment_id,
+                    "timestamp": part.timestamp.isoformat(),
+                    "text": part.transcript,
+                    "final": True,
+                    "record_id": record_id,
+                }, transient=True)
+        submitted = bool(record_id and not transcript and self.transcription_queue)
+        if submitted:
+            self.transcription_queue.submit(record_id, wav_data)
+
+        if merged and record_id:
+            saved = len(segment.parts) - 1
+            COALESCE_SAVED.labels("storage_object").inc(saved)
+            if submitted:
+                COALESCE_SAVED.labels("stt_call").inc(saved)
+            logger.info(
+                f"合并了 {len(segment.parts)} 个语音片段 ({duration_seconds:.1f}s)，"
+                f"节省 {saved} 个存储对象{'和 STT 调用' if submitted else ''}。"
+            )
+
     async def process(self, audio_bytes: bytes):
         """
         处理从客户端流式传输过来的音频数据块。
@@ -110,10 +268,8 @@ class VadWrapper:
         try:
             self._incoming_buffer.extend(audio_bytes)
 
-            shanghai_tz = pytz.timezone("Asia/Shanghai")
-            now_shanghai = datetime.now(shanghai_tz)
-
             while len(self._incoming_buffer) >= self.CHUNK_BYTES:
+                now_shanghai = self._stream_time()
                 chunk = self._incoming_buffer[: self.CHUNK_BYTES]
                 del self._incoming_buffer[: self.CHUNK_BYTES]
 
@@ -125,75 +281,78 @@ class VadWrapper:
                 audio_tensor = (
                     torch.from_numpy(np.frombuffer(chunk, dtype=np.int16)).float() / 32768.0
                 )
-                speech_dict = self.vad_iterator(audio_tensor)
+                with VAD_INFERENCE.time():
+                    speech_dict = self.vad_iterator(audio_tensor)
+                AUDIO_CHUNKS.inc()
+                self._samples_processed += self.CHUNK_SAMPLES
 
                 if speech_dict:
                     if "start" in speech_dict:
                         if not self._is_speaking:
                             logger.debug("检测到语音开始")
                             self._is_speaking = True
+                            self._prefix_bytes = len(self._history_buffer) - len(chunk) # 不含当前块
                             self._speech_buffer.extend(self._history_buffer)
                             self._history_buffer.clear()
+                            if self.streaming_engine is not None:
+                                self._start_stream_session(now_shanghai)
 
                     if "end" in speech_dict:
                         if self._is_speaking:
                             self._is_speaking = False
+                            segment_end_time = time.perf_counter()
+                            SPEECH_SEGMENTS.inc()
                             self._speech_buffer.extend(chunk)
                             logger.debug(
                                 f"检测到语音结束，片段大小: {len(self._speech_buffer)} 字节。"
                             )
+                            self._feed_stream_session()
                             speech_data = bytes(self._speech_buffer)
-                            saved_path = self._save_audio(speech_data)
-
-                            if saved_path and self.stt_engine:
-                                # STT 需要一个本地文件路径。即使我们使用 MinIO，
-                                # 也创建一个临时文件供 STT 引擎读取，处理完后自动删除。
-                                # 在 Windows 上，我们需要先关闭文件，然后才能让另一个进程（如 ffmpeg）读取它。
-                                # 因此，我们不能在 'with' 块内调用 transcribe。这种修改方式对 Linux 和 macOS 也是安全的。
-                                transcript = ""
-                                temp_wav_path = None
-                                try:
-                                    # 1. 创建一个临时文件，但不立即删除
-                                    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_f:
-                                        wav_data = self._create_wav_bytes(speech_data)
-                                        temp_f.write(wav_data)
-                                        temp_wav_path = temp_f.name
-                                    
-                                    # 2. 文件已关闭，现在路径可以安全地传递给 STT 引擎
-                                    if temp_wav_path:
-                                        transcript = await self.stt_engine.transcribe(temp_wav_path)
-                                finally:
-                                    # 3. 手动删除临时文件
-                                    if temp_wav_path and os.path.exists(temp_wav_path):
-                                        try:
-                                            os.remove(temp_wav_path)
-                                        except OSError as e:
-                                            logger.error(f"删除临时文件失败: {temp_wav_path}", exc_info=e)
-
-                                logger.info(f"STT 识别结果: {transcript}")
-                                if transcript:
-                                    # 16-bit PCM = 2 bytes per sample
-                                    duration_seconds = len(speech_data) / (self.SAMPLE_RATE * 2)
-                                    record_data = SleepRecordCreate(
-                                        timestamp=now_shanghai.isoformat(), # 使用上海时间
-                                        duration=round(duration_seconds, 2),
-                                        audio_url=saved_path,  # 这里存储的是 StorageBackend 返回的路径/Key
-                                        transcription=transcript,
-                                        confidence=0.9, # FIXME: 临时写死
-                                        tags=[]  # 标签可以后续通过分析 transcription 生成
-                                    )
-                                    await self._on_speech_end(record_data)
                             self._speech_buffer.clear()
+                            stream_session, self._stream_session = self._stream_session, None
+                            await self._handle_segment(speech_data, now_shanghai, segment_end_time, stream_session)
                             # HACK: 禁用 reset_states 以允许 silero VAD 在内部管理语音填充。
                             # 重新启用此功能将导致语音过早终止。
                             # self.vad_iterator.reset_states()
 
                 if self._is_speaking:
                     self._speech_buffer.extend(chunk)
+                    self._feed_stream_session()
+                elif self._coalescer is not None and not (speech_dict and "end" in speech_dict):
+                    # 片段之间的音频，间隔足够长时交出暂存的片段
+                    done = self._coalescer.add_gap(chunk)
+                    if done is not None:
+                        await self._save_segment(done)
         except Exception:
             logger.error("处理音频流时发生意外错误", exc_info=True)
+            # 暂存待合并的片段已经检测完毕，重置前先保存，不随错误丢弃
+            await self.save_pending()
             self.reset()
 
+    async def flush(self):
+        """音频流结束时，把仍在进行中的语音作为一个片段处理。"""
+        if self._is_speaking and self._speech_buffer:
+            self._is_speaking = False
+            SPEECH_SEGMENTS.inc()
+            self._feed_stream_session()
+            speech_data = bytes(self._speech_buffer)
+            self._speech_buffer.clear()
+            stream_session, self._stream_session = self._stream_session, None
+            await self._handle_segment(speech_data, self._stream_time(), time.perf_counter(), stream_session)
+        await self.save_pending()
+
+    async def save_pending(self):
+        """保存合并器中暂存的片段。reset 会丢弃暂存的片段，重置前（包括出错时）应先调用。"""
+        if self._coalescer is None:
+            return
+        pending = self._coalescer.take()
+        if pending is None:
+            return
+        try:
+            await self._save_segment(pending)
+        except Exception:
+            logger.error("保存暂存的语音片段失败", exc_info=True)
+
     def reset(self):
         """为新的音频流重置 VAD 状态，清空所有缓冲区。"""
         self.vad_iterator.reset_states()
@@ -201,6 +360,19 @@ class VadWrapper:
         self._history_buffer.clear()
         self._speech_buffer.clear()
         self._is_speaking = False
+        self._samples_processed = 0
+        if self._coalescer is not None:
+            self._coalescer.clear()
+        if self._stream_session is not None:
+            self._stream_session.cancel()
+            self._stream_session = None
+
+    def close(self):
+        """音频流彻底结束（连接断开或会话过期）时调用，释放 VAD 状态，之后不能再使用该实例。"""
+        self.reset()
+        if self._release_model is not None:
+            release, self._release_model = self._release_model, None
+            release(self.vad_iterator.model)
 
 
 class VadEngine:
@@ -213,24 +385,69 @@ class VadEngine:
         logger.info("正在加载 Silero VAD 模型...")
         self.model = load_silero_vad()
         self.vad_config = vad_config if vad_config is not None else {}
+        # Silero 模型带有 RNN 状态，reset_states 也作用于整个模型，因此每个音频流独占一个模型实例；
+        # 流结束后实例放回池中，供之后的连接复用
+        self._idle_models: List = [self.model]
         logger.info("Silero VAD 模型加载成功。")
 
-    def get_vad_wrapper(
+    def _warmup_model(self, model, iterations: int):
+        chunk_samples = self.vad_config.get("chunk_samples", 512)
+        silence = torch.zeros(chunk_samples)
+        with torch.no_grad():
+            for _ in range(iterations):
+                model(silence, self.vad_config.get("sample_rate", 16000))
+        model.reset_states()
+
+    def warmup(self, iterations: int = 3):
+        """对静音执行几次推理，完成 TorchScript 的首次优化，之后重置模型状态。"""
+        self._warmup_model(self.model, iterations)
+
+    def _load_model(self):
+        model = load_silero_vad()
+        self._warmup_model(model, 1)
+        return model
+
+    async def _acquire_model(self):
+        """
+        取一个空闲的模型实例，同时在线的流多于已加载的实例时加载一个新的。
+        加载和预热需要数百毫秒，在线程中进行，不阻塞其他连接的音频处理。
+        """
+        if self._idle_models:
+            return self._idle_models.pop()
+        model = await asyncio.to_thread(self._load_model)
+        logger.info("已为新的音频流加载一个 Silero VAD 模型实例。")
+        return model
+
+    def _release_model(self, model):
+        model.reset_states()
+        self._idle_models.append(model)
+
+    async def get_vad_wrapper(
         self,
         on_speech_end: Callable[[SleepRecordCreate], Coroutine],
-        stt_engine: STTEngine,
-        storage_backend: StorageBackend
+        transcription_queue: TranscriptionQueue,
+        storage_backend: StorageBackend,
+        streaming_engine: Optional[StreamingSTTEngine] = None,
+        device_id: Optional[str] = None,
+        vad_overrides: Optional[dict] = None,
     ):
         """
-        为每个客户端连接创建一个新的 VadWrapper 实例。
-        :param on_speech_end: 语音片段结束时的回调函数
-        :param stt_engine: STT 引擎实例
+        为每个客户端连接创建一个新的 VadWrapper 实例，使用独占的模型实例。流结束时需调用 VadWrapper.close 归还。
+        :param on_speech_end: 语音片段结束时的回调函数，返回新记录的 ID
+        :param transcription_queue: STT 识别队列
+        :param streaming_engine: 可选的流式 STT 引擎
         :param storage_backend: 存储后端实例
+        :param device_id: 连接的采集设备
+        :param vad_overrides: 该设备覆盖的 VAD 参数
         """
-        return VadWrapper(
-            self.model,
+        wrapper = VadWrapper(
+            await self._acquire_model(),
             on_speech_end,
-            stt_engine=stt_engine,
+            transcription_queue=transcription_queue,
             storage_backend=storage_backend,
-            **self.vad_config,
+            streaming_engine=streaming_engine,
+            device_id=device_id,
+            **{**self.vad_config, **(vad_overrides or {})},
         )
+        wrapper._release_model = self._release_model
+        return wrapper
@@ -0,0 +1,198 @@
+"""
+离线 VAD 回放与参数调优工具。
+
+不经过 WebSocket，直接以最快速度把 WAV 文件送入 VadWrapper，
+在多个进程中并行扫描参数网格，报告每组参数检测到的片段、片段边界和实时率 (RTF)。
+既可作为 VAD 路径的吞吐量基准，也可以在几分钟内选出 .config.yaml 中的 vad 参数。
+未扫描的参数取 .config.yaml 中 vad 段的值（--ignore-config 时使用 VadWrapper 的默认值），
+因此不指定任何参数时得到的就是生产配置下的基线。
+
+用法:
+    python vad_replay.py night.wav more_recordings/ \\
+        --threshold 0.3,0.4,0.5 --min-silence-duration-ms 500,1000 \\
+        --speech-pad-ms 250,500 --speech-prefix-ms 500 --workers 4
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import load_config
+
+SAMPLE_RATE = 16000
+# 每次送入 VadWrapper 的字节数；回放时不受网络消息大小限制，取较大的块以减少调用开销
+FEED_BYTES = SAMPLE_RATE * 2
+
+# 可扫描的参数及其类型，对应 VadWrapper 的构造参数和 .config.yaml 中的 vad 配置
+GRID_PARAMS = {
+    "threshold": float,
+    "min_silence_duration_ms": int,
+    "speech_pad_ms": int,
+    "speech_prefix_ms": int,
+}
+
+_model = None
+
+
+def _init_worker():
+    """每个工作进程只加载一次 Silero 模型，并限制 torch 只使用单线程，以便进程间并行。"""
+    global _model
+    import torch
+    from silero_vad import load_silero_vad
+    torch.set_num_threads(1)
+    _model = load_silero_vad()
+
+
+def load_pcm(path: str) -> np.ndarray:
+    with wave.open(path, "rb") as wf:
+        if wf.getframerate() != SAMPLE_RATE or wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: 需要 16kHz、16-bit PCM 的 WAV 文件")
+        channels = wf.getnchannels()
+        pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    return pcm[::channels] if channels > 1 else pcm
+
+
+@dataclass
+class ReplayResult:
+    params: Dict
+    file: str
+    audio_seconds: float
+    processing_seconds: float
+    segments: List[Tuple[float, float]] = field(default_factory=list) # (开始秒, 结束秒)
+
+    @property
+    def rtf(self) -> float:
+        """实时率：处理耗时 / 音频时长，越小越快。"""
+        return self.processing_seconds / self.audio_seconds if self.audio_seconds else 0.0
+
+
+def segment_pcm(params: Dict, pcm: np.ndarray, base_params: Optional[Dict] = None) -> Tuple[List[Tuple[float, float]], float]:
+    """
+    用当前进程中加载的模型对一段 PCM 做 VAD，返回片段边界（秒）和处理耗时。
+    调用前需要先执行 _init_worker。
+    :param base_params: 未扫描的参数（通常为 .config.yaml 中的 vad 段），params 覆盖其中的同名参数
+    """
+    from vad.engine import VadWrapper
+
+    class ReplayVadWrapper(VadWrapper):
+        """只记录片段边界，不保存音频也不进行 STT。"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.segments: List[Tuple[int, int]] = []
+
+        async def _handle_segment(self, speech_data: bytes, timestamp: datetime, segment_end_time: float, stream_session=None):
+            end = self._samples_processed
+            self.segments.append((end - len(speech_data) // 2, end))
+
+    wrapper = ReplayVadWrapper(_model, on_speech_end=None, transcription_queue=None, storage_backend=None, **{**(base_params or {}), **params})
+    data = pcm.tobytes()
+
+    async def run():
+        for offset in range(0, len(data), FEED_BYTES):
+            await wrapper.process(data[offset:offset + FEED_BYTES])
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    return [(max(s, 0) / SAMPLE_RATE, e / SAMPLE_RATE) for s, e in wrapper.segments], elapsed
+
+
+def _replay(params: Dict, path: str, base_params: Dict) -> ReplayResult:
+    pcm = load_pcm(path)
+    segments, elapsed = segment_pcm(params, pcm, base_params)
+    return ReplayResult(
+        params=params,
+        file=path,
+        audio_seconds=len(pcm) / SAMPLE_RATE,
+        processing_seconds=elapsed,
+        segments=segments,
+    )
+
+
+def _collect_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(".wav"))
+        else:
+            files.append(path)
+    return files
+
+
+def _parameter_grid(args) -> List[Dict]:
+    axes = {}
+    for name, cast in GRID_PARAMS.items():
+        value = getattr(args, name)
+        if value is not None:
+            axes[name] = [cast(v) for v in value.split(",")]
+    names = list(axes)
+    return [dict(zip(names, combo)) for combo in itertools.product(*axes.values())]
+
+
+def summarize(results: List[ReplayResult]):
+    by_params: Dict[str, List[ReplayResult]] = {}
+    for result in results:
+        by_params.setdefault(json.dumps(result.params, sort_keys=True), []).append(result)
+
+    header = f"{'params':<80} {'segments':>8} {'speech_s':>9} {'mean_len':>8} {'rtf':>8}"
+    print(header)
+    print("-" * len(header))
+    for key, group in sorted(by_params.items()):
+        segments = [seg for r in group for seg in r.segments]
+        speech = sum(e - s for s, e in segments)
+        audio = sum(r.audio_seconds for r in group)
+        processing = sum(r.processing_seconds for r in group)
+        mean_len = speech / len(segments) if segments else 0.0
+        print(f"{key:<80} {len(segments):>8} {speech:>9.1f} {mean_len:>8.2f} {processing / audio if audio else 0:>8.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线回放 WAV 文件，扫描 VAD 参数")
+    parser.add_argument("paths", nargs="+", help="WAV 文件或包含 WAV 文件的目录")
+    parser.add_argument("--threshold", default=None, help="逗号分隔的取值，例如 0.3,0.4,0.5")
+    parser.add_argument("--min-silence-duration-ms", dest="min_silence_duration_ms", default=None)
+    parser.add_argument("--speech-pad-ms", dest="speech_pad_ms", default=None)
+    parser.add_argument("--speech-prefix-ms", dest="speech_prefix_ms", default=None)
+    parser.add_argument("--ignore-config", action="store_true", help="未扫描的参数使用 VadWrapper 的默认值，而不是 .config.yaml 中的 vad 配置")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="并行的进程数")
+    parser.add_argument("--boundaries", action="store_true", help="输出每个文件的片段边界")
+    parser.add_argument("--json", dest="json_path", default=None, help="将完整结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    files = _collect_files(args.paths)
+    grid = _parameter_grid(args) or [{}]
+    base_params = {} if args.ignore_config else load_config().get("vad", {})
+    jobs = [(params, path, base_params) for params in grid for path in files]
+    print(f"{len(files)} 个文件 × {len(grid)} 组参数 = {len(jobs)} 个任务，使用 {args.workers} 个进程。")
+    print(f"基础参数: {json.dumps(base_params, sort_keys=True) if base_params else 'VadWrapper 默认值'}")
+
+    wall_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as executor:
+        results = list(executor.map(_replay, *zip(*jobs)))
+    wall = time.perf_counter() - wall_start
+
+    if args.boundaries:
+        for result in results:
+            print(f"{result.file} {json.dumps(result.params, sort_keys=True)}")
+            for start, end in result.segments:
+                print(f"    {start:9.2f}s - {end:9.2f}s ({end - start:.2f}s)")
+        print()
+
+    summarize(results)
+    total_audio = sum(r.audio_seconds for r in results)
+    print(f"\n共处理 {total_audio:.0f}s 音频，耗时 {wall:.1f}s，整体吞吐为实时的 {total_audio / wall:.0f} 倍。")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump([dict(asdict(r), rtf=r.rtf) for r in results], f, ensure_ascii=False, indent=2)
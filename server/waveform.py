@@ -0,0 +1,64 @@
+import io
+import logging
+import wave
+from typing import Optional, Tuple
+
+import numpy as np
+
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# 每个峰值点覆盖的采样数：16kHz 下 160 个采样即 10ms，每秒 100 个峰值点
+SAMPLES_PER_PEAK = 160
+
+
+def compute_peaks(pcm: np.ndarray, samples_per_peak: int = SAMPLES_PER_PEAK) -> bytes:
+    """
+    计算 16-bit PCM 的波形峰值。
+    按 samples_per_peak 分箱后取每箱的最小值和最大值，量化为 int8，
+    返回 [min0, max0, min1, max1, ...] 交错排列的二进制数据。
+    """
+    if pcm.size == 0:
+        return b""
+    n_bins = -(-pcm.size // samples_per_peak)
+    pad = n_bins * samples_per_peak - pcm.size
+    if pad:
+        # 用最后一个采样值填充，避免影响最后一箱的极值
+        pcm = np.pad(pcm, (0, pad), mode="edge")
+    frames = pcm.reshape(n_bins, samples_per_peak)
+
+    peaks = np.empty((n_bins, 2), dtype=np.int8)
+    peaks[:, 0] = frames.min(axis=1) >> 8
+    peaks[:, 1] = frames.max(axis=1) >> 8
+    return peaks.tobytes()
+
+
+def compute_peaks_from_wav(wav_data: bytes, samples_per_peak: int = SAMPLES_PER_PEAK) -> bytes:
+    """从 WAV 文件内容计算波形峰值（多声道时取第一个声道）。"""
+    with wave.open(io.BytesIO(wav_data), "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"Unsupported sample width: {wf.getsampwidth()}")
+        channels = wf.getnchannels()
+        frames = wf.readframes(wf.getnframes())
+    pcm = np.frombuffer(frames, dtype=np.int16)
+    if channels > 1:
+        pcm = pcm[::channels]
+    return compute_peaks(pcm, samples_per_peak)
+
+
+def get_peaks_by_record_id(record_id: str) -> Optional[Tuple[bytes, int]]:
+    """
+    获取记录的波形峰值。
+    :return: (峰值数据, 每个峰值点的采样数)，不存在时返回 None
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT peaks, samples_per_peak FROM record_peaks WHERE record_id = ?",
+            (record_id,)
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return row['peaks'], row['samples_per_peak']